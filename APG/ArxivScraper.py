@@ -1,44 +1,61 @@
 import requests
-from bs4 import BeautifulSoup
-import random
-import time
-import io
-from fp.fp import FreeProxyException
-from requests.exceptions import ProxyError, ConnectionError
-from urllib3.exceptions import MaxRetryError
+import urllib3
+from lxml import etree
 import os
 import json
+import time
 
+from APG.DuplicateFilter import DuplicateFilter
 from APG.FileGatherer import FileGatherer
+from APG.FileWriter import FileWriter
 from APG.Headers import Headers
+from APG.Journal import Journal
+from APG.MetadataStore import MetadataStore
+from APG.Metrics import Metrics
+from APG.NearDuplicateIndex import NearDuplicateIndex
 from APG.Proxies import Proxies
+from APG.ResponseCache import ResponseCache
+from APG.RetryPolicy import RetryPolicy
+from APG.Sessions import Sessions
 from APG.FileFilterer import FileFilterer
 
 
 class ArxivScraper:
+    api_url = "http://export.arxiv.org/api/query"  # Where API pages are requested from
+    max_page_size = 2000  # The most results arXiv returns for one API call
+    max_total_results = 30000  # The most results arXiv pages through for one query
+    atom = "{http://www.w3.org/2005/Atom}"
+    opensearch = "{http://a9.com/-/spec/opensearch/1.1/}"
+    feed_total = None  # How many results the last feed parsed says its query has, or None if it did not say
 
-    # Grab all available results on a specified page
-        # @param soup_object : A BeautifulSoup response object
-        # @param page_max : The maximum number of results on this page
-    def __get_results_from_page(self, soup_object: BeautifulSoup, page_max: int):
-        arxiv_results = []
-        for element in soup_object.select("entry"):
+    # Parse the entries of an Atom feed from the ArXiv API as they arrive, without building the whole document
+    # Each entry is cleared once read, so memory stays flat however many results the feed holds
+    # The total number of results the feed's query has, which comes before the entries, is kept in feed_total
+        # @param source : A file-like object (such as a streamed response body) or path holding the feed
+    def parse_feed(self, source):
+        self.feed_total = None
+        for _, element in etree.iterparse(source, events=("end",),
+                                          tag=(f"{self.atom}entry", f"{self.opensearch}totalResults")):
+            if element.tag == f"{self.opensearch}totalResults":
+                self.feed_total = int(element.text) if (element.text or "").strip().isdigit() else None
+                continue
             # Get title, author list, direct PDF link, modification date, and abstract for each result
-            title = element.select_one('title')
-            authors = [author.text for author in element.select('author > name')]
-            link = element.select_one('id')
-            mod_date = element.select_one('updated')
-            abstract = element.select_one('summary')
-
-            # Then append them to a dictionary
-            arxiv_results.append({
-                "title": title.text if title else "No title",
+            title = element.findtext(f"{self.atom}title")
+            authors = [name.text or "" for name in element.iterfind(f"{self.atom}author/{self.atom}name")]
+            link = element.findtext(f"{self.atom}id")
+            mod_date = element.findtext(f"{self.atom}updated")
+            abstract = element.findtext(f"{self.atom}summary")
+            yield {
+                "title": title if title is not None else "No title",
                 "authors": ", ".join(authors) if authors else "No authors",
-                "link": link.text.replace("abs", "pdf") if link else None,
-                "mod_date": mod_date.text[:7] if mod_date else None,
-                "abstract": abstract.text if abstract else None
-            })
-        return arxiv_results
+                "link": link.replace("abs", "pdf") if link else None,
+                "mod_date": mod_date[:7] if mod_date else None,
+                "abstract": abstract
+            }
+            # Free the entry and every entry before it, which the parser would otherwise keep attached to the feed
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
 
     # Craft a URL for the desired query, specifying the starting result and number to grab
     # This allows for an iterative approach to result gathering
@@ -46,90 +63,181 @@ class ArxivScraper:
         # @param start : The starting index for results on the page
         # @param num : The number of results to include on this page
     def __build_url(self, query: str, start: int, num: int):
-        base = "http://export.arxiv.org/api/query?"  # Base api query url
         query = query.replace(" ", "+")
-        return f"{base}search_query={query}&start={start}&max_results={num}"
+        return f"{self.api_url}?search_query={query}&start={start}&max_results={num}"
+
+    # Request a page of results from the ArXiv API, streaming the response so it can be parsed as it arrives
+    # Returns the response, or None if it could not be fetched
+        # @param url : The API URL of the page
+    def __request_page(self, url: str):
+        headers_to_use = Headers().get_rand_header()
+        # The rate budget for the ArXiv API ensures compliance with its one request per 3 seconds limit, and
+        #   throttled or failed requests are retried with backoff
+        response = RetryPolicy().get(url, headers_to_use, stream=True)
+
+        # Attempt to resolve bad responses through the best working proxies
+        if response is None or response.status_code != 200:
+            status_code = response.status_code if response is not None else "none"
+            if response is not None:
+                response.close()
+            response = Proxies().request(url, headers_to_use, stream=True)
+            if response is None:
+                print(f"\nRequest to '{url}' failed with status code {status_code} and no working proxy could "
+                      f"fetch it", flush=True)
+                return None
+        response.raw.decode_content = True  # Let urllib3 undo any gzip encoding while the parser reads
+        return response
 
-    # Method that attempts to fetch content from a URL and will retry if failed, with a delay each time
+    # Parse the results of a streamed page, closing the response once done
+    # A page cut off part way still gives every entry that arrived whole
+    # The time spent receiving and parsing the page is recorded, leaving out time the caller spends between results
+        # @param response : The streamed response, as returned by __request_page
+    def __read_page(self, response: requests.Response):
+        busy = 0.0
+        start = time.perf_counter()
+        try:
+            for result in self.parse_feed(response.raw):
+                busy += time.perf_counter() - start
+                yield result
+                start = time.perf_counter()
+        except (etree.XMLSyntaxError, requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as e:
+            print(f"\nArXiv response ended early: {e}", flush=True)
+        finally:
+            response.close()
+            Metrics.observe("arxiv_page", busy + time.perf_counter() - start)
+
+    # Method that attempts to fetch content from a URL and will retry if failed, backing off as RetryPolicy decides
+    # Requests go through the response cache, so URLs that recently failed are skipped right away
         # @param url : The URl to fetch from
         # @param print_index : The index used for printing status
-        # @param max_tries : The maximum number of times to try a request
-    def __fetch(self, url: str, print_index: int, max_tries=2):
-        for _ in range(max_tries):
+        # @param max_tries : The maximum number of times to try a request - None uses the retry policy's budget
+    def __fetch(self, url: str, print_index: int, max_tries: int or None = None):
+        def send():
             try:
-                delay = random.uniform(2, 5)
-                time.sleep(delay)
-                headers_to_use = Headers().get_rand_header_modern()
-                response = requests.get(url, headers=headers_to_use, timeout=10)
-                if response.status_code == 200:
-                    return response
-                elif response.status_code == 403:
-                    print(f"\rProcessing files at index {print_index}... Request blocked")
+                response = ResponseCache().get(url, Headers().get_rand_header_modern(), pdf_only=True)
             except requests.exceptions.RequestException as e:
                 print(f"\rProcessing files at index {print_index}... Request failed on attempt: {e}")
-        return None
+                raise
+            if response is not None and response.status_code == 403:
+                print(f"\rProcessing files at index {print_index}... Request blocked")
+            return response
 
-    # Iteratively gather a set number of results for the desired query
+        response = RetryPolicy().run(url, send, max_tries, remember_failure=True)
+        if response is not None and response.status_code != 200:
+            response.close()
+            return None
+        return response
+
+    # Iteratively gather a set number of results for the desired query, yielding each result as it is parsed
+    # Pages are as large as arXiv allows, so large queries take a few requests rather than hundreds
+    # arXiv sometimes answers with an empty page before the end of the results, so an empty page is asked for once
+    #   more unless the feed's total shows the query has no more results
         # @param query : The arXiv search query
-        # @param total_results : The total number of results to gather
-        # @param num : The number of results on each page - default is 10
-    def scrape_results(self, query: str, total_results: int, num: int = 10):
-        arXiv_results = []
+        # @param total_results : The total number of results to gather - at most max_total_results
+        # @param num : The number of results on each page - default is as many as arXiv allows
+    def iter_results(self, query: str, total_results: int, num: int or None = None):
+        if total_results > self.max_total_results:
+            print(f"\nArXiv only pages through {self.max_total_results} results per query, so only that many "
+                  f"will be gathered.", flush=True)
+            total_results = self.max_total_results
+        num = min(num or self.max_page_size, self.max_page_size)
         start = 0
+        retried = False
         while start < total_results:
-            print(f"\rGetting ArXiv results {start}-{start + num - 1}", end="", flush=True)
-            url = self.__build_url(query, start, num)
-            session = requests.Session()
-            headers_to_use = Headers().get_rand_header()
-            session.headers = headers_to_use
-            response = session.get(url)
-
-            # Attempt to resolve bad responses
-            if response.status_code != 200:
-                try:
-                    selected_proxy = Proxies().get_python_proxy()  # Use pypi proxies
-                except FreeProxyException:  # If none are available
-                    selected_proxy = Proxies().get_rand_proxy()  # Use proxifly instead
-                try:
-                    response = session.get(url, proxies=selected_proxy)
-                except (ProxyError, ConnectionRefusedError, ConnectionError, MaxRetryError):
-                    print(f"\nConnection to {url} could not be established.\nAborting.", flush=True)
-                    exit(-1)
-                if response.status_code != 200:
-                    print(f"\nRequest to '{url}' failed with status code {response.status_code} "
-                          f"and proxy '{selected_proxy}'", flush=True)
-                    continue
+            page_size = min(num, total_results - start)
+            print(f"\rGetting ArXiv results {start}-{start + page_size - 1}", end="", flush=True)
+            response = self.__request_page(self.__build_url(query, start, page_size))
+            if response is None:
+                # Stop here rather than ask for the same page again, so the results of earlier pages are still saved
+                print(f"\nArXiv results could not be fetched. Stopping before result {start}.", flush=True)
+                return
+            received = 0
+            for result in self.__read_page(response):
+                received += 1
+                yield result
+            if self.feed_total is not None:  # Never ask for results past the end of the query
+                total_results = min(total_results, self.feed_total)
+            if received == 0:
+                if start >= total_results:  # The query has no more results
+                    break
+                if retried:
+                    print(f"\nArXiv returned no results twice. Stopping before result {start}.", flush=True)
+                    break
+                retried = True
+                continue
+            retried = False
+            start += received
 
-            soup = BeautifulSoup(response.text, features="xml")
-            page_results = self.__get_results_from_page(soup, num)
-            arXiv_results.extend(page_results)
-            start += num
-            # Add delays to scraping to ensure API compliance
-            delay = random.uniform(3, 7)
-            time.sleep(delay)
-        print(f"\rScraping ArXiv complete for all {total_results} results", flush=True)
+    # Iteratively gather a set number of results for the desired query
+        # @param query : The arXiv search query
+        # @param total_results : The total number of results to gather
+        # @param num : The number of results on each page - default is as many as arXiv allows
+    def scrape_results(self, query: str, total_results: int, num: int or None = None):
+        arXiv_results = list(self.iter_results(query, total_results, num))
+        print(f"\rScraping ArXiv complete for all {len(arXiv_results)} results", flush=True)
         return arXiv_results
 
-    def gather_files(self, results: list, query: str, path_to_directory: str, meta_can_be_missing: bool):
-        result_index = 1
-        print_index = 0
-        for result in results:  # Iterate over results
-            print_index += 1
-            print(f"\rProcessing ArXiv files at index {print_index}...", end="", flush=True)
-
-            url = result['link']
-            if url is None:
-                # No link for this index
-                continue
+    # Fetch the PDF of a single result and check it against the query
+    # Returns the (file, filter_result, digest) entries gathered, as FileGatherer.process_result does
+        # @param gatherer : The FileGatherer that reads the download and keeps count of what happened
+        # @param result : A single scraped result from ArXiv
+        # @param query : The arXiv search query
+        # @param meta_can_be_missing : Boolean toggle that determines if absent title and author is acceptable
+        # @param print_index : The index used for printing status
+    def process_result(self, gatherer: FileGatherer, result: dict, query: str, meta_can_be_missing: bool,
+                       print_index: int):
+        gathered = []
+        url = result['link']
+        if url is not None:  # Some results have no link
             response = self.__fetch(url, print_index)
+            body = gatherer.read_body(response, True) if response else None  # Streams the PDF only
             if not response:
                 print(f"\nFailed to fetch {url}")
-                continue
+            elif body is None:
+                print(f"\nSkipping {url} (not a valid PDF or too large)")
+            else:
+                gathered.append(gatherer.check_file(body[1], body[2], lambda f: FileFilterer().arxiv_filter(
+                    f, result, query, meta_can_be_missing)))
+        return gathered
 
-            pdf_file_obj = io.BytesIO(response.content)
-            filter_result = FileFilterer().arxiv_filter(pdf_file_obj, result, query, meta_can_be_missing)
-            result_index = FileGatherer().handle_file_result(response, filter_result,
-                                                                          result_index, path_to_directory, None, None,
-                                                                          result['abstract'])
-        print("\nAll ArXiv results scraped.")
+    # Gather the PDF for each result, recording each outcome in the output directory's progress journal
+        # @param results : List of scraped results from ArXiv
+        # @param query : The arXiv search query
+        # @param path_to_directory : The path to the directory where all files will be saved
+        # @param meta_can_be_missing : Boolean toggle that determines if absent title and author is acceptable
+        # @param resume : Boolean toggle that skips results completed by a previous run and continues its numbering
+    def gather_files(self, results: list, query: str, path_to_directory: str, meta_can_be_missing: bool,
+                     resume: bool = False):
+        journal = Journal(path_to_directory, resume)
+        if not resume:
+            DuplicateFilter().forget(path_to_directory)  # This run overwrites the files those papers were saved to
+            NearDuplicateIndex().forget(path_to_directory)
+            MetadataStore().forget(path_to_directory)
+        gatherer = FileGatherer()
+        positions = gatherer.order_results(results, gatherer.skip_duplicates(journal, results), query, 'abstract')
+        result_index = journal.next_index
+        gatherer.start_budget()
+        try:
+            for n, position in enumerate(positions):  # Iterate over results
+                if gatherer.budget_exhausted():
+                    gatherer.report_budget(len(positions) - n)
+                    break
+                result = results[position]
+                print_index = position + 1
+                print(f"\rProcessing ArXiv files at index {print_index}...", end="", flush=True)
+                gathered = self.process_result(gatherer, result, query, meta_can_be_missing, print_index)
+                result_index = gatherer.finish_result(journal, position, result, gathered, result_index,
+                                                      path_to_directory, None, None, result['abstract'])
+        finally:
+            journal.close()  # Queued records are written even if gathering stops part way
+        self.print_summary(gatherer)
 
+    # Print the final ArXiv gathering summary
+        # @param gatherer : The FileGatherer that kept count of what happened
+    def print_summary(self, gatherer: FileGatherer):
+        print(f"\nAll ArXiv results scraped.\n\tDuplicate Results Not Fetched: {gatherer.identity_duplicate_count}"
+              f"\n\tResults Pruned Before Fetching: {gatherer.pruned_count}"
+              f"\n\tIdentical Files Skipped: {gatherer.identical_file_count}"
+              f"{DuplicateFilter.get_summary()}{NearDuplicateIndex.get_summary()}"
+              f"{Sessions.get_summary()}{ResponseCache.get_summary()}{RetryPolicy.get_summary()}"
+              f"{FileWriter.get_summary()}", flush=True)
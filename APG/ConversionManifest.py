@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import tempfile
+
+
+class ConversionManifest:
+    file_name = "conversion_manifest.json"
+
+    # Method that loads the conversion manifest of an output directory, if it has one
+    # The manifest maps each converted PDF to its size, modification time, content hash, and the outputs made from it
+        # @param path_to_directory : The path to the directory where all files are saved
+    def __init__(self, path_to_directory: str):
+        self.directory = path_to_directory
+        self.path = os.path.join(path_to_directory, self.file_name)
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"\nConversion manifest could not be read, so every file will be converted: {e}", flush=True)
+
+    # Method that computes the SHA-256 digest of a file
+        # @param path : The path of the file
+    @staticmethod
+    def hash_file(path: str):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    # Method that gets the key a PDF is stored under, which is its path relative to the output directory
+        # @param path : The path of the PDF
+    def __key(self, path):
+        return os.path.relpath(path, self.directory).replace(os.sep, "/")
+
+    # Method that checks whether a PDF was already converted and has not changed since
+    # Size and modification time are checked first, and the content hash only when those differ, so a file that was
+    #   just touched or copied is not converted again
+        # @param path : The path of the PDF
+    def is_up_to_date(self, path):
+        entry = self.entries.get(self.__key(path))
+        if entry is None:
+            return False
+        if not all(os.path.exists(os.path.join(self.directory, output)) for output in entry["outputs"]):
+            return False
+        stat = os.stat(path)
+        if stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"]:
+            return True
+        if stat.st_size == entry["size"] and self.hash_file(path) == entry["sha256"]:
+            entry["mtime"] = stat.st_mtime
+            return True
+        return False
+
+    # Method that deletes the outputs recorded for a PDF and forgets it
+    # Returns whether the PDF had been recorded
+        # @param key : The key of the PDF
+    def __remove_outputs(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        for output in entry["outputs"]:
+            output_path = os.path.join(self.directory, output)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            parent = os.path.dirname(output_path)
+            if os.path.dirname(parent) != os.path.normpath(self.directory) and os.path.isdir(parent) \
+                    and not os.listdir(parent):
+                os.rmdir(parent)  # Per-article folders, such as Images/<index>, go once empty
+        return True
+
+    # Method that deletes the outputs of a PDF before it is converted again, so none are left over from before
+    # Returns whether the PDF had been converted before
+        # @param path : The path of the PDF
+    def forget(self, path):
+        return self.__remove_outputs(self.__key(path))
+
+    # Method that records a converted PDF and the outputs made from it
+        # @param path : The path of the PDF
+        # @param sha256 : The SHA-256 digest of the PDF
+        # @param outputs : The paths of every file made from the PDF
+    def record(self, path, sha256: str, outputs: list):
+        stat = os.stat(path)
+        self.entries[self.__key(path)] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256,
+                                          "outputs": [self.__key(output) for output in outputs]}
+
+    # Method that deletes the outputs of every recorded PDF that no longer exists
+    # Returns how many PDFs were removed
+        # @param paths : The paths of every PDF that currently exists
+    def remove_missing(self, paths: list):
+        existing = {self.__key(p) for p in paths}
+        missing = [key for key in self.entries if key not in existing]
+        for key in missing:
+            self.__remove_outputs(key)
+        return len(missing)
+
+    # Method that atomically saves the manifest, so a crash never leaves a half-written one
+    def save(self):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, 'w', encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(temp_path, self.path)
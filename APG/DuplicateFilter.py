@@ -1,9 +1,27 @@
 import hashlib
+import os
+import sqlite3
+import threading
 
 
 class DuplicateFilter:
-    hash_table = set()  # Static global variable to store hashes
-    duplicateCount = 0
+    hash_table = set()  # Static global variable to store hashes - used when no index file is configured
+    duplicateCount = 0  # Duplicates found this run
+    file_digests = {}  # SHA-256 of a PDF's bytes -> what became of it this run, or the file it was saved as
+    index_path = None  # SQLite file the hashes are kept in between runs - None keeps them in memory only
+    connection = None
+    lock = threading.Lock()
+
+    # Method that keeps the hashes in an index file, so papers saved by earlier runs and other commands are known
+    # The file is only opened once the first paper is checked
+        # @param path : The path of the index file - None keeps hashes in memory only
+    @classmethod
+    def configure(cls, path: str or None):
+        with cls.lock:
+            if cls.connection is not None:
+                cls.connection.close()
+            cls.connection = None
+            cls.index_path = path
 
     @staticmethod
     # Method that generates a unique hash from a paper's metadata
@@ -15,16 +33,120 @@ class DuplicateFilter:
         data = f"{title.lower()}|{'|'.join(sorted(keywords)).lower()}|{authors.lower()}|{mod_date}"
         return hashlib.sha256(data.encode()).hexdigest()
 
+    # Method that opens the index file, creating it if needed -- must be called with the lock held
+    # Every change is written straight away, so a crash never loses a saved paper's hash
+    @classmethod
+    def __get_connection(cls):
+        if cls.connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(cls.index_path)), exist_ok=True)
+            connection = sqlite3.connect(cls.index_path, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS papers (hash TEXT PRIMARY KEY, folder TEXT NOT NULL) "
+                               "WITHOUT ROWID")
+            connection.execute("CREATE INDEX IF NOT EXISTS papers_folder ON papers (folder)")
+            connection.execute("CREATE TABLE IF NOT EXISTS counts (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS files (digest TEXT PRIMARY KEY, folder TEXT NOT NULL, "
+                               "path TEXT NOT NULL) WITHOUT ROWID")
+            connection.execute("CREATE INDEX IF NOT EXISTS files_folder ON files (folder)")
+            cls.connection = connection
+        return cls.connection
+
+    # Method that gets the key a folder is stored under, which is its path relative to the index file
+        # @param path_to_directory : The folder the papers are saved in
+    def __folder_key(self, path_to_directory: str):
+        root = os.path.dirname(os.path.abspath(self.index_path)) if self.index_path is not None else os.getcwd()
+        return os.path.relpath(os.path.abspath(path_to_directory), root).replace(os.sep, "/")
+
+    # Method that forgets every paper saved to a folder, because a new run is about to overwrite its files
+    # Papers saved to other folders, such as by the other commands, are kept
+        # @param path_to_directory : The folder the papers were saved in
+    def forget(self, path_to_directory: str):
+        if self.index_path is None:
+            return
+        cls = type(self)
+        with cls.lock:
+            connection = self.__get_connection()
+            folder = self.__folder_key(path_to_directory)
+            connection.execute("DELETE FROM files WHERE folder = ?", (folder,))
+            connection.execute("DELETE FROM papers WHERE folder = ?", (folder,))
+
+    # Method that finds what became of an earlier PDF with exactly the same bytes
+    # Returns the path of the saved copy (relative to the index file), what happened to a copy that was not saved
+    #   this run (such as "filtered out"), or None if the bytes are new
+        # @param digest : The SHA-256 hex digest of the PDF's bytes
+    def find_file(self, digest: str):
+        cls = type(self)
+        with cls.lock:
+            if digest in cls.file_digests:
+                return cls.file_digests[digest]
+            if self.index_path is None:
+                return None
+            row = self.__get_connection().execute("SELECT path FROM files WHERE digest = ?", (digest,)).fetchone()
+        return row[0] if row is not None else None
+
+    # Method that remembers what became of a PDF, so later copies with the same bytes are skipped
+    # Only saved copies are kept in the index file -- whether a file is relevant depends on the query, so other
+    #   outcomes are only remembered for this run
+        # @param digest : The SHA-256 hex digest of the PDF's bytes
+        # @param outcome : What became of the PDF, such as "saved", "filtered out", or "duplicate"
+        # @param file_path : The path the PDF was saved to, when it was saved
+        # @param path_to_directory : The folder the PDF was saved in, when it was saved
+    def add_file(self, digest: str, outcome: str, file_path: str or None = None, path_to_directory: str = "."):
+        cls = type(self)
+        with cls.lock:
+            if file_path is None:
+                cls.file_digests.setdefault(digest, outcome)
+                return
+            alias = self.__folder_key(file_path)
+            cls.file_digests[digest] = alias
+            if self.index_path is not None:
+                self.__get_connection().execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                                                (digest, self.__folder_key(path_to_directory), alias))
+
     # Method that attempts to add a paper to the hash table, but only if its hash is not currently in the table
         # @param title : The title of the paper
         # @param keywords : List of keywords from the paper
         # @param authors : The author(s) of the paper
         # @param mod_date : Modification date of the paper
-    def add_paper(self, title: str, keywords: list, authors: str, mod_date: str):
+        # @param path_to_directory : The folder the paper is saved in - only used with an index file
+    def add_paper(self, title: str, keywords: list, authors: str, mod_date: str, path_to_directory: str = "."):
         paper_hash = self.generate_paper_hash(title, keywords, authors, mod_date)
-        if paper_hash in self.hash_table:
-            # print("Duplicate paper encountered.")
-            self.duplicateCount += 1
-            return False  # Duplicate found
-        self.hash_table.add(paper_hash)
+        cls = type(self)
+        with cls.lock:
+            if self.index_path is None:
+                is_new = paper_hash not in cls.hash_table
+                cls.hash_table.add(paper_hash)
+            else:
+                is_new = self.__add_to_index(paper_hash, path_to_directory)
+            if not is_new:
+                # print("Duplicate paper encountered.")
+                cls.duplicateCount += 1
+                return False  # Duplicate found
         return True  # Successfully added
+
+    # Method that adds a hash to the index file -- must be called with the lock held
+    # Returns False if the hash was already there
+        # @param paper_hash : The hash of the paper
+        # @param path_to_directory : The folder the paper is saved in
+    def __add_to_index(self, paper_hash: str, path_to_directory: str):
+        connection = self.__get_connection()
+        # The insert is the check, so a hash another process sharing the index file added first counts as a duplicate
+        if connection.execute("INSERT OR IGNORE INTO papers VALUES (?, ?)",
+                              (paper_hash, self.__folder_key(path_to_directory))).rowcount:
+            return True
+        connection.execute("INSERT INTO counts VALUES ('duplicates', 1) "
+                           "ON CONFLICT (name) DO UPDATE SET value = value + 1")
+        return False
+
+    # Method that gets a printable summary of the duplicates found this run and across every run
+    @classmethod
+    def get_summary(cls):
+        with cls.lock:
+            if cls.index_path is None or cls.connection is None:
+                return f"\n\tDuplicates Skipped: {cls.duplicateCount}"
+            row = cls.connection.execute("SELECT value FROM counts WHERE name = 'duplicates'").fetchone()
+            papers = cls.connection.execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+            return (f"\n\tDuplicates Skipped: {cls.duplicateCount} ({row[0] if row else 0} across all runs, "
+                    f"{papers} papers indexed)")
+
@@ -1,12 +1,65 @@
 import io
+import os
 
+import numpy as np
 import PyPDF2
-from PyPDF2.generic import NameObject, TextStringObject
+import pymupdf
+from PyPDF2.generic import NullObject
 from fuzzywuzzy import fuzz
+from rapidfuzz import process
+from rapidfuzz.distance import Indel, Levenshtein
 
 
 class FileFilterer:
     THRESHOLD = 60
+    PROBE = "pymupdf"  # Library used to read metadata - "pymupdf" or "pypdf2"
+    metadata_keys = {'/Title': 'title', '/Author': 'author', '/Keywords': 'keywords', '/ModDate': 'modDate'}
+
+    # Reads only the document information of a file, without parsing its pages
+    # pymupdf reads the trailer and cross-reference table and loads just the info dictionary, while PyPDF2 does the
+    #   same work in pure Python, so pymupdf is the default
+    # Files that are on disk, such as downloads spilled to a temporary file, are opened by name so only the parts
+    #   pymupdf needs are read, rather than the whole file being loaded into memory
+    # Returns a dictionary of the '/Title', '/Author', '/Keywords', and '/ModDate' values the document information
+    #   holds, with empty or null values as empty strings, or None if the file has no document information
+        # @param file : The file to read
+        # @param probe : The library to read with - None uses PROBE
+    def read_metadata(self, file: io.IOBase, probe: str or None = None):
+        probe = probe or self.PROBE
+        file.seek(0)
+        if probe == "pypdf2":
+            meta = PyPDF2.PdfReader(file).metadata
+            if meta is None:
+                return None
+            return {key: "" if isinstance(meta[key], NullObject) else str(meta[key])
+                    for key in self.metadata_keys if key in meta.keys()}
+        path = self.__get_file_path(file)
+        if path is not None:
+            file.flush()
+            doc = pymupdf.open(path, filetype="pdf")
+        else:
+            doc = pymupdf.open(stream=file.read(), filetype="pdf")
+        with doc:
+            info_type, info = doc.xref_get_key(-1, "Info")  # -1 is the trailer
+            if info_type != "xref":
+                return None
+            present = doc.xref_get_keys(int(info.split()[0]))
+            meta = doc.metadata
+        file.seek(0)
+        # pymupdf gives every key, using an empty string for missing values, so the keys present are checked apart
+        return {key: meta.get(name) or "" for key, name in self.metadata_keys.items() if key[1:] in present}
+
+    # Gets a path a file can be opened by, if it is on disk
+    # Returns the path, or None for files held in memory or with no usable name
+        # @param file : The file
+    @staticmethod
+    def __get_file_path(file: io.IOBase):
+        if os.name == "nt":  # Windows does not let an open temporary file be opened a second time by its name
+            return None
+        name = getattr(file, "name", None)
+        if isinstance(name, str) and os.path.isfile(name):
+            return name
+        return None
 
     # Determines the Jaccard Similarity for a query and a paper's title
     # Useful for substring matching
@@ -39,15 +92,71 @@ class FileFilterer:
         fuzzy = self.fuzzy_partial(query, title, keywords)
         return (jaccard * 100 + fuzzy) / 2  # Normalize Jaccard and blend scores
 
+    # Prepares a query for batch scoring, so its lowercase form and character set are only built once
+        # @param query : The Google Scholar search query
+    def compile_query(self, query: str):
+        return CompiledQuery(query)
+
+    # Scores many papers against one query at once, giving exactly the scores hybrid_match would
+    # fuzzywuzzy's partial ratio compares the shorter string with a window of the longer one at each matching block,
+    #   so the windows of every paper are gathered first and all compared in a single multithreaded RapidFuzz call,
+    #   and the Jaccard similarities, maximums, and blending are done with NumPy
+    # Returns a NumPy array with one score per paper
+        # @param query : The query, as returned by compile_query
+        # @param candidates : List of (title, keywords) pairs, where keywords is a list of strings
+    def score_batch(self, query: "CompiledQuery", candidates: list):
+        count = len(candidates)
+        common = np.zeros(count)
+        union = np.zeros(count)
+        unique = {}  # Each distinct lowercase title or keyword -> its position in the partial ratio array
+        owners, positions = [], []  # Which paper each title and keyword belongs to, and its distinct string
+        for i, (title, keywords) in enumerate(candidates):
+            title = title.lower()
+            characters = set(title)
+            common[i] = len(characters & query.characters)
+            union[i] = len(characters) + len(query.characters) - common[i]
+            for text in [title] + [kw.lower() for kw in keywords]:
+                owners.append(i)
+                positions.append(unique.setdefault(text, len(unique)))
+        jaccard = np.divide(common, union, out=np.zeros(count), where=union > 0)
+
+        # Gather every distinct (shorter string, window of longer string) pair to compare
+        shorters, windows, pair_owners = [], [], []
+        exact = np.full(len(unique), -1.0)  # Scores known without comparing windows
+        for j, text in enumerate(unique):
+            if text == query.text:
+                exact[j] = 100
+                continue
+            if not text or not query.text:
+                exact[j] = 0
+                continue
+            shorter, longer = (query.text, text) if len(query.text) <= len(text) else (text, query.text)
+            starts = {block.b - block.a if block.b > block.a else 0
+                      for block in Levenshtein.opcodes(shorter, longer).as_matching_blocks()}
+            for start in starts:
+                shorters.append(shorter)
+                windows.append(longer[start:start + len(shorter)])
+                pair_owners.append(j)
+        best = np.zeros(len(unique))
+        if shorters:
+            ratios = process.cpdist(shorters, windows, scorer=Indel.normalized_similarity, dtype=np.float64,
+                                    workers=-1)
+            np.maximum.at(best, np.array(pair_owners), ratios)
+        partial = np.where(best > .995, 100, np.round(100 * best))
+        partial = np.where(exact >= 0, exact, partial)
+
+        fuzzy = np.zeros(count)
+        np.maximum.at(fuzzy, np.array(owners, dtype=np.intp), partial[np.array(positions, dtype=np.intp)])
+        return (jaccard * 100 + fuzzy) / 2
+
     # Determines if a file is good and relevant to the query or not -- for Google Scholar results
         # @param file : The file to check
         # @param query : The Google Scholar search query
         # @param meta_can_be_missing : Boolean toggle that determines if absent title and author is acceptable
-    def filter(self, file: io.BytesIO, query: str, meta_can_be_missing: bool):
+    def filter(self, file: io.IOBase, query: str, meta_can_be_missing: bool):
         is_good_file = (False, None, None, None, None)
         try:
-            pdf_reader = PyPDF2.PdfReader(file)
-            meta = pdf_reader.metadata
+            meta = self.read_metadata(file)
         except Exception as e:
             # print("File could not be opened.")
             # Bad file
@@ -61,9 +170,9 @@ class FileFilterer:
             if meta_can_be_missing:
                 # Add them if they are not present
                 if '/Title' not in meta.keys():
-                    meta[NameObject('/Title')] = TextStringObject("Unknown")
+                    meta['/Title'] = "Unknown"
                 if '/Author' not in meta.keys():
-                    meta[NameObject('/Author')] = TextStringObject("Unknown")
+                    meta['/Author'] = "Unknown"
             if '/Title' not in meta.keys() or '/Author' not in meta.keys() or '/ModDate' not in meta.keys():
                 # Unknown file
                 pass
@@ -89,11 +198,10 @@ class FileFilterer:
         # @param element : Dictionary containing metadata for file
         # @param query : The Google Scholar search query
         # @param meta_can_be_missing : Boolean toggle that determines if absent title and author is acceptable
-    def arxiv_filter(self, file: io.BytesIO, element: dict, query: str, meta_can_be_missing: bool):
+    def arxiv_filter(self, file: io.IOBase, element: dict, query: str, meta_can_be_missing: bool):
         is_good_file = (False, None, None, None, None)
         try:
-            pdf_reader = PyPDF2.PdfReader(file)
-            meta = pdf_reader.metadata
+            meta = self.read_metadata(file)
         except Exception as e:
             # print("File could not be opened.")
             # Bad file
@@ -125,3 +233,10 @@ class FileFilterer:
             else:
                 is_good_file = (False, title, keywords, None, None)
             return is_good_file
+
+
+# A query prepared once for scoring many papers
+class CompiledQuery:
+    def __init__(self, query: str):
+        self.text = query.lower()
+        self.characters = frozenset(self.text)
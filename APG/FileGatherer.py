@@ -1,14 +1,27 @@
 import os
 import requests
 from bs4 import BeautifulSoup
-import random
-import time
 import io
+import asyncio
+import hashlib
+import heapq
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from APG.FileFilterer import FileFilterer
 from APG.FileWriter import FileWriter
 from APG.DuplicateFilter import DuplicateFilter
 from APG.Headers import Headers
+from APG.Journal import Journal
+from APG.MetadataStore import MetadataStore
+from APG.Metrics import Metrics
+from APG.NearDuplicateIndex import NearDuplicateIndex
+from APG.RateLimiter import RateLimiter
+from APG.ResponseCache import ResponseCache
+from APG.RetryPolicy import RetryPolicy
+from APG.Sessions import Sessions
 
 
 class FileGatherer:
@@ -18,99 +31,466 @@ class FileGatherer:
     request_error_count = 0
     fetch_failed_count = 0
     file_skipped_count = 0
+    oversize_count = 0
     link_no_file_count = 0
+    identity_duplicate_count = 0  # Results skipped because another result is the same paper
+    identical_file_count = 0  # Downloads skipped because a PDF with the same bytes was already handled
+    pruned_count = 0  # Results skipped because their title and snippet scored far below the threshold
     no_good_article_found = True
+    max_file_size = 100 * 1024 * 1024  # Downloads larger than this many bytes are abandoned
+    max_page_size = 5 * 1024 * 1024  # Web pages larger than this many bytes are abandoned
+    spool_threshold = 8 * 1024 * 1024  # PDFs larger than this many bytes are spilled to a named temporary file
+    chunk_size = 64 * 1024
+    sniff_size = 1024  # PDFs must start with the %PDF- marker within this many bytes
+    prioritize = False  # Whether results are fetched from most to least promising, instead of in page order
+    prune_margin = None  # Results scoring more than this far below FileFilterer.THRESHOLD are skipped - None keeps all
+    time_budget = None  # Seconds the run may spend gathering files - None is unlimited
+    byte_budget = None  # Bytes the run may download - None is unlimited
+    budget_started = None
+    bytes_downloaded = 0
+    lock = threading.Lock()
 
-    # Method that attempts to fetch content from a URL and will retry if failed, with a longer delay each time
+    # Method that attempts to fetch content from a URL and will retry if failed, backing off as RetryPolicy decides
+    # Only statuses worth retrying (such as 429 and 503) and connection errors are retried, and a Retry-After
+    #   header is honored
+    # The response is streamed, so the caller must read it with read_body or close it
+    # Requests go through the response cache, so URLs that recently failed are skipped right away
     # @param url : The URl to fetch from
     # @param print_index : The index used for printing status
-    # @param max_tries : The maximum number of times to try a request
-    def fetch(self, url, print_index, max_tries=2):
-        self.total_files_checked += 1
-        for _ in range(max_tries):
+    # @param max_tries : The maximum number of times to try a request - None uses the retry policy's budget
+    # @param pdf_only : Boolean toggle for requests that only want a PDF, which also skip URLs found not to be one
+    def fetch(self, url, print_index, max_tries=None, pdf_only=False):
+        self.count("total_files_checked")
+
+        def send():
             try:
-                headers_to_use = Headers().get_rand_header_modern()
-                response = requests.get(url, headers=headers_to_use, timeout=10)
-                if response.status_code == 200:
-                    return response
-                elif response.status_code == 403:
-                    self.forbidden_count += 1
-                    # print(f"\rProcessing files at index {print_index}... Request blocked")
-            except requests.exceptions.RequestException as e:
-                self.request_error_count += 1
+                response = ResponseCache().get(url, Headers().get_rand_header_modern(), pdf_only=pdf_only)
+            except requests.exceptions.RequestException:
+                self.count("request_error_count")
                 # print(f"\rProcessing files at index {print_index}... Request failed on attempt: {e}")
-                delay = random.uniform(2, 5)
-                time.sleep(delay)
-        return None
+                raise
+            if response is not None and response.status_code == 403:
+                self.count("forbidden_count")
+                # print(f"\rProcessing files at index {print_index}... Request blocked")
+            return response
+
+        response = RetryPolicy().run(url, send, max_tries, remember_failure=True)
+        if response is not None and response.status_code != 200:
+            response.close()
+            return None
+        return response
+
+    # Method that streams the body of a response, deciding from the first chunk whether it is a PDF
+    # PDFs are returned as a file that stays in memory up to spool_threshold bytes and spills to a named temporary
+    #   file after that, so it can be opened again by its path, along with the SHA-256 digest of their bytes, hashed
+    #   as they arrive, while web pages are returned as bytes
+    # Returns (is_pdf, body, digest), or None, without downloading the rest, for non-PDFs when only a PDF is wanted,
+    #   or for bodies larger than the size limits
+        # @param response : The streamed GET response -- it is always closed
+        # @param pdf_only : Boolean toggle that abandons any body that is not a PDF
+    def read_body(self, response: requests.Response, pdf_only: bool):
+        size = 0
+        start = time.perf_counter()
+        try:
+            content_length = response.headers.get("Content-Length", "")
+            if content_length.isdigit() and int(content_length) > self.max_file_size:
+                self.count("oversize_count")
+                return None
+
+            chunks = response.iter_content(chunk_size=self.chunk_size)
+            head = b""
+            for chunk in chunks:  # Gather just enough of the body to sniff it
+                head += chunk
+                size += len(chunk)
+                if len(head) >= self.sniff_size:
+                    break
+            is_pdf = b"%PDF-" in head[:self.sniff_size]
+            if pdf_only and not is_pdf:
+                self.count("file_skipped_count")
+                ResponseCache().store_failure(ResponseCache.get_request_url(response), "not a PDF", True, True)
+                return None
+
+            limit = self.max_file_size if is_pdf else self.max_page_size
+            body = io.BytesIO()
+            body.write(head)
+            digest = hashlib.sha256(head)
+            for chunk in chunks:
+                size += len(chunk)
+                if size > limit:
+                    self.count("oversize_count")
+                    body.close()
+                    return None
+                body.write(chunk)
+                digest.update(chunk)
+                if is_pdf and size > self.spool_threshold and isinstance(body, io.BytesIO):
+                    body = self.__spill(body)
+            if not is_pdf:
+                ResponseCache().store(response, body)
+                return False, body.getvalue(), None
+            body.seek(0)
+            ResponseCache().hold_file(response, body, digest.hexdigest(), size)
+            return True, body, digest.hexdigest()
+        except requests.exceptions.RequestException:
+            self.count("request_error_count")
+            return None
+        finally:
+            response.close()
+            if not getattr(response, "from_cache", False):
+                self.record_bytes(size)
+                Metrics.observe("download", time.perf_counter() - start)
+
+    # Method that moves a download held in memory to a named temporary file, which is removed once it is closed
+    # Returns the temporary file, positioned at its end so the rest of the download can be written after it
+        # @param body : The download so far -- it is closed
+    @staticmethod
+    def __spill(body: io.BytesIO):
+        spilled = tempfile.NamedTemporaryFile()
+        with body.getbuffer() as view:
+            spilled.write(view)
+        body.close()
+        return spilled
+
+    # Method that adds to one of this gatherer's counters, under the lock since concurrent fetches share the gatherer
+        # @param name : The counter, such as "forbidden_count"
+        # @param amount : How much to add
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    # Method that adds to the bytes downloaded this run, which byte_budget is checked against
+        # @param size : The number of bytes downloaded
+    @classmethod
+    def record_bytes(cls, size: int):
+        with cls.lock:
+            cls.bytes_downloaded += size
+        Metrics.add("bytes_downloaded", size)
+
+    # Method that starts the clock that time_budget is checked against, if it is not already running
+    @classmethod
+    def start_budget(cls):
+        with cls.lock:
+            if cls.budget_started is None:
+                cls.budget_started = time.monotonic()
+
+    # Method that checks whether the run has used up its time or byte budget
+    @classmethod
+    def budget_exhausted(cls):
+        with cls.lock:
+            if cls.time_budget is not None and cls.budget_started is not None \
+                    and time.monotonic() - cls.budget_started >= cls.time_budget:
+                return True
+            return cls.byte_budget is not None and cls.bytes_downloaded >= cls.byte_budget
+
+    # Filter a downloaded PDF, unless a PDF with the same bytes was already handled
+    # Returns the (file, filter_result, digest) entry for the gathered list -- for a copy of an earlier PDF, the file
+    #   is closed and None is returned in its place, with what became of the earlier PDF instead of a filter result
+        # @param content : The downloaded PDF
+        # @param digest : The SHA-256 hex digest of the PDF's bytes
+        # @param check : Function that filters the PDF and returns the filter result
+    def check_file(self, content: io.IOBase, digest: str, check):
+        alias = DuplicateFilter().find_file(digest)
+        if alias is not None:
+            content.close()
+            return None, alias, digest
+        with Metrics.timed("filter"):
+            filter_result = check(content)
+        return content, filter_result, digest
+
+    # Gather the file(s) for a single result, including ones that are referenced on its web page
+    # Returns a list of (file, filter_result, digest) entries in the order the files were found
+        # @param result : A single scraped result
+        # @param query : The Google Scholar search query
+        # @param meta_can_be_missing : Boolean toggle that determines if absent title and author is acceptable
+        # @param print_index : The index used for printing status
+    def process_result(self, result: dict, query: str, meta_can_be_missing: bool, print_index: int):
+        gathered = []
+        # Some results have a file_link, which may be different from the regular link, but not all have this
+        #   so, if this value is None, then just use the regular file link, which all results have
+        url = self.get_result_url(result)
+        if url is None:
+            # No link for this index
+            self.count("link_no_file_count")
+            self.count("total_files_checked")
+            return gathered
+        response = self.fetch(url, print_index)
+        if not response:
+            self.count("fetch_failed_count")
+            self.count("total_files_checked")
+            # print(f"\nFailed to fetch {url}")
+            return gathered
+        body = self.read_body(response, False)
+        if body is None:
+            return gathered
+
+        is_pdf, content, digest = body
+        if is_pdf:
+            self.count("total_gathered")
+            gathered.append(self.check_file(content, digest,
+                                            lambda f: FileFilterer().filter(f, query, meta_can_be_missing)))
+            return gathered
+
+        soup = BeautifulSoup(content, 'html.parser')  # Use BeautifulSoup to parse the returned results
+        links = soup.find_all('a')  # Find all hyperlinks present on webpage
+
+        # Check all links for PDFs and grab the ones that are found
+        #   this is the step that introduces problems, as some links report to be PDFs
+        #   but are not or are just empty -- handled by sniffing the start of each download
+        for link in links:
+            file_url = link.get('href')
+            if file_url and file_url.lower().endswith(".pdf"):
+                response = self.fetch(file_url, print_index, pdf_only=True)
+                if not response:
+                    continue
+
+                body = self.read_body(response, True)
+                if body is None:
+                    self.count("total_files_checked")
+                    # print(f"\nSkipping {file_url} (not a valid PDF)")
+                    continue
+
+                self.count("total_gathered")
+                gathered.append(self.check_file(body[1], body[2],
+                                                lambda f: FileFilterer().filter(f, query, meta_can_be_missing)))
+        return gathered
+
+    # Get the URL that should be fetched for a result -- the direct file link is preferred when present
+        # @param result : A single scraped result
+    @staticmethod
+    def get_result_url(result: dict):
+        url = result.get('file_link')
+        if url is None:
+            url = result.get('link')
+        return url
 
     # Gather files from each result, including ones that are referenced on each web page
+    # Every result's outcome is recorded in a progress journal in the output directory, so an interrupted run
+    #   can be resumed without fetching completed results again or overwriting their files
         # @param results : List of scraped results from Google Scholar
         # @param query : The Google Scholar search query
         # @param path_to_directory : The path to the directory where all files will be saved
         # @param meta_can_be_missing : Boolean toggle that determines if absent title and author is acceptable
         # @param year_start : The starting year of a date range - use None if no filtering is desired
         # @param year_end : The ending year of a date range - use None if no filtering is desired
+        # @param concurrency : The number of results fetched at once -- values above 1 use the asyncio engine
+        # @param resume : Boolean toggle that skips results completed by a previous run and continues its numbering
     def gather_files(self, results: list, query: str, path_to_directory: str,
-                     meta_can_be_missing: bool, year_start: int or None, year_end: int or None):
-        result_index = 1
-        print_index = 0
-        for result in results:  # Iterate over results
-            print_index += 1
-            print(f"\rProcessing files at index {print_index}...", end="", flush=True)
-            # Sleep for 3 to 7 seconds to avoid angering any anti-bot policies
-            delay = random.uniform(3, 7)
-            time.sleep(delay)
-            # Some results have a file_link, which may be different from the regular link, but not all have this
-            #   so, if this value is None, then just use the regular file link, which all results have
-            url = result['file_link']
-            if url is None:
-                url = result['link']
-            if url is None:
-                # No link for this index
-                self.link_no_file_count += 1
-                self.total_files_checked += 1
-                continue
-            response = self.fetch(url, print_index)
-            if not response:
-                self.fetch_failed_count += 1
-                self.total_files_checked += 1
-                # print(f"\nFailed to fetch {url}")
+                     meta_can_be_missing: bool, year_start: int or None, year_end: int or None,
+                     concurrency: int = 1, resume: bool = False):
+        journal = Journal(path_to_directory, resume)
+        if not resume:
+            DuplicateFilter().forget(path_to_directory)  # This run overwrites the files those papers were saved to
+            NearDuplicateIndex().forget(path_to_directory)
+            MetadataStore().forget(path_to_directory)
+        positions = self.order_results(results, self.skip_duplicates(journal, results), query, 'snippet')
+        self.start_budget()
+        try:
+            if concurrency > 1:
+                asyncio.run(self.__gather_files_concurrently(results, positions, journal, query, path_to_directory,
+                                                             meta_can_be_missing, year_start, year_end, concurrency))
+            else:
+                result_index = journal.next_index
+                for n, position in enumerate(positions):  # Iterate over results
+                    if self.budget_exhausted():
+                        self.report_budget(len(positions) - n)
+                        break
+                    print(f"\rProcessing files at index {position + 1}...", end="", flush=True)
+                    gathered = self.process_result(results[position], query, meta_can_be_missing, position + 1)
+                    result_index = self.finish_result(journal, position, results[position], gathered, result_index,
+                                                      path_to_directory, year_start, year_end)
+        finally:
+            journal.close()
+        self.print_summary()
+
+    # Get the positions of the results that still need to be gathered, in order
+    # Results that a previous run completed are left out, and results that IdentityResolver found to be the same
+    #   paper as another result are skipped without being fetched -- they are left out of the journal, so a resumed
+    #   run checks them again
+        # @param journal : The progress journal of this run
+        # @param results : List of scraped results
+    def skip_duplicates(self, journal: Journal, results: list):
+        positions = []
+        for position, result in enumerate(results):
+            if journal.is_done(position, self.get_result_url(result)):
                 continue
+            if result.get('duplicate_of'):
+                self.count("identity_duplicate_count")
+            else:
+                positions.append(position)
+        return positions
 
-            content_type = response.headers.get("Content-Type", "").lower()
-            if "pdf" in content_type:
-                self.total_gathered += 1
-                pdf_file_obj = io.BytesIO(response.content)
-                filter_result = FileFilterer().filter(pdf_file_obj, query, meta_can_be_missing)
-                result_index = self.handle_file_result(response, filter_result, result_index, path_to_directory,
-                                                       year_start, year_end)
+    # Score results on the text scraped with them, before anything is downloaded, with FileFilterer.score_batch
+    # Returns the score of each result, in the order of positions
+        # @param results : List of scraped results
+        # @param positions : The positions of the results to score
+        # @param query : The search query
+        # @param text_key : The key of the text scraped with each result, such as 'snippet' or 'abstract'
+    def score_results(self, results: list, positions: list, query: str, text_key: str):
+        filterer = FileFilterer()
+        candidates = []
+        for position in positions:
+            title, text = results[position].get('title'), results[position].get(text_key)
+            candidates.append((title if title and title != "No title" else "",
+                               [text if text and text != "No snippet" else ""]))
+        with Metrics.timed("prefetch_scoring"):
+            return filterer.score_batch(filterer.compile_query(query), candidates).tolist()
+
+    # Check whether a result scored too far below FileFilterer.THRESHOLD to be worth fetching
+        # @param score : The score of the result, as returned by score_results
+    def is_pruned(self, score: float):
+        return self.prune_margin is not None and score < FileFilterer.THRESHOLD - self.prune_margin
+
+    # Score results before anything is downloaded, so unpromising results can be skipped
+    # Results scoring more than prune_margin below FileFilterer.THRESHOLD are skipped without being fetched, and
+    #   with prioritize on the rest are fetched from most to least promising
+    # Pruned results are left out of the journal, so a resumed run scores them again against its own prune_margin
+    # Returns the positions of the results to gather, in the order to gather them
+        # @param results : List of scraped results
+        # @param positions : The positions of the results that still need to be gathered, in order
+        # @param query : The search query
+        # @param text_key : The key of the text scraped with each result, such as 'snippet' or 'abstract'
+    def order_results(self, results: list, positions: list, query: str, text_key: str):
+        if not positions or (not self.prioritize and self.prune_margin is None):
+            return positions
+        queue = []
+        for position, score in zip(positions, self.score_results(results, positions, query, text_key)):
+            if self.is_pruned(score):
+                self.count("pruned_count")
+            else:
+                # Ties keep their page order, so results scored alike are fetched as before
+                heapq.heappush(queue, (-score if self.prioritize else 0, position))
+        return [heapq.heappop(queue)[1] for _ in range(len(queue))]
+
+    # Print how many results were left for a later run because the time or byte budget ran out
+        # @param remaining : The number of results that were not started
+    def report_budget(self, remaining: int):
+        print(f"\nBudget reached after {self.bytes_downloaded / (1024 * 1024):.1f} MB, so {remaining} results were "
+              f"left for a later run - use --resume to continue.", flush=True)
+
+    # Handle the files gathered for a single result and record the result's outcome in the journal
+        # @param journal : The progress journal of this run
+        # @param position : The position of the result in the results list
+        # @param result : The result
+        # @param gathered : The (file, filter_result, digest) entries returned by process_result
+        # @param result_index : The current numbering index
+        # @param path_to_directory : The path to the directory where files are to be saved
+        # @param year_start : The starting year of a date range - use None if no filtering is desired
+        # @param year_end : The ending year of a date range - use None if no filtering is desired
+        # @param abstract : The abstract for the file -- used for ArXiv file handling
+    def finish_result(self, journal: Journal, position: int, result: dict, gathered: list, result_index: int,
+                      path_to_directory: str, year_start: int or None, year_end: int or None,
+                      abstract: str or None = None):
+        first_index = result_index
+        aliases = []
+        for file, filter_result, digest in gathered:
+            if file is not None:
+                # An earlier result may have saved the same bytes after this file was downloaded
+                alias = DuplicateFilter().find_file(digest)
+                if alias is not None:
+                    file.close()
+                    file, filter_result = None, alias
+            if file is None:
+                self.count("identical_file_count")
+                aliases.append({"digest": digest, "alias_of": filter_result})
                 continue
+            with Metrics.timed("save"):
+                result_index = self.handle_file_result(file, filter_result, result_index, path_to_directory,
+                                                       year_start, year_end, abstract, digest)
+        url = self.get_result_url(result)
+        if gathered:
+            outcome = "alias" if len(aliases) == len(gathered) else "gathered"
+        else:
+            outcome = "no file" if url else "no link"
+        MetadataStore().flush(path_to_directory)  # The papers' fields are written before the journal says they were
+        journal.record(position, url, outcome, first_index, result_index, aliases)
+        return result_index
 
-            soup = BeautifulSoup(response.text, 'html.parser')  # Use BeautifulSoup to parse the returned results
-            links = soup.find_all('a')  # Find all hyperlinks present on webpage
-
-            # Check all links for PDFs and grab the ones that are found
-            #   this is the step that introduces problems, as some links report to be PDFs
-            #   but are not or are just empty -- handled by checking response type
-            for link in links:
-                file_url = link.get('href')
-                if file_url and file_url.lower().endswith(".pdf"):
-                    response = self.fetch(file_url, print_index)
-                    if not response:
-                        continue
-
-                    content_type = response.headers.get("Content-Type", "").lower()
-                    if "pdf" not in content_type:
-                        self.file_skipped_count += 1
-                        self.total_files_checked += 1
-                        # print(f"\nSkipping {file_url} (not a valid PDF)")
-                        continue
-
-                    self.total_gathered += 1
-                    pdf_file_obj = io.BytesIO(response.content)
-                    filter_result = FileFilterer().filter(pdf_file_obj, query, meta_can_be_missing)
-                    result_index = self.handle_file_result(response, filter_result, result_index, path_to_directory,
-                                                           year_start, year_end)
+    # Gather files from many results at once, never fetching two results whose links are on the same host together
+    # Links found on a result's landing page may be on any host, so requests for them are only held to their host's
+    #   RateLimiter budget, which still spaces out every request to a host whichever result it comes from
+    #   Files are handled in the order of positions, so the numbering is identical to the sequential path
+        # @param results : List of scraped results from Google Scholar
+        # @param positions : The positions of the results that still need to be gathered, in order
+        # @param journal : The progress journal of this run
+        # @param query : The Google Scholar search query
+        # @param path_to_directory : The path to the directory where all files will be saved
+        # @param meta_can_be_missing : Boolean toggle that determines if absent title and author is acceptable
+        # @param year_start : The starting year of a date range - use None if no filtering is desired
+        # @param year_end : The ending year of a date range - use None if no filtering is desired
+        # @param concurrency : The maximum number of results fetched at once
+    async def __gather_files_concurrently(self, results: list, positions: list, journal: Journal, query: str,
+                                          path_to_directory: str, meta_can_be_missing: bool,
+                                          year_start: int or None, year_end: int or None, concurrency: int):
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        positions = list(positions)  # Results that are never started are removed once the budget runs out
+        pending = list(positions)  # Positions of results that have not been started yet
+        finished = {}  # Position -> gathered files, waiting to be handled in order
+        busy_hosts = set()
+        wake_up = asyncio.Event()
+        state = {"next_to_handle": 0, "result_index": journal.next_index}
+
+        # Handle every finished result that is next in line, so numbering follows the result order
+        def handle_ready():
+            while state["next_to_handle"] < len(positions) and positions[state["next_to_handle"]] in finished:
+                position = positions[state["next_to_handle"]]
+                state["result_index"] = self.finish_result(journal, position, results[position],
+                                                           finished.pop(position), state["result_index"],
+                                                           path_to_directory, year_start, year_end)
+                state["next_to_handle"] += 1
+            print(f"\rProcessing files... {state['next_to_handle']}/{len(positions)} complete", end="", flush=True)
+
+        # Pick the first pending result whose host is free, or report how long until one will be
+        def pick_next():
+            soonest = None
+            for i, position in enumerate(pending):
+                url = self.get_result_url(results[position])
+                host = RateLimiter.get_host(url) if url else ""
+                if host in busy_hosts:
+                    continue
+                ready_in = RateLimiter().ready_in(url) if url else 0
+                if ready_in <= 0:
+                    return pending.pop(i), host, 0
+                if soonest is None or ready_in < soonest:
+                    soonest = ready_in
+            return None, None, soonest
+
+        async def worker():
+            while pending:
+                if self.budget_exhausted():
+                    self.report_budget(len(pending))
+                    for position in pending:
+                        positions.remove(position)
+                    pending.clear()
+                    break
+                position, host, wait = pick_next()
+                if position is None:
+                    # Every remaining host is busy or cooling down, so wait for a host to free up
+                    wake_up.clear()
+                    try:
+                        await asyncio.wait_for(wake_up.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                busy_hosts.add(host)
+                try:
+                    finished[position] = await loop.run_in_executor(
+                        executor, self.process_result, results[position], query, meta_can_be_missing, position + 1)
+                except Exception as e:
+                    print(f"\nUnexpected error while processing result {position + 1}: {e}", flush=True)
+                    finished[position] = []
+                finally:
+                    busy_hosts.discard(host)
+                    wake_up.set()
+                handle_ready()
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        finally:
+            executor.shutdown(wait=True)
+        handle_ready()
+
+    # Print the final gathering summary
+    def print_summary(self):
         print("\nAll results scraped.")
         if self.no_good_article_found:
             print("\n\tNo relevant papers found. Please refine search query and try again.\n")
@@ -118,55 +498,95 @@ class FileGatherer:
               f"\n\tFiles Successfully Gathered (unfiltered): {self.total_gathered}"
               f"\n\t403 Errors: {self.forbidden_count}\n\tRequest Exceptions: {self.request_error_count}"
               f"\n\tFiles Unable to be Fetched: {self.fetch_failed_count}\n\tFiles Skipped: {self.file_skipped_count}"
-              f"\n\tLinks with No Files: {self.link_no_file_count}", flush=True)
+              f"\n\tFiles Over Size Limit: {self.oversize_count}"
+              f"\n\tLinks with No Files: {self.link_no_file_count}"
+              f"\n\tDuplicate Results Not Fetched: {self.identity_duplicate_count}"
+              f"\n\tResults Pruned Before Fetching: {self.pruned_count}"
+              f"\n\tIdentical Files Skipped: {self.identical_file_count}{DuplicateFilter.get_summary()}"
+              f"{NearDuplicateIndex.get_summary()}{Sessions.get_summary()}{ResponseCache.get_summary()}"
+              f"{RetryPolicy.get_summary()}{FileWriter.get_summary()}", flush=True)
 
     # Checks returned file result from filtering and saves the appropriate data
-        # @param response : The GET response of the file
+    # The file is always closed once handled, by the FileWriter if it is saved or stored in the response cache
+        # @param file : The downloaded file, as returned by read_body
         # @param filter_result : The returned filtering result
         # @result_index : The current numbering index
         # @path_to_directory : The path to the directory where files are to be saved
         # @param year_start : The starting year of a date range - use None if no filtering is desired
         # @param year_end : The ending year of a date range - use None if no filtering is desired
         # @param abstract : The abstract for the file -- used for ArXiv file handling
-    def handle_file_result(self, response: requests.Response, filter_result: tuple, result_index: int,
+        # @param digest : The SHA-256 hex digest of the file's bytes, remembered so identical copies are skipped
+    def handle_file_result(self, file: io.IOBase, filter_result: tuple, result_index: int,
                            path_to_directory: str, year_start: int or None, year_end: int or None,
-                           abstract: str or None = None):
+                           abstract: str or None = None, digest: str or None = None):
         if filter_result[0]:
             year_is_good = True
             if year_start is not None and year_end is not None:
                 year_is_good = self.check_paper_year(year_start, year_end, filter_result[4])
-            if DuplicateFilter().add_paper(filter_result[1], filter_result[2],
-                                                           filter_result[3], filter_result[4]) and year_is_good:
+            # Exact duplicates are checked first, then papers whose title and abstract nearly match a saved paper's
+            # A title alone, such as the metadata title of a Scholar PDF, is too generic to drop a paper on, so papers
+            #   without an abstract are only signed and checked once their text is extracted by the converter
+            if DuplicateFilter().add_paper(filter_result[1], filter_result[2], filter_result[3], filter_result[4],
+                                           path_to_directory) and year_is_good \
+                    and (not abstract or NearDuplicateIndex().add_paper(path_to_directory, result_index,
+                                                                        f"{filter_result[1]}\n{abstract}") is None):
                 writer = FileWriter()
                 file_path = os.path.join(path_to_directory, "Articles", f"{result_index}.pdf")
-                writer.write_file(file_path, response.content, 'wb')
-                writer.write_file(os.path.join(path_to_directory, "Titles", f"{result_index}.txt"),
-                                  filter_result[1], 'w', "utf-8")
-                writer.write_file(os.path.join(path_to_directory, "Keywords", f"{result_index}.txt"),
-                                  filter_result[2], 'w', "utf-8")
-                writer.write_file(os.path.join(path_to_directory, "Authors", f"{result_index}.txt"),
-                                  filter_result[3], 'w', "utf-8")
-                writer.write_file(os.path.join(path_to_directory, "ModDate", f"{result_index}.txt"),
-                                  filter_result[4], 'w', "utf-8")
-                if abstract is not None:
-                    writer.write_file(os.path.join(path_to_directory, "Abstracts", f"{result_index}.txt"),
-                                      abstract, 'w', "utf-8")
+                writer.copy_file(file_path, file)  # The writer closes the file once it has been copied
+                ResponseCache().link_file(file, file_path)  # Later runs read it from Articles, once it is written
+                file = None
+                if MetadataStore.enabled:
+                    MetadataStore().add(path_to_directory, result_index, "saved", filter_result[1], filter_result[2],
+                                        filter_result[3], filter_result[4], abstract, digest)
+                else:
+                    self.__write_fields(writer, path_to_directory, result_index, filter_result, abstract)
                 # print(f"File '{file_path}' downloaded.")
+                if digest is not None:
+                    DuplicateFilter().add_file(digest, "saved", file_path, path_to_directory)
                 result_index += 1
                 if self.no_good_article_found is True:  # Only update this value once
                     self.no_good_article_found = False
+            elif digest is not None:
+                DuplicateFilter().add_file(digest, "duplicate" if year_is_good else "outside year range")
         else:
             # print(f"File filtered out.")
             if filter_result[1] is not None:
-                writer = FileWriter()
-                os.path.join(path_to_directory, "Bad", "Keywords", f"{result_index}.txt")
-                writer.write_file(os.path.join(path_to_directory, "Bad", "Titles", f"{result_index}.txt"),
-                                  filter_result[1], 'w', "utf-8")
-                writer.write_file(os.path.join(path_to_directory, "Bad", "Keywords", f"{result_index}.txt"),
-                                  filter_result[2], 'w', "utf-8")
+                if MetadataStore.enabled:
+                    MetadataStore().add(path_to_directory, result_index, "filtered out", filter_result[1],
+                                        filter_result[2])
+                else:
+                    writer = FileWriter()
+                    writer.write_file(os.path.join(path_to_directory, "Bad", "Titles", f"{result_index}.txt"),
+                                      filter_result[1], 'w', "utf-8")
+                    writer.write_file(os.path.join(path_to_directory, "Bad", "Keywords", f"{result_index}.txt"),
+                                      filter_result[2], 'w', "utf-8")
                 result_index += 1
+            if digest is not None:
+                DuplicateFilter().add_file(digest, "filtered out")
+        if file is not None:
+            ResponseCache().store_file(file)  # Kept in the cache for later runs, then closed
         return result_index
 
+    # Writes the fields of a saved paper to the legacy layout, one file per field
+        # @param writer : The FileWriter to write with
+        # @param path_to_directory : The path to the directory where files are to be saved
+        # @param result_index : The numbering index of the paper
+        # @param filter_result : The returned filtering result
+        # @param abstract : The abstract for the file, if the source supplied one
+    def __write_fields(self, writer: FileWriter, path_to_directory: str, result_index: int, filter_result: tuple,
+                       abstract: str or None):
+        writer.write_file(os.path.join(path_to_directory, "Titles", f"{result_index}.txt"), filter_result[1], 'w',
+                          "utf-8")
+        writer.write_file(os.path.join(path_to_directory, "Keywords", f"{result_index}.txt"), filter_result[2], 'w',
+                          "utf-8")
+        writer.write_file(os.path.join(path_to_directory, "Authors", f"{result_index}.txt"), filter_result[3], 'w',
+                          "utf-8")
+        writer.write_file(os.path.join(path_to_directory, "ModDate", f"{result_index}.txt"), filter_result[4], 'w',
+                          "utf-8")
+        if abstract is not None:
+            writer.write_file(os.path.join(path_to_directory, "Abstracts", f"{result_index}.txt"), abstract, 'w',
+                              "utf-8")
+
     def check_paper_year(self, year_start, year_end, mod_date):
         year = int(mod_date[3:])
         return year_start <= year <= year_end
@@ -1,17 +1,66 @@
+import io
 import os
+import queue
+import shutil
+import threading
+import time
 
+from APG.Metrics import Metrics
 
+
+# Writes files atomically, through a temporary file that is renamed into place, so a crash never leaves a half-written
+#   file behind under its final name
+# With background on, writes are queued and made by a writer thread, so disk I/O never holds up network fetches
+#   Writes are made in batches, in the order they were queued, and work queued with after_writes runs once every
+#   write queued before it has been made
 class FileWriter:
+    background = True  # Whether writes are queued for the writer thread, instead of made by the caller
+    fsync = False  # Whether each batch of files is synced to the disk before it is renamed into place
+    queue_size = 64  # Writes waiting for the writer thread before callers wait
+    max_queued_bytes = 64 * 1024 * 1024  # Bytes held in memory by waiting writes before callers wait
+    batch_size = 32  # The most writes made, and synced, together
+    max_errors = 20  # Failed writes kept for the report
+    directories = set()  # Directories already created this run
+    writes = None
+    thread = None
+    owner = None  # ID of the process the writer thread runs in
+    files_written = 0
+    bytes_written = 0
+    batches = 0
+    error_count = 0
+    errors = []  # (path, error) of the first max_errors failed writes
+    queued_bytes = 0  # Bytes held in memory by the writes waiting for the writer thread
+    lock = threading.Lock()
+    space = threading.Condition(lock)  # Notified as the writer thread frees queued bytes
+
+    # Create a writer -- background None uses the class setting
+        # @param background : Boolean toggle that queues writes for the writer thread
+    def __init__(self, background: bool or None = None):
+        self.queued = self.background if background is None else background
+
+    # Change how files are written
+        # @param background : Whether writes are queued for the writer thread - None keeps current
+        # @param fsync : Whether files are synced to the disk before they are renamed into place - None keeps current
+    @classmethod
+    def configure(cls, background: bool or None = None, fsync: bool or None = None):
+        if background is not None:
+            cls.flush()  # Writes already queued are made before the setting changes
+            cls.background = background
+        if fsync is not None:
+            cls.fsync = fsync
 
     # CHeck if a path is valid and create any needed directories
+    # Directories that were already created are remembered, so they are not checked again for every file
         # @param path : The path to check, including the file name
     def __check_path(self, path: str):
         value = 0
         parent = os.path.dirname(path)  # Get the parent directory path
 
-        if parent:  # If path is not just a filename, check parent path
+        if parent and parent not in self.directories:  # If path is not just a filename, check parent path
             try:
                 os.makedirs(parent, exist_ok=True)  # Create all parent directories if needed
+                with self.lock:
+                    self.directories.add(parent)
             except PermissionError:
                 print(f"\nCannot create directory '{parent}' due to a permission error.", flush=True)
                 value = -1
@@ -25,17 +74,216 @@ class FileWriter:
         # @param content : The contents of the file
         # @param write_type : The writing mode to use for this file
     def write_file(self, path: str, content, write_type: str, encoding: str = None):
+        self.__submit(("write", path, content, write_type, encoding))
+
+    # Open a file at a specified path for writing in pieces, after verifying the path
+    # Returns the open file, which the caller must close, or None if the file could not be opened
+        # @param path : The path to write the file to, including file name
+        # @param write_type : The writing mode to use for this file
+        # @param encoding : The encoding to use for text files
+    def open_file(self, path: str, write_type: str, encoding: str = None):
         value = self.__check_path(path)
         if value == 0:
             try:
-                if encoding:
-                    file = open(path, write_type, encoding=encoding)
-                else:
-                    file = open(path, write_type)
-                file.write(content)
-                file.close()
+                return open(path, write_type, encoding=encoding)
             except Exception as e:
                 print("\nEncountered unexpected error when attempting to write to file: ", e, flush=True)
+        return None
+
+    # Copy the contents of an open file to a specified path, after verifying the path
+    # The source is closed once it has been copied, so the caller must not use it again
+        # @param path : The path to write the file to, including file name
+        # @param source : The open binary file to copy from -- it is read from the start
+    def copy_file(self, path: str, source):
+        self.__submit(("copy", path, source, 'wb', None))
+
+    # Run a function once every write queued before it has been made, such as recording that the files were saved
+        # @param function : The function to run
+        # @param args : The arguments to call it with
+    def after_writes(self, function, *args):
+        self.__submit(("call", function, args, None, None))
+
+    # Queue a write for the writer thread, or make it straight away when writes are not queued
+    # Writes from another process, such as a conversion worker, or from the writer thread itself, are always made
+    #   straight away
+    # Callers wait while the queue holds queue_size writes or max_queued_bytes bytes in memory, so fetching never
+    #   runs far ahead of the disk -- a single write larger than max_queued_bytes waits for the queue to empty
+        # @param item : (kind, path or function, content or source or args, write type, encoding)
+    def __submit(self, item: tuple):
+        cls = type(self)
+        if not self.queued or cls.owner not in (None, os.getpid()) or threading.current_thread() is cls.thread:
+            self.__run_batch([item])
+            return
+        size = self.__memory_size(item)
+        with cls.space:
+            if cls.thread is None:
+                cls.writes = queue.Queue(self.queue_size)
+                cls.owner = os.getpid()
+                cls.thread = threading.Thread(target=cls.__write_queued, daemon=True)
+                cls.thread.start()
+            while cls.queued_bytes and cls.queued_bytes + size > cls.max_queued_bytes:
+                cls.space.wait()
+            cls.queued_bytes += size
+        cls.writes.put((item, size))  # Blocks while the queue is full
+
+    # Get how many bytes a write holds in memory while it waits -- files already spilled to the disk hold none
+        # @param item : (kind, path or function, content or source or args, write type, encoding)
+    @staticmethod
+    def __memory_size(item: tuple):
+        kind, _, content, _, _ = item
+        if kind == "write":
+            return len(content)
+        if kind == "copy":
+            if isinstance(content, io.BytesIO):
+                return content.getbuffer().nbytes
+        return 0
+
+    # Writer thread -- makes queued writes in batches of whatever has been queued since the last batch
+    @classmethod
+    def __write_queued(cls):
+        writer = cls(background=False)
+        while True:
+            queued = [cls.writes.get()]
+            while len(queued) < cls.batch_size:
+                try:
+                    queued.append(cls.writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                writer.__run_batch([item for item, _ in queued])
+            finally:
+                with cls.space:
+                    cls.queued_bytes -= sum(size for _, size in queued)
+                    cls.space.notify_all()
+                for _ in queued:
+                    cls.writes.task_done()
+
+    # Make a batch of writes: each file is written to a temporary file beside it, synced if fsync is on, and renamed
+    #   into place, and queued functions run once the writes before them have been made
+        # @param items : The queued writes, in the order they were queued
+    def __run_batch(self, items: list):
+        start = time.perf_counter()
+        staged = []  # (temporary path, path, size) of files waiting to be renamed into place
+        calls = []
+        for kind, target, content, write_type, encoding in items:
+            if kind == "call":
+                calls.append((target, content))
+                continue
+            staged_file = self.__stage(target, content, write_type, encoding, kind == "copy")
+            if staged_file is not None:
+                staged.append(staged_file)
+
+        synced = set()
+        for temp_path, path, size in staged:
+            try:
+                os.replace(temp_path, path)
+            except OSError as e:
+                self.__discard(temp_path)
+                self.__record_error(path, e)
+                continue
+            synced.add(os.path.dirname(path))
+            with self.lock:
+                type(self).files_written += 1
+                type(self).bytes_written += size
+        if self.fsync:
+            for directory in synced:  # The renames themselves reach the disk once per directory, not once per file
+                self.__sync_directory(directory)
+        if staged:
+            with self.lock:
+                type(self).batches += 1
+            Metrics.observe("write", time.perf_counter() - start)
+
+        for function, args in calls:
+            try:
+                function(*args)
+            except Exception as e:
+                self.__record_error(getattr(function, "__qualname__", repr(function)), e)
+
+    # Write a file's contents to a temporary file beside it
+    # Returns (temporary path, path, size), or None if it could not be written
+        # @param path : The path to write the file to, including file name
+        # @param content : The contents of the file, or the open binary file to copy from
+        # @param write_type : The writing mode to use for this file
+        # @param encoding : The encoding to use for text files
+        # @param is_copy : Boolean toggle that copies content from an open file, and closes it
+    def __stage(self, path: str, content, write_type: str, encoding: str or None, is_copy: bool):
+        temp_path = os.path.join(os.path.dirname(path),
+                                 f".{os.path.basename(path)}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            if self.__check_path(path) != 0:
+                self.__record_error(path, OSError(f"Cannot create directory '{os.path.dirname(path)}'"), False)
+                return None
+            try:
+                file = open(temp_path, write_type, encoding=encoding)
+            except FileNotFoundError:  # The directory was removed since it was created
+                with self.lock:
+                    self.directories.discard(os.path.dirname(path))
+                if self.__check_path(path) != 0:
+                    self.__record_error(path, OSError(f"Cannot create directory '{os.path.dirname(path)}'"), False)
+                    return None
+                file = open(temp_path, write_type, encoding=encoding)
+            with file:
+                if is_copy:
+                    content.seek(0)
+                    shutil.copyfileobj(content, file)
+                else:
+                    file.write(content)
+                size = file.tell()
+                if self.fsync:
+                    file.flush()
+                    os.fsync(file.fileno())
+            return temp_path, path, size
+        except Exception as e:
+            self.__discard(temp_path)
+            self.__record_error(path, e)
+            return None
+        finally:
+            if is_copy:
+                content.close()
+
+    # Sync a directory, so the files renamed into it survive a power loss
+        # @param directory : The directory's path
+    def __sync_directory(self, directory: str):
+        try:
+            fd = os.open(directory or ".", os.O_RDONLY)
+        except OSError:
+            return  # Directories cannot be opened on some platforms, such as Windows
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    # Remove a temporary file left by a failed write, if it exists
+        # @param temp_path : The temporary file's path
+    @staticmethod
+    def __discard(temp_path: str):
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+    # Report a failed write, and keep it for the end of run report
+        # @param path : The path that could not be written, or the function that failed
+        # @param error : The error
+        # @param show : Boolean toggle that prints the error, for errors that were not printed already
+    @classmethod
+    def __record_error(cls, path: str, error: Exception, show: bool = True):
+        if show:
+            print(f"\nEncountered unexpected error when attempting to write to file '{path}': {error}", flush=True)
+        with cls.lock:
+            cls.error_count += 1
+            if len(cls.errors) < cls.max_errors:
+                cls.errors.append((path, str(error)))
+
+    # Wait until every queued write has been made
+    # Returns how many writes have failed this run
+    @classmethod
+    def flush(cls):
+        if cls.thread is not None and cls.owner == os.getpid():
+            cls.writes.join()
+        return cls.error_count
 
     # Remove a file, if it exists
         # @param path : The file's path
@@ -44,3 +292,19 @@ class FileWriter:
             os.remove(path)
         else:
             print(f"\nPath '{path}' does not exist.", flush=True)
+
+    # Get the write statistics for this run, once every queued write has been made
+    @classmethod
+    def get_stats(cls):
+        cls.flush()
+        with cls.lock:
+            return {"background": cls.background, "fsync": cls.fsync, "files_written": cls.files_written,
+                    "bytes_written": cls.bytes_written, "batches": cls.batches, "errors": cls.error_count,
+                    "failed_writes": [{"path": path, "error": error} for path, error in cls.errors]}
+
+    # Get a printable summary of the files written this run, once every queued write has been made
+    @classmethod
+    def get_summary(cls):
+        cls.flush()
+        with cls.lock:
+            return f"\n\tFiles Written: {cls.files_written}\n\tWrite Errors: {cls.error_count}"
@@ -0,0 +1,110 @@
+import re
+
+
+class IdentityResolver:
+    min_title_words = 4  # Shorter titles (such as "Introduction") are too common to identify a paper by
+    arxiv_pattern = re.compile(r"arxiv\.org/(?:abs|pdf)/((?:\d{4}\.\d{4,5})|(?:[a-z\-]+(?:\.[a-z]{2})?/\d{7}))",
+                               re.IGNORECASE)
+    doi_pattern = re.compile(r"\b(10\.\d{4,9}/[^\s?#&]+)", re.IGNORECASE)
+    tag_pattern = re.compile(r"^(\s*\[[^\]]*\])+")  # Tags Google Scholar puts before titles, such as [PDF][PDF]
+
+    # Method that gets the normalized form of a title, used to match the same paper across sources
+        # @param title : The title of the result
+    def normalize_title(self, title: str or None):
+        if not title or title == "No title":
+            return None
+        words = re.findall(r"[a-z0-9]+", self.tag_pattern.sub("", title).lower())
+        return " ".join(words) if len(words) >= self.min_title_words else None
+
+    # Method that gets every identity key of a result, from its title, links, and Google Scholar identifier
+        # @param result : A single scraped result from Google Scholar or ArXiv
+    def get_keys(self, result: dict):
+        keys = set()
+        title = self.normalize_title(result.get('title'))
+        if title is not None:
+            keys.add(f"title:{title}")
+        for link in (result.get('link'), result.get('file_link')):
+            if not link:
+                continue
+            arxiv_id = self.arxiv_pattern.search(link)
+            if arxiv_id is not None:
+                keys.add(f"arxiv:{arxiv_id.group(1).lower()}")
+            doi = self.doi_pattern.search(link)
+            if doi is not None:
+                doi = re.sub(r"(\.pdf|/full|/abstract|/pdf)$", "", doi.group(1).rstrip(".,;)/").lower())
+                arxiv_doi = re.fullmatch(r"10\.48550/arxiv\.(.+)", doi)  # arXiv's own DOIs name the arXiv ID
+                keys.add(f"arxiv:{arxiv_doi.group(1)}" if arxiv_doi else f"doi:{doi}")
+        scholar_id = result.get('scholar_id')
+        if scholar_id and scholar_id != "No ID":
+            keys.add(f"scholar:{scholar_id}")
+        return keys
+
+    # Method that ranks how cheaply a result's file can be fetched, lower being cheaper
+    # ArXiv results come from its first-party API with a known PDF link and abstract, so they are cheapest, then
+    #   direct file links (ArXiv ones first), then pages that still have to be searched for files
+        # @param source : The name of the results list the result is from
+        # @param result : The result
+    def get_cost(self, source: str, result: dict):
+        if source == "arxiv":
+            return 0 if result.get('link') else 4
+        file_link = result.get('file_link')
+        if file_link:
+            return 1 if self.arxiv_pattern.search(file_link) else 2
+        return 3 if result.get('link') else 4
+
+    # Method that finds results in any of the lists that are the same paper, before anything is downloaded
+    # Results sharing any key are grouped with a union-find, and every result but the cheapest of each group is
+    #   marked with 'duplicate_of', naming the list and position of the result that will be fetched instead
+    # Returns how many results were marked
+        # @param results_by_source : Dictionary of results lists by the name of their source, such as "scholar"
+    def resolve(self, results_by_source: dict):
+        entries = [(source, position) for source, results in results_by_source.items()
+                   for position in range(len(results))]
+        parent = list(range(len(entries)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]  # Path halving keeps the trees flat
+                i = parent[i]
+            return i
+
+        owner = {}  # Key -> the first entry seen with it
+        for i, (source, position) in enumerate(entries):
+            results_by_source[source][position].pop('duplicate_of', None)
+            for key in self.get_keys(results_by_source[source][position]):
+                if key in owner:
+                    parent[find(i)] = find(owner[key])
+                else:
+                    owner[key] = i
+
+        groups = {}
+        for i in range(len(entries)):
+            groups.setdefault(find(i), []).append(i)
+        marked = 0
+        for members in groups.values():
+            if len(members) < 2:
+                continue
+            best = min(members, key=lambda i: (self.get_cost(entries[i][0],
+                                                             results_by_source[entries[i][0]][entries[i][1]]), i))
+            for i in members:
+                if i != best:
+                    source, position = entries[i]
+                    results_by_source[source][position]['duplicate_of'] = {"source": entries[best][0],
+                                                                           "position": entries[best][1]}
+                    marked += 1
+        return marked
+
+    # Method that checks a single result as it is scraped, for when files are gathered before every list is complete
+    # The first result seen with a key keeps it, so a later result sharing any key is the same paper as that one --
+    #   unlike resolve, the cheapest copy cannot be chosen, because the first copy may already be downloading
+    # Returns the (source, position) of the earlier result, or None if the result is a new paper
+        # @param owners : Dictionary of identity keys to the (source, position) of the result that claimed them
+        # @param source : The name of the results list the result is from
+        # @param position : The position of the result in its list
+        # @param result : The result
+    def claim(self, owners: dict, source: str, position: int, result: dict):
+        keys = self.get_keys(result)
+        owner = next((owners[key] for key in sorted(keys) if key in owners), None)
+        for key in keys:
+            owners.setdefault(key, owner or (source, position))
+        return owner
@@ -0,0 +1,75 @@
+import json
+import os
+
+from APG.FileWriter import FileWriter
+
+
+class Journal:
+    file_name = "progress.jsonl"
+
+    # Method that opens the progress journal of an output directory
+    # Without resuming, any previous journal is started over, just like the files it describes
+        # @param path_to_directory : The path to the directory where files are saved
+        # @param resume : Boolean toggle that loads the previous journal so completed results can be skipped
+    def __init__(self, path_to_directory: str, resume: bool):
+        self.path = os.path.join(path_to_directory, self.file_name)
+        self.completed = {}  # Result position -> URL of that result
+        self.next_index = 1
+        os.makedirs(path_to_directory, exist_ok=True)
+        if resume:
+            self.__load()
+        self.file = open(self.path, 'a' if resume else 'w', encoding="utf-8")
+
+    # Method that reads every record from a previous run
+    # A crash can leave the last line half written, so lines that cannot be parsed are ignored
+    def __load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self.completed[record["position"]] = record["url"]
+                self.next_index = max(self.next_index, record["next_index"])
+        if self.completed:
+            print(f"\nResuming after {len(self.completed)} completed results, numbering from {self.next_index}.",
+                  flush=True)
+
+    # Method that checks whether a result was already completed by a previous run
+        # @param position : The position of the result in the results list
+        # @param url : The URL of the result -- a different URL means the results list changed
+    def is_done(self, position: int, url: str or None):
+        return position in self.completed and self.completed[position] == url
+
+    # Method that appends the outcome of a result
+    # The record is written once every file queued before it has been written, and makes sure it reaches the disk,
+    #   so the journal never says a result was saved before its files were
+        # @param position : The position of the result in the results list
+        # @param url : The URL of the result
+        # @param outcome : What happened to the result, such as "saved", "filtered", or "no file"
+        # @param first_index : The first numbering index given to this result's files
+        # @param next_index : The numbering index the next result starts from
+        # @param aliases : The files of this result that were copies of files already handled, and what they copied
+    def record(self, position: int, url: str or None, outcome: str, first_index: int, next_index: int,
+               aliases: list or None = None):
+        record = {"position": position, "url": url, "outcome": outcome,
+                  "indices": list(range(first_index, next_index)), "next_index": next_index}
+        if aliases:
+            record["aliases"] = aliases
+        FileWriter().after_writes(self.__append, json.dumps(record) + "\n")
+        self.completed[position] = url
+        self.next_index = next_index
+
+    # Method that writes a record to the end of the journal file and syncs it to the disk
+        # @param line : The record, as a line of JSON
+    def __append(self, line: str):
+        self.file.write(line)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    # Method that closes the journal, once every queued write has been made
+    def close(self):
+        FileWriter.flush()
+        self.file.close()
@@ -0,0 +1,133 @@
+import os
+import sqlite3
+import threading
+
+
+# Single SQLite file holding the fields of every paper saved to, or filtered out of, an output directory
+# It replaces the Titles, Keywords, Authors, ModDate, Abstracts, and Bad folders, which hold one tiny file per field
+#   per paper, and export rebuilds those folders for tools that still read them
+class MetadataStore:
+    file_name = "metadata.sqlite3"
+    enabled = False  # Whether gathering saves fields to the store instead of to one file each
+    folders = {"title": "Titles", "keywords": "Keywords", "authors": "Authors", "mod_date": "ModDate",
+               "abstract": "Abstracts"}  # Field -> legacy folder of the papers that were saved
+    bad_folders = {"title": os.path.join("Bad", "Titles"),
+                   "keywords": os.path.join("Bad", "Keywords")}  # Field -> legacy folder of filtered out papers
+    fields = ("idx", "outcome", "title", "keywords", "authors", "mod_date", "abstract", "digest")
+    connections = {}  # (process ID, directory) -> open connection, since connections cannot cross a fork
+    pending = {}  # Directory -> rows waiting to be written
+    lock = threading.Lock()
+
+    # Method that gets the path of the store of an output directory
+        # @param path_to_directory : The output directory
+    def get_path(self, path_to_directory: str):
+        return os.path.join(path_to_directory, self.file_name)
+
+    # Method that checks whether an output directory has a store
+        # @param path_to_directory : The output directory
+    def exists(self, path_to_directory: str):
+        return os.path.exists(self.get_path(path_to_directory))
+
+    # Method that opens the store of an output directory, creating it if needed -- must be called with the lock held
+        # @param path_to_directory : The output directory
+    def __get_connection(self, path_to_directory: str):
+        key = (os.getpid(), os.path.abspath(path_to_directory))
+        connection = self.connections.get(key)
+        if connection is None:
+            os.makedirs(path_to_directory, exist_ok=True)
+            # Conversion workers may update abstracts at the same time, so writers wait their turn
+            connection = sqlite3.connect(self.get_path(path_to_directory), timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS papers (idx INTEGER PRIMARY KEY, outcome TEXT NOT NULL, "
+                               "title TEXT, keywords TEXT, authors TEXT, mod_date TEXT, abstract TEXT, digest TEXT)")
+            connection.commit()
+            self.connections[key] = connection
+        return connection
+
+    # Method that queues the fields of a paper to be written on the next flush
+        # @param path_to_directory : The output directory
+        # @param index : The numbering index of the paper
+        # @param outcome : "saved" for papers saved to Articles, or "filtered out"
+        # @param title : The title of the paper
+        # @param keywords : The keywords of the paper
+        # @param authors : The author(s) of the paper - None for filtered out papers
+        # @param mod_date : The modification date of the paper - None for filtered out papers
+        # @param abstract : The abstract of the paper, if the source supplied one
+        # @param digest : The SHA-256 hex digest of the paper's file
+    def add(self, path_to_directory: str, index: int, outcome: str, title: str, keywords: str,
+            authors: str or None = None, mod_date: str or None = None, abstract: str or None = None,
+            digest: str or None = None):
+        with self.lock:
+            self.pending.setdefault(os.path.abspath(path_to_directory), []).append(
+                (index, outcome, title, keywords, authors, mod_date, abstract, digest))
+
+    # Method that writes every queued paper of an output directory in one transaction
+    # Called before a result is recorded in the progress journal, so the journal never gets ahead of the store
+        # @param path_to_directory : The output directory
+    def flush(self, path_to_directory: str):
+        with self.lock:
+            rows = self.pending.pop(os.path.abspath(path_to_directory), None)
+            if not rows:
+                return
+            connection = self.__get_connection(path_to_directory)
+            with connection:
+                connection.executemany(f"INSERT OR REPLACE INTO papers ({', '.join(self.fields)}) "
+                                       f"VALUES ({', '.join('?' * len(self.fields))})", rows)
+
+    # Method that forgets every paper of an output directory, because a new run is about to number papers from 1
+        # @param path_to_directory : The output directory
+    def forget(self, path_to_directory: str):
+        if not self.exists(path_to_directory):
+            return
+        with self.lock:
+            self.pending.pop(os.path.abspath(path_to_directory), None)
+            connection = self.__get_connection(path_to_directory)
+            with connection:
+                connection.execute("DELETE FROM papers")
+
+    # Method that gets the fields of a paper
+    # Returns a dictionary of the fields, or None if the paper is not in the store
+        # @param path_to_directory : The output directory
+        # @param index : The numbering index of the paper
+    def get_paper(self, path_to_directory: str, index: int):
+        with self.lock:
+            row = self.__get_connection(path_to_directory).execute(
+                f"SELECT {', '.join(self.fields)} FROM papers WHERE idx = ?", (index,)).fetchone()
+        return dict(zip(self.fields, row)) if row is not None else None
+
+    # Method that sets the abstract of a paper, such as one found while converting it
+        # @param path_to_directory : The output directory
+        # @param index : The numbering index of the paper
+        # @param abstract : The abstract
+    def set_abstract(self, path_to_directory: str, index: int, abstract: str):
+        with self.lock:
+            connection = self.__get_connection(path_to_directory)
+            with connection:
+                connection.execute("UPDATE papers SET abstract = ? WHERE idx = ?", (abstract, index))
+
+    # Method that gets the fields of every paper in an output directory, in numbering order
+        # @param path_to_directory : The output directory
+    def iter_papers(self, path_to_directory: str):
+        with self.lock:
+            rows = self.__get_connection(path_to_directory).execute(
+                f"SELECT {', '.join(self.fields)} FROM papers ORDER BY idx").fetchall()
+        for row in rows:
+            yield dict(zip(self.fields, row))
+
+    # Method that rebuilds the legacy folders of an output directory from its store, one file per field per paper
+    # Returns how many papers were exported
+        # @param path_to_directory : The output directory
+    def export(self, path_to_directory: str):
+        for folder in list(self.folders.values()) + list(self.bad_folders.values()):
+            os.makedirs(os.path.join(path_to_directory, folder), exist_ok=True)
+        exported = 0
+        for paper in self.iter_papers(path_to_directory):
+            folders = self.folders if paper["outcome"] == "saved" else self.bad_folders
+            for field, folder in folders.items():
+                if paper[field] is not None:
+                    with open(os.path.join(path_to_directory, folder, f"{paper['idx']}.txt"), 'w',
+                              encoding="utf-8") as f:
+                        f.write(paper[field])
+            exported += 1
+        return exported
@@ -0,0 +1,179 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource  # Only available on Unix-like systems
+except ImportError:
+    resource = None
+
+
+class Metrics:
+    # Upper bounds of the latency histogram buckets, in seconds -- the last bucket holds everything slower
+    bucket_bounds = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    report_name = "run_report.json"
+    prometheus_name = "metrics.prom"
+    histograms = {}  # Stage -> {"buckets": counts per bucket, "count": observations, "sum": seconds, "max": seconds}
+    counters = {}  # Name -> running total, such as bytes downloaded
+    statuses = {}  # Host -> {status code (or error name) -> responses}
+    sleep_seconds = 0.0  # Time spent waiting on rate budgets, summed across every thread
+    started = time.monotonic()
+    lock = threading.Lock()
+
+    # Method that clears everything recorded and restarts the run clock
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.histograms = {}
+            cls.counters = {}
+            cls.statuses = {}
+            cls.sleep_seconds = 0.0
+            cls.started = time.monotonic()
+
+    # Method that records how long one piece of work in a stage took
+        # @param stage : The name of the stage, such as "fetch" or "filter"
+        # @param seconds : How long the work took
+    @classmethod
+    def observe(cls, stage: str, seconds: float):
+        with cls.lock:
+            histogram = cls.histograms.get(stage)
+            if histogram is None:
+                histogram = cls.histograms[stage] = {"buckets": [0] * (len(cls.bucket_bounds) + 1), "count": 0,
+                                                     "sum": 0.0, "max": 0.0}
+            bucket = next((i for i, bound in enumerate(cls.bucket_bounds) if seconds <= bound),
+                          len(cls.bucket_bounds))
+            histogram["buckets"][bucket] += 1
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+            histogram["max"] = max(histogram["max"], seconds)
+
+    # Method that times the work done inside a with block and records it under a stage
+        # @param stage : The name of the stage
+    @classmethod
+    @contextmanager
+    def timed(cls, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.observe(stage, time.perf_counter() - start)
+
+    # Method that adds to a running total
+        # @param name : The name of the total, such as "bytes_downloaded"
+        # @param amount : How much to add
+    @classmethod
+    def add(cls, name: str, amount: float = 1):
+        with cls.lock:
+            cls.counters[name] = cls.counters.get(name, 0) + amount
+
+    # Method that records the status of a response from a host, or the error that stopped it
+        # @param host : The host the request was sent to
+        # @param status : The HTTP status code, or the name of the exception raised
+    @classmethod
+    def record_status(cls, host: str, status):
+        with cls.lock:
+            by_status = cls.statuses.setdefault(host, {})
+            by_status[str(status)] = by_status.get(str(status), 0) + 1
+
+    # Method that records time spent sleeping rather than working
+        # @param seconds : How long was slept
+    @classmethod
+    def record_sleep(cls, seconds: float):
+        with cls.lock:
+            cls.sleep_seconds += seconds
+
+    # Method that gets the peak resident memory of this process and of its finished worker processes, in bytes
+    # Returns None for each where the platform cannot tell
+    @staticmethod
+    def peak_rss():
+        if resource is None:
+            return None, None
+        # Linux reports kilobytes and macOS reports bytes
+        scale = 1 if sys.platform == "darwin" else 1024
+        return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+    # Method that builds the run report from everything recorded so far
+        # @param command : The subcommand that was run
+        # @param extra : Any further sections to include, such as the connection statistics
+    @classmethod
+    def report(cls, command: str, extra: dict or None = None):
+        peak_self, peak_children = cls.peak_rss()
+        with cls.lock:
+            wall = time.monotonic() - cls.started
+            stages = {}
+            for stage, histogram in sorted(cls.histograms.items()):
+                stages[stage] = {"count": histogram["count"], "total_seconds": round(histogram["sum"], 6),
+                                 "mean_seconds": round(histogram["sum"] / histogram["count"], 6),
+                                 "max_seconds": round(histogram["max"], 6),
+                                 "buckets": {str(bound): count for bound, count in
+                                             zip(cls.bucket_bounds + ("+Inf",), histogram["buckets"])}}
+            # Stage totals are not added up: stages nest and run in many threads and processes at once, so their sum
+            #   is neither the wall time nor the CPU time of the run
+            report = {"command": command, "wall_seconds": round(wall, 3),
+                      "sleep_seconds": round(cls.sleep_seconds, 3),
+                      "stages": stages, "counters": dict(cls.counters),
+                      "statuses": {host: dict(by_status) for host, by_status in sorted(cls.statuses.items())},
+                      "peak_rss_bytes": peak_self, "peak_worker_rss_bytes": peak_children}
+        report.update(extra or {})
+        return report
+
+    # Method that saves the run report to the output directory as JSON, and optionally in Prometheus text format
+    # Returns the path of the JSON report
+        # @param path_to_directory : The output directory
+        # @param command : The subcommand that was run
+        # @param prometheus : Boolean toggle that also writes the metrics for a Prometheus textfile collector
+        # @param extra : Any further sections to include in the JSON report
+    @classmethod
+    def export(cls, path_to_directory: str, command: str, prometheus: bool = False, extra: dict or None = None):
+        report = cls.report(command, extra)
+        path = os.path.join(path_to_directory, cls.report_name)
+        cls.__write(path, json.dumps(report, indent=2))
+        if prometheus:
+            cls.__write(os.path.join(path_to_directory, cls.prometheus_name), cls.__to_prometheus(report))
+        return path
+
+    # Method that writes a file in one step, so a reader never sees it half written
+        # @param path : The path of the file
+        # @param text : The contents of the file
+    @staticmethod
+    def __write(path: str, text: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        with os.fdopen(handle, 'w', encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temp_path, path)
+
+    # Method that formats a run report in the Prometheus text exposition format
+        # @param report : The run report, as returned by report
+    @classmethod
+    def __to_prometheus(cls, report: dict):
+        lines = ["# TYPE apg_stage_seconds histogram"]
+        with cls.lock:
+            histograms = {stage: dict(histogram) for stage, histogram in cls.histograms.items()}
+        for stage, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(cls.bucket_bounds + ("+Inf",), histogram["buckets"]):
+                cumulative += count
+                lines.append(f'apg_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'apg_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+            lines.append(f'apg_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+        lines.append("# TYPE apg_http_responses_total counter")
+        for host, by_status in report["statuses"].items():
+            for status, count in sorted(by_status.items()):
+                lines.append(f'apg_http_responses_total{{host="{host}",status="{status}"}} {count}')
+        for name, value in sorted(report["counters"].items()):
+            lines.append(f"# TYPE apg_{name}_total counter")
+            lines.append(f"apg_{name}_total {value}")
+        lines.append("# TYPE apg_sleep_seconds_total counter")
+        lines.append(f"apg_sleep_seconds_total {report['sleep_seconds']}")
+        lines.append("# TYPE apg_wall_seconds gauge")
+        lines.append(f"apg_wall_seconds {report['wall_seconds']}")
+        if report["peak_rss_bytes"] is not None:
+            lines.append("# TYPE apg_peak_rss_bytes gauge")
+            lines.append(f"apg_peak_rss_bytes {report['peak_rss_bytes']}")
+        return "\n".join(lines) + "\n"
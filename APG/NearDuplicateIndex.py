@@ -0,0 +1,227 @@
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import threading
+from array import array
+
+
+class NearDuplicateIndex:
+    threshold = 0.8  # Estimated Jaccard similarity at which two papers are near-duplicates - 0 turns checking off
+    num_perm = 128  # How many hash functions each signature is made from
+    shingle_size = 3  # How many words each shingle holds
+    min_words = 4  # Texts with fewer words (such as one-word titles) are too short to compare
+    index_path = None  # SQLite file the signatures are kept in between runs - None keeps them in memory only
+    connection = None
+    bands = None  # (bands, rows) of the LSH table, chosen from the threshold
+    duplicateCount = 0  # Near-duplicates found this run
+    lock = threading.Lock()
+
+    prime = (1 << 61) - 1
+    permutations = None  # (a, b) of each hash function, made on first use
+
+    # Method that sets where signatures are kept and how similar two papers must be to count as near-duplicates
+        # @param path : The path of the index file - None keeps signatures in memory only
+        # @param threshold : The similarity, from 0 to 1, at which papers are near-duplicates - None keeps current
+    @classmethod
+    def configure(cls, path: str or None, threshold: float or None = None):
+        with cls.lock:
+            if cls.connection is not None:
+                cls.connection.close()
+            cls.connection = None
+            cls.bands = None
+            cls.index_path = path
+            if threshold is not None:
+                cls.threshold = threshold
+
+    # Method that builds the MinHash signature of a text from its normalized word shingles
+    # Returns None if the text is too short to compare
+        # @param text : The text, such as a title, abstract, and first page joined together
+    @classmethod
+    def signature(cls, text: str):
+        if cls.permutations is None:
+            # Hash functions are (a * x + b) mod a Mersenne prime, from a fixed seed so signatures match between runs
+            generator = random.Random(cls.num_perm)
+            cls.permutations = [(generator.randrange(1, cls.prime), generator.randrange(0, cls.prime))
+                                for _ in range(cls.num_perm)]
+        words = re.findall(r"[a-z0-9]+", text.lower())
+        if len(words) < cls.min_words:
+            return None
+        size = min(cls.shingle_size, len(words))
+        hashes = {int.from_bytes(hashlib.blake2b(" ".join(words[i:i + size]).encode(), digest_size=8).digest(),
+                                 "big") % cls.prime
+                  for i in range(len(words) - size + 1)}
+        return [min((a * h + b) % cls.prime for h in hashes) for a, b in cls.permutations]
+
+    # Method that estimates the Jaccard similarity of two texts from their signatures
+        # @param first : The signature of the first text
+        # @param second : The signature of the second text
+    @staticmethod
+    def similarity(first: list, second: list):
+        return sum(1 for x, y in zip(first, second) if x == y) / len(first)
+
+    # Method that chooses how signatures are split into LSH bands
+    # Papers share a bucket when one whole band matches, which happens most often around (1 / bands) ^ (1 / rows)
+    #   similarity, so the split whose curve centers closest below the threshold is used -- candidates are then
+    #   confirmed with their full signatures, so finding extra candidates only costs time
+    @classmethod
+    def __choose_bands(cls):
+        best = None
+        for rows in range(1, cls.num_perm + 1):
+            bands = cls.num_perm // rows
+            center = (1 / bands) ** (1 / rows)
+            if center <= cls.threshold and (best is None or center > best[0]):
+                best = (center, bands, rows)
+        return best[1:] if best is not None else (cls.num_perm, 1)
+
+    # Method that opens the index file, creating it if needed -- must be called with the lock held
+    @classmethod
+    def __get_connection(cls):
+        if cls.connection is None:
+            if cls.index_path is not None:
+                os.makedirs(os.path.dirname(os.path.abspath(cls.index_path)), exist_ok=True)
+            connection = sqlite3.connect(cls.index_path or ":memory:", isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS signatures (paper TEXT PRIMARY KEY, folder TEXT NOT NULL, "
+                               "signature BLOB NOT NULL, duplicate_of TEXT) WITHOUT ROWID")
+            connection.execute("CREATE INDEX IF NOT EXISTS signatures_folder ON signatures (folder)")
+            connection.execute("CREATE TABLE IF NOT EXISTS buckets (band INTEGER NOT NULL, bucket INTEGER NOT NULL, "
+                               "paper TEXT NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS buckets_lookup ON buckets (band, bucket)")
+            connection.execute("CREATE INDEX IF NOT EXISTS buckets_paper ON buckets (paper)")
+            connection.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            cls.connection = connection
+        if cls.bands is None:
+            cls.bands = cls.__choose_bands()
+            stored = cls.connection.execute("SELECT value FROM settings WHERE name = 'bands'").fetchone()
+            if stored is not None and stored[0] != f"{cls.bands[0]}x{cls.bands[1]}":
+                cls.__rebuild_buckets()  # The threshold changed since the buckets were made
+            cls.connection.execute("INSERT OR REPLACE INTO settings VALUES ('bands', ?)",
+                                   (f"{cls.bands[0]}x{cls.bands[1]}",))
+        return cls.connection
+
+    # Method that gets the LSH bucket of every band of a signature
+        # @param signature : The signature
+    @classmethod
+    def __buckets(cls, signature: list):
+        bands, rows = cls.bands
+        return [(band, int.from_bytes(hashlib.blake2b(array('Q', signature[band * rows:(band + 1) * rows]).tobytes(),
+                                                      digest_size=8).digest(), "big", signed=True))
+                for band in range(bands)]
+
+    # Method that puts every stored signature back into buckets, after the band split changed
+    @classmethod
+    def __rebuild_buckets(cls):
+        cls.connection.execute("DELETE FROM buckets")
+        for paper, blob in cls.connection.execute("SELECT paper, signature FROM signatures").fetchall():
+            cls.connection.executemany("INSERT INTO buckets VALUES (?, ?, ?)",
+                                       [(band, bucket, paper) for band, bucket in cls.__buckets(array('Q', blob))])
+
+    # Method that gets the key a paper is stored under, which is its file path relative to the index, without suffix
+        # @param path_to_directory : The folder the paper is saved in
+        # @param index : The numbering index of the paper
+    def paper_key(self, path_to_directory: str, index):
+        root = os.path.dirname(os.path.abspath(self.index_path)) if self.index_path else os.getcwd()
+        return os.path.relpath(os.path.join(os.path.abspath(path_to_directory), "Articles", str(index)),
+                               root).replace(os.sep, "/")
+
+    # Method that forgets every paper saved to a folder, because a new run is about to overwrite its files
+        # @param path_to_directory : The folder the papers were saved in
+    def forget(self, path_to_directory: str):
+        cls = type(self)
+        with cls.lock:
+            if cls.index_path is None and cls.connection is None:
+                return
+            connection = self.__get_connection()
+            folder = os.path.dirname(os.path.dirname(self.paper_key(path_to_directory, 0)))
+            connection.execute("BEGIN")
+            connection.execute("DELETE FROM buckets WHERE paper IN (SELECT paper FROM signatures WHERE folder = ?)",
+                               (folder,))
+            connection.execute("DELETE FROM signatures WHERE folder = ?", (folder,))
+            connection.execute("COMMIT")
+
+    # Method that finds the stored paper most similar to a signature, among those sharing an LSH bucket with it
+    # Returns the key of the paper if it is at least as similar as the threshold, and None otherwise
+    # Must be called with the lock held
+        # @param signature : The signature to look up
+        # @param exclude : The key of a paper to leave out, such as the paper itself
+    def __find_similar(self, signature: list, exclude: str or None):
+        connection = self.__get_connection()
+        candidates = set()
+        for band, bucket in self.__buckets(signature):
+            candidates.update(paper for (paper,) in connection.execute(
+                "SELECT paper FROM buckets WHERE band = ? AND bucket = ?", (band, bucket)))
+        candidates.discard(exclude)
+        best = None
+        for paper in sorted(candidates):
+            row = connection.execute("SELECT signature FROM signatures WHERE paper = ?", (paper,)).fetchone()
+            score = self.similarity(signature, array('Q', row[0])) if row is not None else 0
+            if score >= self.threshold and (best is None or score > best[0]):
+                best = (score, paper)
+        return best[1] if best is not None else None
+
+    # Method that stores a paper's signature, replacing any signature it had before -- must be called with the lock held
+        # @param key : The key of the paper
+        # @param signature : The signature of the paper
+        # @param duplicate_of : The key of the paper this one is a near-duplicate of, if any
+    def __store(self, key: str, signature: list, duplicate_of: str or None):
+        connection = self.__get_connection()
+        connection.execute("BEGIN")
+        connection.execute("DELETE FROM buckets WHERE paper = ?", (key,))
+        connection.execute("INSERT OR REPLACE INTO signatures VALUES (?, ?, ?, ?)",
+                           (key, os.path.dirname(os.path.dirname(key)), array('Q', signature).tobytes(),
+                            duplicate_of))
+        connection.executemany("INSERT INTO buckets VALUES (?, ?, ?)",
+                               [(band, bucket, key) for band, bucket in self.__buckets(signature)])
+        connection.execute("COMMIT")
+
+    # Method that checks a paper about to be saved against every stored paper, and stores it if it is not a
+    #   near-duplicate of one
+    # Returns the key of the paper it is a near-duplicate of, or None if it was stored
+        # @param path_to_directory : The folder the paper will be saved in
+        # @param index : The numbering index the paper will be saved under
+        # @param text : The text to compare, such as the title and abstract
+    def add_paper(self, path_to_directory: str, index: int, text: str):
+        if not self.threshold:
+            return None
+        signature = self.signature(text)
+        if signature is None:
+            return None
+        cls = type(self)
+        with cls.lock:
+            duplicate_of = self.__find_similar(signature, None)
+            if duplicate_of is not None:
+                cls.duplicateCount += 1
+                return duplicate_of
+            self.__store(self.paper_key(path_to_directory, index), signature, None)
+        return None
+
+    # Method that replaces the signature of an already saved paper with one made from more of its text, such as the
+    #   first page once it is converted, and checks it again
+    # Returns the key of the paper it is a near-duplicate of, or None
+        # @param key : The key of the paper
+        # @param signature : The new signature of the paper, as returned by signature
+    def update_paper(self, key: str, signature: list or None):
+        if not self.threshold or signature is None:
+            return None
+        cls = type(self)
+        with cls.lock:
+            duplicate_of = self.__find_similar(signature, key)
+            if duplicate_of is not None:
+                # Whichever paper is recorded as the original, the pair is only reported once
+                row = self.__get_connection().execute("SELECT duplicate_of FROM signatures WHERE paper = ?",
+                                                      (duplicate_of,)).fetchone()
+                if row is not None and row[0] == key:
+                    duplicate_of = None
+            self.__store(key, signature, duplicate_of)
+        return duplicate_of
+
+    # Method that gets a printable summary of the near-duplicates found this run
+    @classmethod
+    def get_summary(cls):
+        if not cls.threshold:
+            return ""
+        return f"\n\tNear-Duplicates Skipped: {cls.duplicateCount}"
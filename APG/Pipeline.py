@@ -0,0 +1,327 @@
+import json
+import os
+import queue
+import threading
+
+from APG.ArxivScraper import ArxivScraper
+from APG.DuplicateFilter import DuplicateFilter
+from APG.FileGatherer import FileGatherer
+from APG.FileWriter import FileWriter
+from APG.IdentityResolver import IdentityResolver
+from APG.Journal import Journal
+from APG.MetadataStore import MetadataStore
+from APG.NearDuplicateIndex import NearDuplicateIndex
+from APG.RateLimiter import RateLimiter
+from APG.ResultGatherer import ResultGatherer
+from APG.TextConverterAndExtractor import TextConverterAndExtractor
+
+
+# Runs the full pipeline as stages that work at the same time, connected by bounded queues
+# Google Scholar and ArXiv are scraped in parallel, and each page of results is fetched and filtered, written, and
+#   converted while later pages are still being scraped, so a run takes about as long as its slowest stage
+class Pipeline:
+    queue_size = 64  # Results waiting to be fetched, and fetched results waiting to be written, before stages wait
+    arxiv_batch = 100  # ArXiv results are queued this many at a time, so they can be scored and ordered together
+
+    # Method that sets up a pipelined run of the full pipeline
+        # @param query : The search query to use
+        # @param directory : The directory to save files to
+        # @param total_results : The total number of results to gather from each source
+        # @param year_start : The starting year of a date range - use None if no filtering is desired
+        # @param year_end : The ending year of a date range - use None if no filtering is desired
+        # @param meta_can_be_missing : Boolean toggle that determines if absent title and author is acceptable
+        # @param include_arxiv : Boolean toggle that scrapes and gathers ArXiv results alongside Google Scholar's
+        # @param concurrency : The number of results fetched at once (never two results on the same host)
+        # @param workers : The number of processes to convert files with
+        # @param resume : Boolean toggle that reuses saved results and continues an interrupted run
+    def __init__(self, query: str, directory: str, total_results: int, year_start: int or None,
+                 year_end: int or None, meta_can_be_missing: bool, include_arxiv: bool, concurrency: int = 1,
+                 workers: int = 1, resume: bool = False):
+        self.query = query
+        self.directory = directory
+        self.total_results = total_results
+        self.year_start = year_start
+        self.year_end = year_end
+        self.meta_can_be_missing = meta_can_be_missing
+        self.concurrency = concurrency
+        self.workers = workers
+        self.resume = resume
+        self.directories = {"scholar": directory}
+        if include_arxiv:
+            self.directories["arxiv"] = os.path.join(directory, "ArXiv")
+        self.results = {source: [] for source in self.directories}
+        self.gatherers = {source: FileGatherer() for source in self.directories}
+        self.journals = {}
+        self.owners = {}  # Identity key -> (source, position) of the first result seen with it
+        self.pending = []  # (source, position) of results waiting to be fetched, in the order to fetch them
+        self.admitted = {source: [] for source in self.directories}  # Positions queued, in the order they are numbered
+        self.dropped = set()  # (source, position) of queued results left for a later run once the budget ran out
+        self.busy_hosts = set()
+        self.scraping = len(self.directories)  # Scrapers still running
+        self.over_budget = 0  # Results left for a later run because the time or byte budget ran out
+        self.condition = threading.Condition()  # Guards pending, admitted, dropped, busy_hosts, owners, and counts
+        self.fetched = queue.Queue(self.queue_size)  # Outcomes waiting to be written, in the order they finished
+        # Saved articles waiting to be converted -- only paths of files already on the disk, so it is not bounded and
+        #   the FileWriter thread that queues them never waits for the converter
+        self.written = queue.Queue()
+
+    # Method that runs every stage until all results are gathered and every saved file is converted
+    def run(self):
+        for source, path_to_directory in self.directories.items():
+            self.journals[source] = Journal(path_to_directory, self.resume)
+            if not self.resume:
+                DuplicateFilter().forget(path_to_directory)  # This run overwrites the files those papers were saved to
+                NearDuplicateIndex().forget(path_to_directory)
+                MetadataStore().forget(path_to_directory)
+        FileGatherer.start_budget()
+
+        scrapers = [threading.Thread(target=self.__scrape, args=(source,), daemon=True) for source in self.directories]
+        fetchers = [threading.Thread(target=self.__fetch, daemon=True) for _ in range(self.concurrency)]
+        writer = threading.Thread(target=self.__write, daemon=True)
+        converter = threading.Thread(target=self.__convert, daemon=True)
+        stages = scrapers + fetchers + [writer, converter]
+        for thread in stages:
+            thread.start()
+        try:
+            for thread in scrapers + fetchers:
+                thread.join()
+            self.fetched.put(None)  # Every result has been fetched, so the writer can finish
+            writer.join()
+            converter.join()
+        finally:
+            for journal in self.journals.values():
+                journal.close()
+
+        if self.over_budget:
+            FileGatherer().report_budget(self.over_budget)
+        self.gatherers["scholar"].print_summary()
+        if "arxiv" in self.gatherers:
+            ArxivScraper().print_summary(self.gatherers["arxiv"])
+        # Convert anything an earlier run left behind, just as the phased pipeline does
+        TextConverterAndExtractor().convert_and_extract(self.directory, self.workers)
+
+    # Method that gets the pages of results of a source, as they are scraped or from the results a previous run saved
+        # @param source : "scholar" or "arxiv"
+    def __pages(self, source: str):
+        results_path = os.path.join(self.directories[source], "results.txt")
+        if self.resume and os.path.exists(results_path):
+            with open(results_path, 'r') as f:
+                yield json.load(f)
+        elif source == "scholar":
+            yield from ResultGatherer().iter_pages(self.query, self.total_results, self.year_start, self.year_end)
+        else:
+            batch = []
+            for result in ArxivScraper().iter_results(self.query, self.total_results):
+                batch.append(result)
+                if len(batch) == self.arxiv_batch:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+    # Scraping stage -- queues each page of a source's results to be fetched, and saves the results once complete
+        # @param source : "scholar" or "arxiv"
+    def __scrape(self, source: str):
+        try:
+            for page in self.__pages(source):
+                self.__admit(source, page)
+        except Exception as e:
+            print(f"\nScraping {source} results stopped early: {e}", flush=True)
+        finally:
+            os.makedirs(self.directories[source], exist_ok=True)
+            with open(os.path.join(self.directories[source], "results.txt"), 'w') as f:
+                json.dump(self.results[source], f)
+            with self.condition:
+                self.scraping -= 1
+                self.condition.notify_all()
+
+    # Method that adds a page of results to a source's list and queues the ones that need to be fetched
+    # Results that are the same paper as an earlier result, or that score too low to be worth fetching, are skipped
+    #   and left out of the journal, so a resumed run checks them again, and with prioritize on the rest of the page
+    #   is fetched from most to least promising
+        # @param source : "scholar" or "arxiv"
+        # @param page : The results of the page
+    def __admit(self, source: str, page: list):
+        results = self.results[source]
+        gatherer = self.gatherers[source]
+        journal = self.journals[source]
+        first = len(results)
+        results.extend(page)
+        positions = []
+        with self.condition:
+            for position in range(first, len(results)):
+                result = results[position]
+                result.pop('duplicate_of', None)
+                # Completed results still claim their keys, so their duplicates are not fetched either
+                owner = IdentityResolver().claim(self.owners, source, position, result)
+                if journal.is_done(position, FileGatherer.get_result_url(result)):
+                    continue
+                if owner is not None:
+                    result['duplicate_of'] = {"source": owner[0], "position": owner[1]}
+                    gatherer.count("identity_duplicate_count")
+                else:
+                    positions.append(position)
+        if positions and (gatherer.prioritize or gatherer.prune_margin is not None):
+            scores = gatherer.score_results(results, positions, self.query,
+                                            'snippet' if source == "scholar" else 'abstract')
+            scored = []
+            for position, score in zip(positions, scores):
+                if gatherer.is_pruned(score):
+                    gatherer.count("pruned_count")
+                else:
+                    scored.append((-score if gatherer.prioritize else 0, position))
+            positions = [position for _, position in sorted(scored)]
+        for position in positions:
+            with self.condition:
+                while len(self.pending) >= self.queue_size:
+                    self.condition.wait()
+                self.pending.append((source, position))
+                self.admitted[source].append(position)
+                self.condition.notify_all()
+
+    # Method that takes the first waiting result whose host is free, waiting until there is one
+    # Returns (source, position, host), or None once every result has been taken
+    def __take(self):
+        with self.condition:
+            while True:
+                if FileGatherer.budget_exhausted():
+                    # Leave the rest out of the journal, so a resumed run gathers them
+                    self.over_budget += len(self.pending)
+                    self.dropped.update(self.pending)
+                    self.pending.clear()
+                    self.condition.notify_all()
+                soonest = None
+                for i, (source, position) in enumerate(self.pending):
+                    url = FileGatherer.get_result_url(self.results[source][position])
+                    host = RateLimiter.get_host(url) if url else ""
+                    if host in self.busy_hosts:
+                        continue
+                    ready_in = RateLimiter().ready_in(url) if url else 0
+                    if ready_in <= 0:
+                        del self.pending[i]
+                        self.busy_hosts.add(host)
+                        self.condition.notify_all()
+                        return source, position, host
+                    if soonest is None or ready_in < soonest:
+                        soonest = ready_in
+                if not self.pending and self.scraping == 0:
+                    return None
+                # Every waiting host is busy or cooling down, so wait for a host or a new page
+                self.condition.wait(soonest)
+
+    # Fetching stage -- downloads and filters the files of each result, never two results on the same host at once
+    def __fetch(self):
+        while True:
+            taken = self.__take()
+            if taken is None:
+                return
+            source, position, host = taken
+            result = self.results[source][position]
+            try:
+                if source == "scholar":
+                    gathered = self.gatherers[source].process_result(result, self.query, self.meta_can_be_missing,
+                                                                     position + 1)
+                else:
+                    gathered = ArxivScraper().process_result(self.gatherers[source], result, self.query,
+                                                             self.meta_can_be_missing, position + 1)
+            except Exception as e:
+                print(f"\nUnexpected error while processing {source} result {position + 1}: {e}", flush=True)
+                gathered = []
+            finally:
+                with self.condition:
+                    self.busy_hosts.discard(host)
+                    self.condition.notify_all()
+            self.fetched.put((source, position, gathered))
+
+    # Writing stage -- saves the files of each fetched result and records its outcome
+    # Results are saved in the order they were queued to be fetched, not the order they finish, so files are numbered
+    #   as a regular run numbers them, and saved Google Scholar articles are passed on to be converted
+    def __write(self):
+        finished = {}  # (source, position) -> gathered files of a result waiting for the results queued before it
+        handled = {source: 0 for source in self.directories}  # Queued results of each source saved or dropped so far
+        try:
+            while True:
+                item = self.fetched.get()
+                if item is None:
+                    break
+                source, position, gathered = item
+                finished[(source, position)] = gathered
+                self.__write_ready(source, finished, handled)
+            for source in self.directories:  # Every result has been fetched, so results dropped since are passed
+                self.__write_ready(source, finished, handled)
+        finally:
+            FileWriter.flush()  # Every article is queued to be converted before the converter is told to finish
+            self.written.put(None)
+
+    # Method that saves every fetched result of a source that is next in line, stopping at the first one still being
+    #   fetched -- results dropped once the budget ran out are passed over
+        # @param source : "scholar" or "arxiv"
+        # @param finished : (source, position) -> gathered files of the fetched results not saved yet
+        # @param handled : Source -> how many of its queued results have been saved or dropped
+    def __write_ready(self, source: str, finished: dict, handled: dict):
+        while True:
+            with self.condition:
+                if handled[source] == len(self.admitted[source]):
+                    return
+                position = self.admitted[source][handled[source]]
+                dropped = (source, position) in self.dropped
+            if not dropped and (source, position) not in finished:
+                return
+            handled[source] += 1
+            if not dropped:
+                self.__save(source, position, finished.pop((source, position)))
+
+    # Method that saves the files of a fetched result and records its outcome in the journal
+        # @param source : "scholar" or "arxiv"
+        # @param position : The position of the result in its source's results
+        # @param gathered : The (file, filter_result, digest) entries gathered for the result
+    def __save(self, source: str, position: int, gathered: list):
+        journal = self.journals[source]
+        result = self.results[source][position]
+        try:
+            first_index = journal.next_index
+            if source == "scholar":
+                next_index = self.gatherers[source].finish_result(journal, position, result, gathered, first_index,
+                                                                  self.directory, self.year_start, self.year_end)
+                # Articles are only on the disk once the writer gets to them
+                FileWriter().after_writes(self.__queue_articles, first_index, next_index)
+            else:
+                self.gatherers[source].finish_result(journal, position, result, gathered, first_index,
+                                                     self.directories[source], None, None, result['abstract'])
+        except Exception as e:
+            print(f"\nUnexpected error while saving {source} result {position + 1}: {e}", flush=True)
+
+    # Method that queues the articles saved for a result to be converted -- indices that were filtered out have none
+        # @param first_index : The first numbering index given to the result's files
+        # @param next_index : The numbering index the next result starts from
+    def __queue_articles(self, first_index: int, next_index: int):
+        for index in range(first_index, next_index):
+            article = os.path.join(self.directory, "Articles", f"{index}.pdf")
+            if os.path.exists(article):
+                self.written.put_nowait(article)
+
+    # Converting stage -- converts saved articles in batches of whatever has been written since the last batch
+    # Every batch goes to one process pool, kept open for the whole run, so no batch waits for workers to start
+    def __convert(self):
+        converter = TextConverterAndExtractor()
+        converter.start_method = "spawn"  # Forking while the other stages hold locks could deadlock the workers
+        if self.workers > 1:
+            converter.open_pool(self.workers)
+        finished = False
+        try:
+            while not finished:
+                paths = [self.written.get()]
+                while True:
+                    try:
+                        paths.append(self.written.get_nowait())
+                    except queue.Empty:
+                        break
+                finished = None in paths
+                paths = [path for path in paths if path is not None]
+                if paths:
+                    try:
+                        converter.convert_and_extract(self.directory, self.workers, only=paths)
+                    except Exception as e:
+                        print(f"\nUnexpected error while converting files: {e}", flush=True)
+        finally:
+            converter.close_pool()
@@ -1,28 +1,275 @@
-import requests
+import json
+import os
 import random
-from fp.fp import FreeProxy
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from fp.fp import FreeProxy, FreeProxyException
+
+from APG.Headers import Headers
+from APG.Metrics import Metrics
+from APG.RateLimiter import RateLimiter
+from APG.Sessions import Sessions
 
 
+# Pool of free proxies, checked in the background and ranked by how fast and reliable they have been
+# A proxy that fails failure_limit times in a row is left out for cooldown seconds, then given one more chance
 class Proxies:
-    proxy_list = None
+    check_url = "https://www.google.com/generate_204"  # Fetched through each candidate to check that it works
+    check_timeout = 5.0  # Seconds a candidate has to answer its check
+    check_workers = 32  # Candidates checked at once
+    max_candidates = 300  # The most candidates checked in one refresh
+    request_timeout = 20.0  # Seconds a request through a proxy may take to answer
+    attempts = 3  # Proxies tried for one request before giving up on it
+    wait_timeout = 30.0  # Seconds a request waits for the first proxy to pass its check when none are known yet
+    failure_limit = 3  # Failures in a row that take a proxy out of rotation
+    cooldown = 15 * 60  # Seconds a failing proxy is left out before it is tried again
+    smoothing = 0.3  # Weight of the newest latency in each proxy's moving average
+    cache_path = None  # JSON file the pool is kept in between runs - None keeps it in memory only
+    cache_ttl = 60 * 60  # Seconds a cached pool is used before it is checked again
+    save_interval = 60.0  # Seconds between saves of a pool that changed, besides the save at the end of the run
+    pool = {}  # Proxy URL -> {"latency", "successes", "failures", "consecutive_failures", "open_until"}
+    refreshed_at = None
+    saved_at = 0.0  # When the pool was last saved, by time.monotonic
+    dirty = False  # Whether the pool changed since it was last saved
+    refresher = None
+    loaded = False
+    proxied_requests = 0
+    proxied_failures = 0
+    condition = threading.Condition()
 
+    # Method that sets where the pool is kept between runs
+        # @param cache_path : The path of the pool file - None keeps the pool in memory only
+        # @param cache_ttl : Seconds a cached pool is used before it is checked again - None keeps current
+    @classmethod
+    def configure(cls, cache_path: str or None, cache_ttl: int or None = None):
+        with cls.condition:
+            cls.cache_path = cache_path
+            cls.loaded = False
+            if cache_ttl is not None:
+                cls.cache_ttl = cache_ttl
+
+    # Method that gets the proxies listed by proxifly
     def get_free_proxies(self):
         proxies = []
         # Proxies gathered are a subset of the proxies available at https://github.com/proxifly/free-proxy-list
         # Proxifly allows for the free use of these proxies, assuming standard use practices are adhered to
         url = "https://cdn.jsdelivr.net/gh/proxifly/free-proxy-list@main/proxies/countries/US/data.json"
-        content = requests.get(url).json()
+        content = Sessions().get_session().get(url, timeout=10).json()
         for item in content:
             if item['protocol'] == "http":
                 proxies.append(item['proxy'])
         return proxies
 
-    def get_python_proxy(self):
-        selected_proxy = FreeProxy(https=True).get()
-        return {"http": selected_proxy, "https": selected_proxy}
+    # Method that gets the HTTPS-capable proxies listed by free-proxy, without checking them one by one as it would
+    def get_python_proxies(self):
+        return [f"http://{address}" for address in FreeProxy(https=True).get_proxy_list(repeat=False)]
+
+    # Method that gets the candidates to check, from every source that answers
+    def get_candidates(self):
+        candidates = []
+        for source in (self.get_python_proxies, self.get_free_proxies):
+            try:
+                candidates.extend(source())
+            except (FreeProxyException, requests.exceptions.RequestException, ValueError, KeyError) as e:
+                print(f"\nCould not get proxies from {source.__name__}: {e}", flush=True)
+        candidates = list(dict.fromkeys(candidates))  # Drop repeats, keeping the order
+        random.shuffle(candidates)
+        return candidates[:self.max_candidates]
+
+    # Method that checks a proxy by fetching check_url through it
+    # Returns how many seconds it took, or None if it failed
+        # @param proxy : The proxy URL
+    def check(self, proxy: str):
+        start = time.perf_counter()
+        try:
+            response = requests.get(self.check_url, headers=Headers().get_rand_header(), timeout=self.check_timeout,
+                                    proxies={"http": proxy, "https": proxy})
+            response.close()
+            ok = response.status_code in (200, 204)
+        except requests.exceptions.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - start
+        Metrics.observe("proxy_check", elapsed)
+        return elapsed if ok else None
+
+    # Method that checks every candidate at once, adding each working one to the pool as soon as it passes
+    # Proxies already in the pool are checked again, so ones that stopped working are taken out of rotation
+    @classmethod
+    def refresh(cls):
+        proxies = cls()
+        try:
+            candidates = list(dict.fromkeys(list(cls.pool) + proxies.get_candidates()))
+            with ThreadPoolExecutor(max_workers=cls.check_workers) as executor:
+                checks = {executor.submit(proxies.check, proxy): proxy for proxy in candidates}
+                for done in as_completed(checks):
+                    proxy = checks[done]
+                    latency = done.result()
+                    with cls.condition:
+                        if latency is not None or proxy in cls.pool:
+                            cls.report(proxy, latency)
+            with cls.condition:
+                cls.refreshed_at = time.time()
+                # Candidates that never worked are forgotten, rather than kept as dead weight
+                cls.pool = {proxy: stats for proxy, stats in cls.pool.items() if stats["successes"]}
+                cls.dirty = True
+            cls.save()
+        finally:
+            with cls.condition:
+                cls.refresher = None
+                cls.condition.notify_all()
+
+    # Method that loads the saved pool, if it is fresh, and starts a background refresh if it is not
+    @classmethod
+    def warm(cls):
+        with cls.condition:
+            if not cls.loaded:
+                cls.loaded = True
+                cls.__load()
+            stale = cls.refreshed_at is None or time.time() - cls.refreshed_at > cls.cache_ttl
+            if stale and cls.refresher is None:
+                cls.refresher = threading.Thread(target=cls.refresh, daemon=True)
+                cls.refresher.start()
+
+    # Method that reads the pool from cache_path, if it was saved less than cache_ttl seconds ago
+    @classmethod
+    def __load(cls):
+        if cls.cache_path is None:
+            return
+        try:
+            with open(cls.cache_path, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if time.time() - saved.get("refreshed_at", 0) <= cls.cache_ttl:
+            cls.pool = saved.get("proxies", {})
+            cls.refreshed_at = saved["refreshed_at"]
+
+    # Method that atomically writes the pool to cache_path, so a crash never leaves a half-written one
+    # Nothing is written if the pool has not changed since it was last saved
+    @classmethod
+    def save(cls):
+        with cls.condition:
+            if cls.cache_path is None or cls.refreshed_at is None or not cls.dirty:
+                return
+            text = json.dumps({"refreshed_at": cls.refreshed_at, "proxies": cls.pool})
+            cls.dirty = False
+            cls.saved_at = time.monotonic()
+        os.makedirs(os.path.dirname(os.path.abspath(cls.cache_path)), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cls.cache_path)), suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(temp_path, cls.cache_path)
+
+    # Method that saves the pool if it changed and save_interval seconds have passed since it was last saved
+    # Requests only mark the pool as changed, so a busy run writes it now and then rather than after every request
+    @classmethod
+    def save_if_due(cls):
+        with cls.condition:
+            due = cls.dirty and time.monotonic() - cls.saved_at >= cls.save_interval
+        if due:
+            cls.save()
+
+    # Method that records how a request through a proxy went
+    # Latencies are kept as a moving average, and failing failure_limit times in a row takes the proxy out of
+    #   rotation for cooldown seconds -- a proxy that fails again once it is back is taken out again straight away
+        # @param proxy : The proxy URL
+        # @param latency : Seconds the request took, or None if it failed
+    @classmethod
+    def report(cls, proxy: str, latency: float or None):
+        with cls.condition:
+            stats = cls.pool.setdefault(proxy, {"latency": latency or cls.check_timeout, "successes": 0,
+                                                "failures": 0, "consecutive_failures": 0, "open_until": 0})
+            if latency is None:
+                stats["failures"] += 1
+                stats["consecutive_failures"] += 1
+                if stats["consecutive_failures"] >= cls.failure_limit:
+                    stats["open_until"] = time.time() + cls.cooldown
+            else:
+                stats["successes"] += 1
+                stats["consecutive_failures"] = 0
+                stats["open_until"] = 0
+                stats["latency"] += cls.smoothing * (latency - stats["latency"])
+            cls.dirty = True
+            cls.condition.notify_all()
+
+    # Method that picks the best proxy in rotation -- the fastest, after allowing for how often it has failed
+        # @param exclude : Proxies not to pick, such as ones already tried for this request
+    @classmethod
+    def __best(cls, exclude: set):
+        now = time.time()
+        best = None
+        best_score = None
+        for proxy, stats in cls.pool.items():
+            if proxy in exclude or stats["open_until"] > now or not stats["successes"]:
+                continue
+            success_rate = (stats["successes"] + 1) / (stats["successes"] + stats["failures"] + 2)
+            score = stats["latency"] / success_rate
+            if best_score is None or score < best_score:
+                best, best_score = proxy, score
+        return best
+
+    # Method that gets the best working proxy, waiting for the first check to pass if none are known yet
+    # Returns the proxy URL, or None if there is no working proxy
+        # @param exclude : Proxies not to pick, such as ones already tried for this request
+    def get_proxy(self, exclude: set = frozenset()):
+        cls = type(self)
+        cls.warm()
+        deadline = time.monotonic() + self.wait_timeout
+        with cls.condition:
+            while True:
+                proxy = cls.__best(exclude)
+                remaining = deadline - time.monotonic()
+                if proxy is not None or cls.refresher is None or remaining <= 0:
+                    return proxy
+                cls.condition.wait(remaining)
+
+    # Method that sends a GET request through the best working proxies, trying another if one fails
+    # Returns the response, or None if no proxy could get a 200 response
+        # @param url : The URL to request
+        # @param headers : The headers to send
+        # @param stream : Boolean toggle that streams the body instead of reading it right away
+    def request(self, url: str, headers: dict, stream: bool = False):
+        cls = type(self)
+        tried = set()
+        for _ in range(self.attempts):
+            proxy = self.get_proxy(tried)
+            if proxy is None:
+                break
+            tried.add(proxy)
+            RateLimiter().wait(url)
+            start = time.perf_counter()
+            with cls.condition:
+                cls.proxied_requests += 1
+            try:
+                response = Sessions().get_session().get(url, headers=headers, stream=stream,
+                                                        proxies={"http": proxy, "https": proxy},
+                                                        timeout=self.request_timeout)
+            except requests.exceptions.RequestException:
+                response = None
+            if response is not None and response.status_code == 200:
+                cls.report(proxy, time.perf_counter() - start)
+                cls.save_if_due()
+                return response
+            if response is not None:
+                response.close()
+            with cls.condition:
+                cls.proxied_failures += 1
+            cls.report(proxy, None)
+        cls.save_if_due()
+        return None
 
-    def get_rand_proxy(self):
-        if self.proxy_list is None:
-            self.proxy_list = self.get_free_proxies()
-        selected_proxy = random.choice(self.proxy_list)
-        return {"http": selected_proxy, "https": selected_proxy}
+    # Method that gets the proxy statistics for this run
+    @classmethod
+    def get_stats(cls):
+        with cls.condition:
+            now = time.time()
+            return {"known": len(cls.pool),
+                    "in_rotation": sum(1 for stats in cls.pool.values()
+                                       if stats["successes"] and stats["open_until"] <= now),
+                    "out_of_rotation": sum(1 for stats in cls.pool.values() if stats["open_until"] > now),
+                    "requests": cls.proxied_requests,
+                    "failed_requests": cls.proxied_failures}
@@ -0,0 +1,163 @@
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+from APG.Metrics import Metrics
+
+
+class RateLimiter:
+    # Rate budget for each host: (seconds between requests, burst size, maximum random jitter in seconds)
+    # Google Scholar keeps the old 3 to 7 second human-like spacing, and the ArXiv API is held to exactly
+    #   one request every 3 seconds, as its terms of use ask. Subdomains share their parent's budget
+    host_budgets = {
+        "scholar.google.com": (3.0, 1, 4.0),
+        "export.arxiv.org": (3.0, 1, 0.0),
+        "arxiv.org": (2.0, 1, 3.0),
+    }
+    default_budget = (3.0, 1, 4.0)  # Used for every other host, which is mostly publisher sites
+    # Each host's interval is scaled by its pace, which creeps down while the host answers normally and is doubled
+    #   whenever it answers with a throttling status, so tolerant hosts speed up and strict ones back off
+    # A 403 only counts as throttling when it carries Retry-After, since one without it is a paywall or a forbidden
+    #   file rather than a sign of sending too fast
+    throttle_statuses = frozenset({429, 503})
+    pace_step = 0.1  # Taken off a host's pace after each normal response
+    pace_factor = 2.0  # A host's pace is multiplied by this after each throttling response
+    max_pace = 8.0
+    min_pace = 0.25  # The fastest a host is paced, as a share of its budget's interval
+    # Hosts that are never sent requests faster than their budget allows, because they ask for that spacing
+    pace_floors = {"scholar.google.com": 1.0, "export.arxiv.org": 1.0}
+    enabled = True
+    buckets = {}  # Static global variable holding the token bucket state of each host: host -> [tokens, last_refill]
+    paces = {}  # Host -> pace, for hosts that have answered at least once
+    held_until = {}  # Host -> monotonic time before which nothing is sent, such as when a server sent Retry-After
+    lock = threading.Lock()
+
+    # Method that changes the rate budget of a host
+        # @param host : The host to configure, or "default" for every host without its own budget
+        # @param interval : The number of seconds between requests
+        # @param burst : How many requests may be sent back to back before the interval applies - None keeps current
+        # @param jitter : The maximum random delay added to each request - None keeps the current value
+    @classmethod
+    def set_budget(cls, host: str, interval: float, burst: int or None = None, jitter: float or None = None):
+        with cls.lock:
+            host = host.lower()
+            current = cls.default_budget if host == "default" else cls.host_budgets.get(host, cls.default_budget)
+            budget = (float(interval), current[1] if burst is None else burst, current[2] if jitter is None else jitter)
+            if host == "default":
+                cls.default_budget = budget
+            else:
+                cls.host_budgets[host] = budget
+            cls.buckets.clear()  # Start every host over with a full bucket under the new budgets
+
+    # Method that gets the host a URL points to
+        # @param url : The URL to check
+    @staticmethod
+    def get_host(url: str):
+        return (urlparse(url).hostname or "").lower()
+
+    # Method that looks a host up in a table of hosts, falling back on parent domains and then a default
+        # @param table : The table to look in
+        # @param host : The host to look up
+        # @param default : The value to use if neither the host nor a parent domain is in the table
+    @staticmethod
+    def __lookup(table: dict, host: str, default):
+        labels = host.split(".")
+        for i in range(len(labels) - 1):
+            value = table.get(".".join(labels[i:]))
+            if value is not None:
+                return value
+        return default
+
+    # Method that finds the rate budget of a host, falling back on parent domains and then the default budget
+        # @param host : The host to look up
+    def get_budget(self, host: str):
+        return self.__lookup(self.host_budgets, host, self.default_budget)
+
+    # Method that finds the rate budget of a host with its interval scaled by the host's current pace
+    # Must be called while holding the lock
+        # @param host : The host to look up
+    def __paced_budget(self, host: str):
+        interval, burst, jitter = self.get_budget(host)
+        return interval * self.paces.get(host, 1.0), burst, jitter
+
+    # Method that adjusts a host's pace from the status of one of its responses -- additive speed-up while it
+    #   answers normally, multiplicative slow-down when it throttles
+        # @param host : The host that answered
+        # @param status_code : The HTTP status code of the response
+        # @param retry_after : Boolean toggle for responses that carry a Retry-After header
+    @classmethod
+    def record_response(cls, host: str, status_code: int, retry_after: bool = False):
+        if not cls.enabled:
+            return
+        with cls.lock:
+            pace = cls.paces.get(host, 1.0)
+            if status_code in cls.throttle_statuses or (status_code == 403 and retry_after):
+                cls.paces[host] = min(cls.max_pace, pace * cls.pace_factor)
+            elif status_code < 400:
+                cls.paces[host] = max(cls.__lookup(cls.pace_floors, host, cls.min_pace), pace - cls.pace_step)
+
+    # Method that holds back every request to a URL's host for a number of seconds
+        # @param url : A URL on the host
+        # @param seconds : How long to hold requests back for
+    def hold(self, url: str, seconds: float):
+        host = self.get_host(url)
+        with self.lock:
+            self.held_until[host] = max(self.held_until.get(host, 0.0), time.monotonic() + seconds)
+
+    # Method that gets the current pace of every host that has answered, as a multiple of its budget's interval
+    @classmethod
+    def get_paces(cls):
+        with cls.lock:
+            return dict(cls.paces)
+
+    # Method that refills a host's bucket for the time that has passed and returns it
+        # @param host : The host whose bucket is needed
+        # @param budget : The rate budget of the host
+        # @param now : The current monotonic time
+    def __refill(self, host: str, budget: tuple, now: float):
+        interval, burst = budget[0], budget[1]
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = self.buckets[host] = [float(burst), now]
+        elif interval > 0:
+            bucket[0] = min(float(burst), bucket[0] + (now - bucket[1]) / interval)
+        else:
+            bucket[0] = float(burst)
+        bucket[1] = now
+        return bucket
+
+    # Method that reports how many seconds remain until a request to a URL's host would be sent without waiting
+        # @param url : The URL that is about to be requested
+    def ready_in(self, url: str):
+        if not self.enabled:
+            return 0.0
+        host = self.get_host(url)
+        with self.lock:
+            budget = self.__paced_budget(host)
+            now = time.monotonic()
+            bucket = self.__refill(host, budget, now)
+            return max(0.0, (1 - bucket[0]) * budget[0], self.held_until.get(host, 0.0) - now)
+
+    # Method that blocks until a request to a URL's host fits within that host's rate budget
+    # A slot is reserved before sleeping, so concurrent callers for the same host are queued one interval apart,
+    #   while callers for other hosts are never held up
+        # @param url : The URL that is about to be requested
+    def wait(self, url: str):
+        if not self.enabled:
+            return 0.0
+        host = self.get_host(url)
+        with self.lock:
+            budget = self.__paced_budget(host)
+            interval, jitter = budget[0], budget[2]
+            now = time.monotonic()
+            bucket = self.__refill(host, budget, now)
+            delay = max(0.0, (1 - bucket[0]) * interval, self.held_until.get(host, 0.0) - now)
+            extra = random.uniform(0, jitter) if jitter > 0 else 0.0
+            # The jitter is charged against the bucket too, so the next request is pushed back by the same amount
+            bucket[0] -= 1 + (extra / interval if interval > 0 else 0)
+        delay += extra
+        if delay > 0:
+            time.sleep(delay)
+            Metrics.record_sleep(delay)
+        return delay
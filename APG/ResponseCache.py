@@ -0,0 +1,350 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from APG.FileWriter import FileWriter
+from APG.RateLimiter import RateLimiter
+from APG.Sessions import Sessions
+
+
+class ResponseCache:
+    cache_dir = None  # Directory holding the cache - None turns caching off
+    fresh_ttl = 24 * 60 * 60  # Seconds a cached body is used without asking the server if it changed
+    failure_ttl = 12 * 60 * 60  # Seconds a URL that failed for good (such as a 404, or not a PDF) is skipped for
+    transient_failure_ttl = 10 * 60  # Seconds a URL that failed for a passing reason (timeout, 429, 5xx) is skipped for
+    permanent_statuses = frozenset({401, 403, 404, 410})  # Statuses a URL is expected to keep answering with
+    max_size = 1024 * 1024 * 1024  # Bytes stored bodies may take up before the least recently used are removed
+    evict_to = 0.9  # Share of max_size the stored bodies are cut down to once they go over it
+    size = None  # Bytes the stored bodies take up, counted when first needed
+    hits = 0
+    revalidated = 0
+    misses = 0
+    failure_hits = 0
+    lock = threading.Lock()
+
+    # Method that turns the cache on or off
+        # @param cache_dir : The directory to keep the cache in - None turns caching off
+        # @param fresh_ttl : Seconds a cached body is used without revalidating - None keeps current
+        # @param failure_ttl : Seconds a failed URL is skipped for - None keeps current
+        # @param max_size : Bytes stored bodies may take up - None keeps current
+    @classmethod
+    def configure(cls, cache_dir: str or None, fresh_ttl: int or None = None, failure_ttl: int or None = None,
+                  max_size: int or None = None):
+        with cls.lock:
+            cls.cache_dir = cache_dir
+            cls.size = None
+            if fresh_ttl is not None:
+                cls.fresh_ttl = fresh_ttl
+            if failure_ttl is not None:
+                cls.failure_ttl = failure_ttl
+            if max_size is not None:
+                cls.max_size = max_size
+
+    # Method that gets the URL a response was originally requested with, before any redirects
+        # @param response : The GET response
+    @staticmethod
+    def get_request_url(response: requests.Response):
+        return response.history[0].url if response.history else response.url
+
+    # Method that gets the path of the entry file for a URL
+    # Failures are kept apart from stored bodies, and by the kind of request that failed
+        # @param url : The URL
+        # @param failure_kind : "any" or "pdf" for the failure entry of a URL - None for its stored body
+    def __entry_path(self, url: str, failure_kind: str or None = None):
+        prepared = requests.models.PreparedRequest()
+        prepared.prepare_url(url, None)  # Normalize the URL the same way requests does before sending it
+        name = prepared.url if failure_kind is None else f"{failure_kind} {prepared.url}"
+        key = hashlib.sha256(name.encode()).hexdigest()
+        return os.path.join(self.cache_dir, "entries", key[:2], f"{key}.json")
+
+    # Method that gets the path of a stored body from its SHA-256 digest
+        # @param digest : The hex digest of the body
+    def __blob_path(self, digest: str):
+        return os.path.join(self.cache_dir, "blobs", digest[:2], digest)
+
+    # Method that atomically writes a JSON entry, so a crash never leaves a half-written one
+        # @param path : The path of the entry
+        # @param entry : The entry to write
+    def __write_entry(self, path: str, entry: dict):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(temp_path, path)
+
+    # Method that reads an entry file, if there is one
+        # @param path : The path of the entry
+    @staticmethod
+    def __read_entry(path: str):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # Method that reads the cache entry for a URL, if its body is still there
+    # Saved PDFs are read from their copy in Articles, as long as it has not been changed since
+        # @param url : The URL
+    def lookup(self, url: str):
+        if self.cache_dir is None:
+            return None
+        entry = self.__read_entry(self.__entry_path(url))
+        if entry is None or "failure" in entry:
+            return None
+        if "path" in entry:
+            try:
+                stat = os.stat(entry["path"])
+            except OSError:
+                return None
+            return entry if stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"] else None
+        return entry if os.path.exists(self.__blob_path(entry["digest"])) else None
+
+    # Method that reads the failure recorded for a URL, if it has not run out yet
+    # Failures of any request are found, and with pdf_only, so are failures that only rule the URL out as a PDF
+        # @param url : The URL
+        # @param pdf_only : Boolean toggle for requests that only want a PDF
+    def find_failure(self, url: str, pdf_only: bool = False):
+        if self.cache_dir is None:
+            return None
+        for kind in ("any", "pdf") if pdf_only else ("any",):
+            entry = self.__read_entry(self.__entry_path(url, kind))
+            if entry is not None and entry["expires"] > time.time():
+                return entry
+        return None
+
+    # Method that builds a response whose body is read from the cache
+        # @param url : The URL that was requested
+        # @param entry : The cache entry for the URL
+    def __cached_response(self, url: str, entry: dict):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict({"Content-Type": entry.get("content_type", ""),
+                                                "Content-Length": str(entry["size"])})
+        response.from_cache = True
+        response.cache_entry = entry
+        if "path" in entry:
+            response.raw = open(entry["path"], 'rb')
+            return response
+        blob_path = self.__blob_path(entry["digest"])
+        response.raw = open(blob_path, 'rb')
+        try:
+            os.utime(blob_path)  # Mark the body as recently used, so it is the last to be evicted
+        except OSError:
+            pass
+        return response
+
+    # Method that sends a streamed GET through the shared session, answering from the cache when it can
+    # Fresh entries are returned without a request, and older ones are revalidated with a conditional GET
+    # Returns None without sending anything for URLs that recently failed
+        # @param url : The URL to fetch from
+        # @param headers : The headers to send
+        # @param timeout : Seconds to wait for the server
+        # @param pdf_only : Boolean toggle for requests that only want a PDF, which also skip URLs found not to be one
+    def get(self, url: str, headers: dict, timeout: int = 10, pdf_only: bool = False):
+        if self.find_failure(url, pdf_only) is not None:
+            self.__count("failure_hits")
+            return None
+        entry = self.lookup(url)
+        if entry is not None:
+            if time.time() - entry["stored_at"] < self.fresh_ttl:
+                self.__count("hits")
+                return self.__cached_response(url, entry)
+            headers = dict(headers)
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        RateLimiter().wait(url)  # Stay within this host's rate budget
+        response = Sessions().get_session().get(url, headers=headers, timeout=timeout, stream=True)
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            self.__count("revalidated")
+            entry["stored_at"] = time.time()
+            self.__write_entry(self.__entry_path(url), entry)
+            return self.__cached_response(url, entry)
+        if response.status_code == 200:
+            self.__count("misses")
+        return response
+
+    # Method that builds the entry a response body is stored under
+        # @param response : The GET response the body came from
+        # @param digest : The SHA-256 hex digest of the body
+        # @param size : The size of the body, in bytes
+    def __make_entry(self, response: requests.Response, digest: str, size: int):
+        return {
+            "url": self.get_request_url(response),
+            "digest": digest,
+            "size": size,
+            "content_type": response.headers.get("Content-Type", ""),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "stored_at": time.time()
+        }
+
+    # Method that stores a fully read web page under the URL it was requested with
+    # PDFs are stored with hold_file and store_file instead, once it is known whether they were saved
+        # @param response : The GET response the body came from
+        # @param body : The body, as bytes or as an open binary file
+    def store(self, response: requests.Response, body):
+        if self.cache_dir is None or getattr(response, "from_cache", False):
+            return
+        try:
+            source = io.BytesIO(body) if isinstance(body, bytes) else body
+            source.seek(0)
+            # Copy the body into the cache while hashing it, then move it to its content-addressed path
+            os.makedirs(os.path.join(self.cache_dir, "blobs"), exist_ok=True)
+            digest = hashlib.sha256()
+            size = 0
+            fd, temp_path = tempfile.mkstemp(dir=os.path.join(self.cache_dir, "blobs"), suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: source.read(64 * 1024), b""):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            source.seek(0)
+            blob_path = self.__blob_path(digest.hexdigest())
+            is_new = not os.path.exists(blob_path)
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(temp_path, blob_path)
+            self.__write_entry(self.__entry_path(self.get_request_url(response)),
+                               self.__make_entry(response, digest.hexdigest(), size))
+            if is_new:
+                self.__add_size(size)
+        except OSError as e:
+            print(f"\nCould not cache '{response.url}': {e}", flush=True)
+
+    # Method that remembers where a downloaded PDF came from, so it can be cached once it is known whether it was
+    #   saved -- saved PDFs are read from their copy in Articles by link_file, and the rest are stored by store_file
+        # @param response : The GET response the PDF came from
+        # @param file : The downloaded PDF
+        # @param digest : The SHA-256 hex digest of the PDF
+        # @param size : The size of the PDF, in bytes
+    def hold_file(self, response: requests.Response, file: io.IOBase, digest: str, size: int):
+        if self.cache_dir is not None:
+            file.cache_entry = getattr(response, "cache_entry", None) or self.__make_entry(response, digest, size)
+
+    # Method that points the cache entry of a saved PDF at its copy in Articles, once the FileWriter has written it,
+    #   so later runs read it from there instead of downloading it again or keeping a second copy
+        # @param file : The downloaded PDF, as given to hold_file
+        # @param path : The path the PDF is saved to
+    def link_file(self, file: io.IOBase, path: str):
+        entry = getattr(file, "cache_entry", None)
+        if self.cache_dir is not None and entry is not None:
+            FileWriter().after_writes(self.__finish_link, entry, os.path.abspath(path))
+
+    # Method that records a PDF linked by link_file, once the FileWriter has written it
+        # @param entry : The cache entry of the PDF
+        # @param path : The absolute path the PDF was saved to
+    def __finish_link(self, entry: dict, path: str):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return  # The PDF could not be written
+        self.__write_entry(self.__entry_path(entry["url"]), dict(entry, path=path, mtime_ns=stat.st_mtime_ns))
+
+    # Method that stores a downloaded PDF that was not saved, such as one that was filtered out, then closes it
+    # The PDF is written by the FileWriter, so storing it never holds up fetching
+        # @param file : The downloaded PDF, as given to hold_file -- it is always closed
+    def store_file(self, file: io.IOBase):
+        entry = getattr(file, "cache_entry", None)
+        if self.cache_dir is None or entry is None:
+            file.close()
+            return
+        entry = {key: value for key, value in entry.items() if key not in ("path", "mtime_ns")}
+        blob_path = self.__blob_path(entry["digest"])
+        if os.path.exists(blob_path):
+            file.close()
+            FileWriter().after_writes(self.__finish_store, entry, 0)
+        else:
+            FileWriter().copy_file(blob_path, file)
+            FileWriter().after_writes(self.__finish_store, entry, entry["size"])
+
+    # Method that records a PDF stored by store_file, once the FileWriter has written it
+        # @param entry : The cache entry of the PDF
+        # @param size : The bytes its body added to the cache
+    def __finish_store(self, entry: dict, size: int):
+        if not os.path.exists(self.__blob_path(entry["digest"])):
+            return  # The body could not be written
+        self.__write_entry(self.__entry_path(entry["url"]), entry)
+        self.__add_size(size)
+
+    # Method that lists every stored body
+    # Returns a list of (last used time, size, path)
+    def __list_blobs(self):
+        blobs = []
+        for root, _, names in os.walk(os.path.join(self.cache_dir, "blobs")):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        return blobs
+
+    # Method that adds to the bytes stored bodies take up, and removes the least recently used bodies once they
+    #   take up more than max_size -- entries whose body is gone are treated as misses
+        # @param amount : The bytes added, or removed if negative
+    def __add_size(self, amount: int):
+        cls = type(self)
+        with cls.lock:
+            if cls.size is None:
+                cls.size = sum(size for _, size, _ in self.__list_blobs())
+            else:
+                cls.size += amount
+            if cls.size <= cls.max_size:
+                return
+            for _, size, path in sorted(self.__list_blobs()):
+                if cls.size <= cls.max_size * cls.evict_to:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                cls.size -= size
+
+    # Method that remembers that a URL failed, so it is skipped for failure_ttl, or for transient_failure_ttl if the
+    #   failure may pass
+    # A URL that is not a PDF is only skipped by requests that want a PDF, since it may still be a page worth reading
+        # @param url : The URL that failed
+        # @param reason : Why the URL failed
+        # @param permanent : Boolean toggle for failures the URL is expected to repeat, such as a 404
+        # @param pdf_only : Boolean toggle for failures that only rule the URL out as a PDF
+    def store_failure(self, url: str, reason: str, permanent: bool, pdf_only: bool = False):
+        if self.cache_dir is None:
+            return
+        ttl = self.failure_ttl if permanent else self.transient_failure_ttl
+        try:
+            self.__write_entry(self.__entry_path(url, "pdf" if pdf_only else "any"),
+                               {"url": url, "failure": reason, "expires": time.time() + ttl})
+        except OSError as e:
+            print(f"\nCould not cache failure for '{url}': {e}", flush=True)
+
+    # Method that increments one of the hit or miss counters
+        # @param name : The name of the counter
+    @classmethod
+    def __count(cls, name: str):
+        with cls.lock:
+            setattr(cls, name, getattr(cls, name) + 1)
+
+    # Method that gets a printable summary of how well the cache did this run
+    @classmethod
+    def get_summary(cls):
+        if cls.cache_dir is None:
+            return ""
+        with cls.lock:
+            served = cls.hits + cls.revalidated
+            total = served + cls.misses
+            ratio = served / total * 100 if total else 0
+            return (f"\n\tCache Hits: {served}/{total} ({ratio:.0f}%, {cls.revalidated} revalidated)"
+                    f"\n\tKnown Failures Skipped: {cls.failure_hits}")
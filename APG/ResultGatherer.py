@@ -1,16 +1,13 @@
-import requests
 from bs4 import BeautifulSoup
-import random
-import time
-from fp.fp import FreeProxyException
-from requests.exceptions import ProxyError, ConnectionError
-from urllib3.exceptions import MaxRetryError
 
 from APG.Headers import Headers
+from APG.Metrics import Metrics
 from APG.Proxies import Proxies
+from APG.RetryPolicy import RetryPolicy
 
 
 class ResultGatherer:
+    base_url = "https://scholar.google.com/scholar"  # Where search pages are requested from
 
     # Grab all available results on a specified page
         # @param soup_object : A BeautifulSoup response object
@@ -51,51 +48,54 @@ class ResultGatherer:
         # @param year_end : The ending year of a date range - use None if no filtering is desired
         # @param language : The language to use for the page - default is english
     def __build_url(self, query: str, start: int, num: int, year_start: int, year_end: int, language: str = "en"):
-        base = "https://scholar.google.com/scholar?"
+        base = f"{self.base_url}?"
         query = query.replace(" ", "+")
         if year_start is None or year_end is None:
             return f"{base}hl={language}&num={num}&start={start}&q={query}"
         return f"{base}hl={language}&num={num}&start={start}&q={query}&as_ylo={year_start}&as_yhi={year_end}"
 
-    # Iteratively gather a set number of results for the desired query
+    # Iteratively gather a set number of results for the desired query, yielding the results of each page as it is
+    #   scraped
         # @param query : The Google Scholar search query
         # @param total_results : The total number of results to gather
         # @param year_start : The starting year of a date range - use None if no filtering is desired
         # @param year_end : The ending year of a date range - use None if no filtering is desired
         # @param num : The number of results on each page - default is 10
-    def scrape_results(self, query: str, total_results: int, year_start: int or None, year_end: int or None,
-                       num: int = 10):
-        scholar_results = []
+    def iter_pages(self, query: str, total_results: int, year_start: int or None, year_end: int or None,
+                   num: int = 10):
         start = 0
         while start < total_results:
             print(f"\rGetting results {start}-{start+num-1}", end="", flush=True)
             url = self.__build_url(query, start, num, year_start, year_end)
-            session = requests.Session()
             headers_to_use = Headers().get_rand_header()
-            session.headers = headers_to_use
-            response = session.get(url)
+            # Google Scholar has strict anti-bot policies, so its rate budget keeps scraping slow, and throttled or
+            #   failed requests are retried with backoff
+            response = RetryPolicy().get(url, headers_to_use)
 
-            if response.status_code != 200:
-                try:
-                    selected_proxy = Proxies().get_python_proxy()  # Use pypi proxies
-                except FreeProxyException:  # If none are available
-                    selected_proxy = Proxies().get_rand_proxy()  # Use proxifly instead
-                try:
-                    response = session.get(url, proxies=selected_proxy)
-                except (ProxyError, ConnectionRefusedError, ConnectionError, MaxRetryError):
-                    print(f"\nConnection to {url} could not be established.\nAborting.", flush=True)
-                    exit(-1)
-                if response.status_code != 200:
-                    print(f"\nRequest to '{url}' failed with status code {response.status_code} "
-                          f"and proxy '{selected_proxy}'", flush=True)
-                    continue
+            if response is None or response.status_code != 200:  # Try again through the best working proxies
+                status_code = response.status_code if response is not None else "none"
+                response = Proxies().request(url, headers_to_use)
+                if response is None:
+                    # Stop here rather than exit, so the results of earlier pages are still saved
+                    print(f"\nRequest to '{url}' failed with status code {status_code} and no working proxy "
+                          f"could fetch it. Stopping before result {start}.", flush=True)
+                    return
 
-            soup = BeautifulSoup(response.text, "html.parser")
-            page_results = self.__get_results_from_page(soup, num)
-            scholar_results.extend(page_results)
+            with Metrics.timed("parse_scholar_page"):
+                page_results = self.__get_results_from_page(BeautifulSoup(response.text, "html.parser"), num)
+            yield page_results
             start += num
-            # Google Scholar has strict anti-bot policies, so scraping slowly is a must
-            delay = random.uniform(3, 7)
-            time.sleep(delay)
-        print(f"\rScraping complete for all {total_results} results", flush=True)
+
+    # Iteratively gather a set number of results for the desired query
+        # @param query : The Google Scholar search query
+        # @param total_results : The total number of results to gather
+        # @param year_start : The starting year of a date range - use None if no filtering is desired
+        # @param year_end : The ending year of a date range - use None if no filtering is desired
+        # @param num : The number of results on each page - default is 10
+    def scrape_results(self, query: str, total_results: int, year_start: int or None, year_end: int or None,
+                       num: int = 10):
+        scholar_results = []
+        for page_results in self.iter_pages(query, total_results, year_start, year_end, num):
+            scholar_results.extend(page_results)
+        print(f"\rScraping complete for {len(scholar_results)} of {total_results} results", flush=True)
         return scholar_results
@@ -0,0 +1,193 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+
+from APG.Metrics import Metrics
+from APG.RateLimiter import RateLimiter
+from APG.ResponseCache import ResponseCache
+from APG.Sessions import Sessions
+
+
+# Shared retry policy for every request: failed attempts are retried after an exponential backoff with full jitter,
+#   or after the delay the server asked for in its Retry-After header
+class RetryPolicy:
+    max_tries = 3  # Attempts at each request, including the first
+    base_delay = 1.0  # Seconds the backoff starts from, doubled after each failed attempt
+    max_delay = 60.0  # The longest backoff, in seconds
+    max_retry_after = 300.0  # Retry-After delays longer than this give up on the request instead of waiting
+    timeout = 30.0  # Seconds a request waits for the server to connect, or to send more of its response
+    # Statuses worth trying again -- a 403 is only tried again when it carries Retry-After, since one without it is
+    #   almost always a paywall or a forbidden file that will never succeed
+    retry_statuses = frozenset({408, 429, 500, 502, 503, 504})
+    stats = {}  # Host -> {"retries", "recovered", "gave_up", "retry_after", "backoff_seconds"}
+    lock = threading.Lock()
+
+    # Method that changes the retry budget
+        # @param max_tries : Attempts at each request, including the first - None keeps current
+        # @param base_delay : Seconds the backoff starts from - None keeps current
+        # @param max_delay : The longest backoff, in seconds - None keeps current
+    @classmethod
+    def configure(cls, max_tries: int or None = None, base_delay: float or None = None,
+                  max_delay: float or None = None):
+        with cls.lock:
+            if max_tries is not None:
+                cls.max_tries = max_tries
+            if base_delay is not None:
+                cls.base_delay = base_delay
+            if max_delay is not None:
+                cls.max_delay = max_delay
+
+    # Method that checks whether a failed response is worth trying again
+        # @param response : The failed response
+    def should_retry(self, response: requests.Response):
+        if response.status_code == 403:
+            return self.get_retry_after(response) is not None
+        return response.status_code in self.retry_statuses
+
+    # Method that reads the Retry-After header of a response, given as seconds or as an HTTP date
+    # Returns the seconds to wait, or None if there is no usable header
+        # @param response : The response, or None if the request raised an exception
+    @staticmethod
+    def get_retry_after(response: requests.Response or None):
+        value = response.headers.get("Retry-After") if response is not None else None
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    # Method that gets the backoff before the next attempt: a random delay of up to base_delay doubled for each
+    #   failed attempt, capped at max_delay
+        # @param attempt : How many attempts have failed so far, less one
+    def get_backoff(self, attempt: int):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    # Method that waits before another attempt at a failed request
+    # A Retry-After delay also holds back every other request to the host, through the rate limiter
+    # Returns False, without waiting, if the server asked for a longer wait than max_retry_after
+        # @param url : The URL that was requested
+        # @param attempt : How many attempts have failed so far, less one
+        # @param response : The failed response, or None if the request raised an exception
+    def wait(self, url: str, attempt: int, response: requests.Response or None = None):
+        host = RateLimiter.get_host(url)
+        retry_after = self.get_retry_after(response)
+        if retry_after is not None and retry_after > self.max_retry_after:
+            return False
+        if retry_after is not None:
+            RateLimiter().hold(url, retry_after)
+            delay = retry_after
+        else:
+            delay = self.get_backoff(attempt)
+        self.__record(host, "retries", 1)
+        self.__record(host, "retry_after", 1 if retry_after is not None else 0)
+        self.__record(host, "backoff_seconds", delay)
+        if delay > 0:
+            time.sleep(delay)
+            Metrics.record_sleep(delay)
+        return True
+
+    # Method that records how a retried request ended, once it will not be tried again
+        # @param url : The URL that was requested
+        # @param attempts : How many attempts were made
+        # @param succeeded : Whether the last attempt succeeded
+    def finish(self, url: str, attempts: int, succeeded: bool):
+        if attempts > 1:
+            self.__record(RateLimiter.get_host(url), "recovered" if succeeded else "gave_up", 1)
+
+    # Method that sends a request until it succeeds, trying again while it fails with a status worth retrying or with
+    #   a connection error, and backing off between attempts
+    # Returns the response, which may not be a 200 if every attempt failed, or None if the last attempt raised an
+    #   exception or send skipped the request
+        # @param url : The URL being requested
+        # @param send : Function that sends one attempt and returns its response, or None to skip the request, such
+        #   as for a URL known to fail -- it may raise a requests exception
+        # @param max_tries : Attempts to make - None uses max_tries
+        # @param remember_failure : Boolean toggle that records a URL that could not be fetched in the response cache
+    def run(self, url: str, send, max_tries: int or None = None, remember_failure: bool = False):
+        tries = max_tries or self.max_tries
+        response = None
+        failure, permanent = None, False
+        for attempt in range(tries):
+            try:
+                response = send()
+            except requests.exceptions.RequestException as e:
+                response = None
+                failure, permanent = type(e).__name__, False
+            else:
+                if response is None:  # Skipped without a request
+                    return None
+                if response.status_code == 200:
+                    self.finish(url, attempt + 1, True)
+                    return response
+                failure = f"status {response.status_code}"
+                permanent = response.status_code in ResponseCache.permanent_statuses
+                if not self.should_retry(response):
+                    break
+            if attempt + 1 == tries or not self.wait(url, attempt, response):
+                break
+            if response is not None:
+                response.close()
+        self.finish(url, attempt + 1, False)
+        if remember_failure:
+            ResponseCache().store_failure(url, failure, permanent)
+        return response
+
+    # Method that sends a GET request through the shared session, trying again as run does
+    # Returns the last response, which may not be a 200, or None if the last attempt raised an exception
+        # @param url : The URL to request
+        # @param headers : The headers to send
+        # @param stream : Boolean toggle that streams the body instead of reading it right away
+        # @param max_tries : Attempts to make - None uses max_tries
+        # @param timeout : Seconds to wait for the server - None uses timeout
+    def get(self, url: str, headers: dict, stream: bool = False, max_tries: int or None = None,
+            timeout: float or None = None):
+        def send():
+            RateLimiter().wait(url)
+            try:
+                return Sessions().get_session().get(url, headers=headers, stream=stream,
+                                                    timeout=timeout or self.timeout)
+            except requests.exceptions.RequestException as e:
+                print(f"\nRequest to '{url}' failed: {e}", flush=True)
+                raise
+
+        return self.run(url, send, max_tries)
+
+    # Method that adds to a host's retry statistics
+        # @param host : The host
+        # @param name : The statistic to add to
+        # @param amount : How much to add
+    @classmethod
+    def __record(cls, host: str, name: str, amount: float):
+        with cls.lock:
+            host_stats = cls.stats.setdefault(host, {"retries": 0, "recovered": 0, "gave_up": 0, "retry_after": 0,
+                                                     "backoff_seconds": 0.0})
+            host_stats[name] += amount
+
+    # Method that gets the retry statistics of each host, along with how the rate limiter has paced it
+    @classmethod
+    def get_stats(cls):
+        paces = RateLimiter.get_paces()
+        with cls.lock:
+            stats = {host: dict(host_stats, backoff_seconds=round(host_stats["backoff_seconds"], 3))
+                     for host, host_stats in cls.stats.items()}
+        for host, pace in paces.items():
+            stats.setdefault(host, {})["pace"] = round(pace, 3)
+        return dict(sorted(stats.items()))
+
+    # Method that gets a printable summary of the retries made this run
+    @classmethod
+    def get_summary(cls):
+        with cls.lock:
+            retries = sum(host_stats["retries"] for host_stats in cls.stats.values())
+            recovered = sum(host_stats["recovered"] for host_stats in cls.stats.values())
+            gave_up = sum(host_stats["gave_up"] for host_stats in cls.stats.values())
+        return (f"\n\tRequests Retried: {retries}\n\tRecovered by Retrying: {recovered}"
+                f"\n\tGave Up After Retrying: {gave_up}")
@@ -0,0 +1,202 @@
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+
+from APG.Metrics import Metrics
+from APG.RateLimiter import RateLimiter
+
+
+class Sessions:
+    pool_connections = 32  # How many hosts keep a connection pool at once
+    pool_maxsize = 8  # How many idle keep-alive connections are kept for each host
+    dns_cache_ttl = 300  # Seconds a resolved address is reused - 0 turns the DNS cache off
+    session = None  # Static global session shared by every module
+    new_connections = 0
+    requests_sent = 0
+    dns_cache_size = 1024  # The most resolved addresses kept at once
+    dns_cache = OrderedDict()  # (host, port) -> (expiry time, address)
+    dns_lookups = 0
+    dns_hits = 0
+    lock = threading.Lock()
+
+    # Method that changes the pool settings -- must be called before the first request to take full effect
+        # @param pool_connections : How many hosts keep a connection pool at once - None keeps current
+        # @param pool_maxsize : How many idle keep-alive connections are kept for each host - None keeps current
+        # @param dns_cache_ttl : Seconds a resolved address is reused, 0 turns the cache off - None keeps current
+    @classmethod
+    def configure(cls, pool_connections: int or None = None, pool_maxsize: int or None = None,
+                  dns_cache_ttl: int or None = None):
+        with cls.lock:
+            if pool_connections is not None:
+                cls.pool_connections = pool_connections
+            if pool_maxsize is not None:
+                cls.pool_maxsize = pool_maxsize
+            if dns_cache_ttl is not None:
+                cls.dns_cache_ttl = dns_cache_ttl
+            if cls.session is not None:  # Rebuild the pools with the new sizes
+                cls.session.close()
+                cls.session = None
+
+    # Method that gets the shared session, creating it on first use
+    def get_session(self):
+        cls = type(self)
+        with cls.lock:
+            if cls.session is None:
+                session = requests.Session()
+                adapter = CountingHTTPAdapter(pool_connections=cls.pool_connections, pool_maxsize=cls.pool_maxsize)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                cls.session = session
+            return cls.session
+
+    # Method that records that a request was sent through the shared session
+    @classmethod
+    def record_request(cls):
+        with cls.lock:
+            cls.requests_sent += 1
+
+    # Method that records that a brand new connection was opened, rather than a pooled one reused
+    @classmethod
+    def record_new_connection(cls):
+        with cls.lock:
+            cls.new_connections += 1
+
+    # Method that gets the connection statistics for this run
+    @classmethod
+    def get_stats(cls):
+        with cls.lock:
+            return {"requests": cls.requests_sent,
+                    "new_connections": cls.new_connections,
+                    "reused_connections": max(0, cls.requests_sent - cls.new_connections),
+                    "dns_lookups": cls.dns_lookups,
+                    "dns_cache_hits": cls.dns_hits}
+
+    # Method that gets a printable summary of the connection statistics
+    @classmethod
+    def get_summary(cls):
+        stats = cls.get_stats()
+        return (f"\n\tConnections Reused: {stats['reused_connections']}"
+                f"\n\tConnections Opened: {stats['new_connections']}"
+                f"\n\tDNS Cache Hits: {stats['dns_cache_hits']}/{stats['dns_lookups']}")
+
+    # Method that gets the address a host resolves to, remembering it for dns_cache_ttl seconds
+    # Only connections opened by the shared session use the cache, so name resolution for the rest of the process
+    #   is left alone
+    # Returns the address, or None if the cache is off or the host could not be resolved
+        # @param host : The host to resolve
+        # @param port : The port to connect to
+    @classmethod
+    def resolve(cls, host: str, port: int):
+        if cls.dns_cache_ttl <= 0:
+            return None
+        key = (host, port)
+        now = time.monotonic()
+        with cls.lock:
+            cls.dns_lookups += 1
+            entry = cls.dns_cache.get(key)
+            if entry is not None and entry[0] > now:
+                cls.dns_hits += 1
+                cls.dns_cache.move_to_end(key)
+                return entry[1]
+        try:  # Resolved outside the lock
+            result = socket.getaddrinfo(host, port, allowed_gai_family(), socket.SOCK_STREAM)
+        except OSError:
+            return None  # The connection resolves the host itself, and reports the error as usual
+        if not result:
+            return None
+        address = result[0][4][0]
+        with cls.lock:
+            cls.dns_cache[key] = (now + cls.dns_cache_ttl, address)
+            cls.dns_cache.move_to_end(key)
+            while len(cls.dns_cache) > cls.dns_cache_size:  # Forget the least recently used addresses
+                cls.dns_cache.popitem(last=False)
+        return address
+
+    # Method that opens a connection's socket to the cached address of its host
+    # The host name is still used for the Host header and for TLS, and a cached address that cannot be connected
+    #   to is forgotten, so the next attempt resolves the host again
+        # @param connection : The connection being opened
+        # @param new_conn : The connection's own method that opens its socket
+    @classmethod
+    def open_socket(cls, connection: HTTPConnection, new_conn):
+        host = connection._dns_host
+        address = cls.resolve(host, connection.port)
+        if address is None or address == host:
+            return new_conn()
+        connection._dns_host = address
+        try:
+            return new_conn()
+        except (NewConnectionError, ConnectTimeoutError):
+            with cls.lock:
+                cls.dns_cache.pop((host, connection.port), None)
+            raise
+        finally:
+            connection._dns_host = host
+
+
+# Connections that connect to the address the shared DNS cache holds for their host
+class CachedDNSHTTPConnection(HTTPConnection):
+    def _new_conn(self):
+        return Sessions.open_socket(self, super()._new_conn)
+
+
+class CachedDNSHTTPSConnection(HTTPSConnection):
+    def _new_conn(self):
+        return Sessions.open_socket(self, super()._new_conn)
+
+
+# Connection pools that count every new connection they have to open
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CachedDNSHTTPConnection
+
+    def _new_conn(self):
+        Sessions.record_new_connection()
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CachedDNSHTTPSConnection
+
+    def _new_conn(self):
+        Sessions.record_new_connection()
+        return super()._new_conn()
+
+
+# Transport adapter whose pools (including ones used through a proxy) count new connections and requests
+class CountingHTTPAdapter(HTTPAdapter):
+    pool_classes = {"http": CountingHTTPConnectionPool, "https": CountingHTTPSConnectionPool}
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self.pool_classes
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        manager.pool_classes_by_scheme = self.pool_classes
+        return manager
+
+    # Every request is timed until its headers arrive, and its status is counted for its host and used to pace it
+    def send(self, request, **kwargs):
+        Sessions.record_request()
+        host = (urlparse(request.url).hostname or "").lower()
+        start = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except requests.exceptions.RequestException as e:
+            Metrics.record_status(host, type(e).__name__)
+            raise
+        finally:
+            Metrics.observe("request", time.perf_counter() - start)
+        Metrics.record_status(host, response.status_code)
+        # Pace the host by how it is answering
+        RateLimiter.record_response(host, response.status_code, "Retry-After" in response.headers)
+        return response
@@ -1,57 +1,361 @@
+import hashlib
+import json
+import multiprocessing
 import os
+import shutil
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 import pymupdf
 
+from APG.ConversionManifest import ConversionManifest
 from APG.FileWriter import FileWriter
+from APG.MetadataStore import MetadataStore
+from APG.Metrics import Metrics
+from APG.NearDuplicateIndex import NearDuplicateIndex
 
 
 class TextConverterAndExtractor:
+    max_crashes = 2  # Times a file may be caught in a crashed worker before it is converted in isolation
+    save_every = 50  # Converted files between saves of the conversion manifest
+    abstract_pages = 3  # How many pages from the start of a document are searched for its abstract
+    min_image_width = 32  # Images narrower than this many pixels are skipped
+    min_image_height = 32  # Images shorter than this many pixels are skipped
+    min_image_bytes = 2048  # Images smaller than this many bytes are skipped
+    image_store = "_store"  # Folder inside Images that holds every distinct image, named by content hash
+    image_folders = True  # Also write each paper's images to Images/<index>/imageN.ext, linked to the store if possible
+    near_duplicates = 0  # Converted files found to be near-duplicates of another file this run
+    start_method = None  # How worker processes are started, such as "spawn" - None uses the platform default
+    executor = None  # A process pool kept open across calls by open_pool - None starts a new pool for each call
 
     # Method that converts the PDF articles into simple plain text representations
+    # A manifest of converted files is kept, so only new or changed PDFs are converted and the outputs of PDFs that
+    #   were deleted are removed, along with stored images no paper uses any more
+    # Files are independent, so with more than one worker they are spread across a process pool
         # @param path_to_directory : The path to the directory where all files will be saved
-    def convert_and_extract(self, path_to_directory: str):
-        path_list = Path(os.path.join(path_to_directory, "Articles")).glob("**/*.pdf")
-
-        for p in path_list:
-            writer = FileWriter()
-            index = p.stem
-            doc = pymupdf.open(p)  # Open the file
-
-            # Convert the PDF to plain text
-            content = ""  # String to store the text
-            # Extract the text and store in content
-            for _ in range(doc.page_count):
-                content += doc.load_page(_).get_text() + "\n"
-            # Write the text as a file
-            writer.write_file(os.path.join(path_to_directory, "Articles-Text", f"{index}.txt"), content, 'w', "utf-8")
-
-            # Only extract abstract if it does not already exist -- ArXiv supplies full abstracts in responses
-            if not os.path.exists(os.path.join(path_to_directory, "Abstracts", f"{index}.txt")):
-                # Extract text between "Abstract" and "Introduction" to catch most abstracts
-                abstract_start = content.lower().find("abstract")
-                if abstract_start != -1:
-                    abstract_end = content.lower().find("introduction", abstract_start)
-                    abstract = content[abstract_start:abstract_end].strip() if abstract_end != -1 \
-                        else content[abstract_start:].strip()
-                    writer.write_file(os.path.join(path_to_directory, "Abstracts", f"{index}.txt"), abstract, 'w', "utf-8")
-
-            # Extract images
-            image_list = []
-            i = 0
-            end = doc.xref_length()
-            for xref in range(1, end):
-                try:
-                    if doc.xref_is_image(xref) is False:
-                        continue
-                    img = doc.extract_image(xref)
-                except Exception as e:
-                    print(f"\nArticle: {index} - Encountered error with xref: {xref}\tError: ", e, flush=True)
+        # @param workers : The number of processes to convert files with
+        # @param force : Boolean toggle that converts every PDF, even ones that are up to date
+        # @param only : The paths of the PDFs to consider, such as ones that were just saved - None considers all
+    def convert_and_extract(self, path_to_directory: str, workers: int = 1, force: bool = False,
+                            only: list or None = None):
+        manifest = ConversionManifest(path_to_directory)
+        all_paths = sorted(Path(os.path.join(path_to_directory, "Articles")).glob("**/*.pdf"))
+        removed = manifest.remove_missing(all_paths)
+        if only is not None:
+            all_paths = sorted(Path(p) for p in only if os.path.exists(p))
+        paths = all_paths if force else [p for p in all_paths if not manifest.is_up_to_date(p)]
+        stale = removed
+        for p in paths:
+            stale += manifest.forget(p)  # Clear out what an older version of the file produced
+        try:
+            if workers > 1:
+                failed = self.__convert_in_pool(paths, path_to_directory, workers, manifest)
+            else:
+                failed = 0
+                for done, p in enumerate(paths, start=1):
+                    failed += self.__finish(p, self.convert_file(p, path_to_directory), done, len(paths),
+                                            path_to_directory, manifest)
+        finally:
+            manifest.save()
+        print(f"\rConverted {len(paths) - failed}/{len(paths)} files. {len(all_paths) - len(paths)} already up to "
+              f"date, {removed} removed, {self.near_duplicates} near-duplicates found.", flush=True)
+        if stale:  # Image lists were removed or rewritten, so some stored images may have lost every reference
+            unused = self.collect_images(path_to_directory)
+            if unused:
+                print(f"Removed {unused} stored images no paper uses any more.", flush=True)
+
+    # Method that opens a process pool that every later call converts files with, until close_pool is called
+    # Callers that convert files in many small batches, such as the pipelined mode, then start their workers once
+        # @param workers : The number of processes to convert files with
+    def open_pool(self, workers: int):
+        self.close_pool()
+        context = multiprocessing.get_context(self.start_method) if self.start_method else None
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+    # Method that shuts down the process pool opened by open_pool, if there is one
+    def close_pool(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    # Method that gets the state sent to worker processes along with the converter -- the pool stays behind
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("executor", None)
+        return state
+
+    # Method that counts the references to each image in the store from the Images/<index>.json lists, and removes
+    #   the images nothing refers to, such as those of papers that were deleted or converted again
+    # Returns how many images were removed
+        # @param path_to_directory : The path to the directory where all files are saved
+    def collect_images(self, path_to_directory: str):
+        images_directory = os.path.join(path_to_directory, "Images")
+        store_directory = os.path.join(images_directory, self.image_store)
+        if not os.path.isdir(store_directory):
+            return 0
+        references = Counter()
+        for list_path in Path(images_directory).glob("*.json"):
+            try:
+                with open(list_path, 'r', encoding="utf-8") as f:
+                    references.update(image["path"] for image in json.load(f))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                # Removing images this list may refer to could break it, so leave the store as it is
+                print(f"\nImage list '{list_path}' could not be read, so no stored images were removed: {e}",
+                      flush=True)
+                return 0
+        removed = 0
+        for root, _, names in os.walk(store_directory, topdown=False):
+            for name in names:
+                stored_path = f"{self.image_store}/{os.path.basename(root)}/{name}"
+                if name.endswith(".tmp") or references[stored_path]:
+                    continue
+                os.remove(os.path.join(root, name))
+                removed += 1
+            if root != store_directory and not os.listdir(root):
+                os.rmdir(root)
+        return removed
+
+    # Method that converts files across a process pool, reporting progress in the original file order
+    # If a worker process crashes (such as from a fault inside pymupdf) the unfinished files are retried in a new
+    #   pool, and files caught in more than one crash are converted one at a time so the bad file fails alone
+    # The pool opened by open_pool is used if there is one, and replaced if a crash breaks it
+        # @param paths : The paths of the PDFs to convert
+        # @param path_to_directory : The path to the directory where all files will be saved
+        # @param workers : The number of processes to convert files with
+        # @param manifest : The conversion manifest to record converted files in
+    def __convert_in_pool(self, paths: list, path_to_directory: str, workers: int, manifest: ConversionManifest):
+        crashes = {}  # Path -> times it was unfinished when a worker crashed
+        remaining = list(paths)
+        done = 0
+        failed = 0
+        context = multiprocessing.get_context(self.start_method) if self.start_method else None
+        while remaining:
+            isolated = [p for p in remaining if crashes.get(p, 0) >= self.max_crashes]
+            for p in isolated:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    try:
+                        result = executor.submit(self.convert_file, p, path_to_directory).result()
+                    except BrokenProcessPool:
+                        result = (None, [], "Worker process crashed", None, None)
+                done += 1
+                failed += self.__finish(p, result, done, len(paths), path_to_directory, manifest)
+
+            batch = [p for p in remaining if crashes.get(p, 0) < self.max_crashes]
+            remaining = []
+            executor = self.executor or ProcessPoolExecutor(max_workers=workers, mp_context=context)
+            try:
+                futures = [(p, executor.submit(self.convert_file, p, path_to_directory)) for p in batch]
+                for i, (p, future) in enumerate(futures):
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        # Keep the files that finished before the crash and retry the rest
+                        for q, f in futures[i:]:
+                            if f.done() and not f.cancelled() and f.exception() is None:
+                                done += 1
+                                failed += self.__finish(q, f.result(), done, len(paths), path_to_directory,
+                                                        manifest)
+                            else:
+                                crashes[q] = crashes.get(q, 0) + 1
+                                remaining.append(q)
+                        if executor is self.executor:  # A broken pool takes no more work
+                            self.open_pool(workers)
+                        break
+                    done += 1
+                    failed += self.__finish(p, result, done, len(paths), path_to_directory, manifest)
+            finally:
+                if executor is not self.executor:
+                    executor.shutdown()
+        return failed
+
+    # Method that records a converted file in the manifest and prints the progress, and whether the file failed
+    # The file's signature is also checked against the near-duplicate index, now that it includes the first page
+    # Returns 1 if the file failed and 0 otherwise, for counting
+        # @param path : The path of the PDF
+        # @param result : The (sha256, outputs, error, signature, seconds) tuple returned by convert_file
+        # @param done : How many files have been converted so far
+        # @param total : How many files are being converted
+        # @param path_to_directory : The path to the directory where all files will be saved
+        # @param manifest : The conversion manifest to record the file in
+    def __finish(self, path: Path, result: tuple, done: int, total: int, path_to_directory: str,
+                 manifest: ConversionManifest):
+        sha256, outputs, error, signature, seconds = result
+        if seconds is not None:  # Timed inside the worker, so the time it spent waiting in the pool is left out
+            Metrics.observe("convert", seconds)
+        if error is not None:
+            print(f"\nArticle: {path.stem} - Could not be converted\tError: {error}", flush=True)
+        else:
+            index = NearDuplicateIndex()
+            duplicate_of = index.update_paper(index.paper_key(path_to_directory, path.stem), signature)
+            if duplicate_of is not None:
+                self.near_duplicates += 1
+                print(f"\nArticle: {path.stem} - Near-duplicate of {duplicate_of}", flush=True)
+            manifest.record(path, sha256, outputs)
+            if done % self.save_every == 0:
+                manifest.save()  # Save as we go, so a crash does not lose the whole run's progress
+        print(f"\rConverting files... {done}/{total}", end="", flush=True)
+        return 0 if error is None else 1
+
+    # Method that converts a single PDF article, extracting its text, abstract, and images
+    # Returns the file's SHA-256 digest, the paths of every output made from it, any error, the near-duplicate
+    #   signature of its title, abstract, and first page, and how many seconds it took -- errors are returned
+    #   instead of raised, so one bad file never stops the rest
+        # @param p : The path of the PDF
+        # @param path_to_directory : The path to the directory where all files will be saved
+    def convert_file(self, p: Path, path_to_directory: str):
+        outputs = []
+        start = time.perf_counter()
+        try:
+            sha256 = ConversionManifest.hash_file(p)
+            signature = self.__convert(p, path_to_directory, outputs)
+        except Exception as e:
+            return None, outputs, f"{type(e).__name__}: {e}", None, time.perf_counter() - start
+        return sha256, outputs, None, signature, time.perf_counter() - start
+
+    # Method that finds the abstract of a document, looking only at the text blocks of its first few pages
+    # Extracts the text between "Abstract" and "Introduction" to catch most abstracts
+        # @param doc : The open pymupdf document
+    def __find_abstract(self, doc: pymupdf.Document):
+        blocks = []
+        for page_number in range(min(self.abstract_pages, doc.page_count)):
+            # Blocks are (x0, y0, x1, y1, text, block number, block type) and type 0 is text, rather than an image
+            blocks.extend(block[4] for block in doc.load_page(page_number).get_text("blocks", sort=True)
+                          if block[6] == 0)
+        content = "\n".join(blocks)
+        lowered = content.lower()
+        abstract_start = lowered.find("abstract")
+        if abstract_start == -1:
+            return None
+        abstract_end = lowered.find("introduction", abstract_start)
+        return content[abstract_start:abstract_end].strip() if abstract_end != -1 \
+            else content[abstract_start:].strip()
+
+    # Method that checks whether an image is below the pixel size limits, using only its dictionary, so small images
+    #   such as icons and logos are skipped without being extracted
+        # @param doc : The open pymupdf document
+        # @param xref : The cross-reference number of the image
+    def __is_too_small(self, doc: pymupdf.Document, xref: int):
+        for key, minimum in (("Width", self.min_image_width), ("Height", self.min_image_height)):
+            value_type, value = doc.xref_get_key(xref, key)
+            if value_type == "int" and int(value) < minimum:
+                return True
+        return False
+
+    # Method that extracts the images of a document into the corpus-wide image store
+    # Each image is written as soon as it is extracted, under the SHA-256 digest of its bytes, so an image that
+    #   appears in many papers (such as a publisher logo) is only stored once. The paper's images are listed in
+    #   Images/<index>.json, which points at their copies in the store
+    # Unless image_folders is turned off, the images are also placed in Images/<index>/imageN.ext as before, as hard
+    #   links to the store where the file system allows them and as copies where it does not
+        # @param doc : The open pymupdf document
+        # @param index : The index of the paper
+        # @param path_to_directory : The path to the directory where all files will be saved
+        # @param outputs : The list of outputs made from the paper, which the image list is added to
+    def __extract_images(self, doc: pymupdf.Document, index: str, path_to_directory: str, outputs: list):
+        images = []
+        for xref in range(1, doc.xref_length()):
+            try:
+                if doc.xref_is_image(xref) is False or self.__is_too_small(doc, xref):
                     continue
-                image_list.append((img['image'], img['ext'], i))
-                i += 1
-            for image in image_list:
-                writer.write_file(os.path.join(path_to_directory, "Images", index, f"image{image[2]}.{image[1]}"),
-                                  image[0], 'wb')
-
-            # Close the file and move to next
-            doc.close()
+                img = doc.extract_image(xref)
+            except Exception as e:
+                print(f"\nArticle: {index} - Encountered error with xref: {xref}\tError: ", e, flush=True)
+                continue
+            if not img or len(img['image']) < self.min_image_bytes:
+                continue
+            digest = hashlib.sha256(img['image']).hexdigest()
+            stored_path = f"{self.image_store}/{digest[:2]}/{digest}.{img['ext']}"
+            self.__store_image(os.path.join(path_to_directory, "Images", stored_path), img['image'])
+            name = f"image{len(images)}.{img['ext']}"
+            if self.image_folders:
+                outputs.append(os.path.join(path_to_directory, "Images", index, name))
+                self.__link_image(os.path.join(path_to_directory, "Images", stored_path), outputs[-1])
+            images.append({"name": name, "sha256": digest, "width": img['width'], "height": img['height'],
+                           "path": stored_path})
+        if images:
+            outputs.append(os.path.join(path_to_directory, "Images", f"{index}.json"))
+            FileWriter(background=False).write_file(outputs[-1], json.dumps(images, indent=1), 'w', "utf-8")
+
+    # Method that writes an image into the store, unless an identical image is already there
+    # The image is written to a temporary file and renamed into place, so parallel workers never see a partial image
+        # @param path : The path of the image in the store
+        # @param data : The bytes of the image
+    def __store_image(self, path: str, data: bytes):
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    # Method that places a stored image in a paper's own image folder, replacing whatever was there
+    # A hard link takes no extra space, and removing the stored image later leaves the paper's copy intact
+        # @param stored : The path of the image in the store
+        # @param path : The path of the image in the paper's folder
+    def __link_image(self, stored: str, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.link(stored, temp_path)
+        except OSError:  # Links are not supported here, or the store is on another file system
+            shutil.copyfile(stored, temp_path)
+        os.replace(temp_path, path)
+
+    def __convert(self, p: Path, path_to_directory: str, outputs: list):
+        writer = FileWriter(background=False)  # Outputs are listed in the manifest, so they must be written first
+        index = p.stem
+        doc = pymupdf.open(p)  # Open the file
+
+        # Convert the PDF to plain text, writing each page as it is extracted so only one page is held in memory
+        # The pages go to a temporary file in the same folder, which is renamed into place once every page is written,
+        #   so a conversion that stops part way never leaves a truncated text file behind
+        outputs.append(os.path.join(path_to_directory, "Articles-Text", f"{index}.txt"))
+        temp_path = f"{outputs[-1]}.{os.getpid()}.tmp"
+        text_file = writer.open_file(temp_path, 'w', "utf-8")
+        if text_file is not None:
+            try:
+                with text_file:
+                    for page in doc:
+                        text_file.write(page.get_text() + "\n")
+                os.replace(temp_path, outputs[-1])
+            except BaseException:
+                os.remove(temp_path)
+                raise
+
+        # Only extract abstract if it does not already exist -- ArXiv supplies full abstracts in responses
+        store = MetadataStore()
+        paper = store.get_paper(path_to_directory, int(index)) \
+            if index.isdigit() and store.exists(path_to_directory) else None
+        if paper is not None:  # The fields were saved to the metadata store rather than to their own files
+            abstract = paper["abstract"]
+            if abstract is None:
+                abstract = self.__find_abstract(doc)
+                if abstract is not None:
+                    store.set_abstract(path_to_directory, int(index), abstract)
+            title = paper["title"] or ""
+        else:
+            abstract_path = os.path.join(path_to_directory, "Abstracts", f"{index}.txt")
+            if not os.path.exists(abstract_path):
+                abstract = self.__find_abstract(doc)
+                if abstract is not None:
+                    outputs.append(abstract_path)
+                    writer.write_file(outputs[-1], abstract, 'w', "utf-8")
+            else:
+                abstract = Path(abstract_path).read_text(encoding="utf-8")
+            title_path = os.path.join(path_to_directory, "Titles", f"{index}.txt")
+            title = Path(title_path).read_text(encoding="utf-8") if os.path.exists(title_path) else ""
+
+        # Build the near-duplicate signature from the title, abstract, and first page
+        first_page = doc.load_page(0).get_text() if doc.page_count else ""
+        signature = NearDuplicateIndex.signature(f"{title}\n{abstract or ''}\n{first_page}")
+
+        # Extract images into the corpus-wide image store
+        self.__extract_images(doc, index, path_to_directory, outputs)
+
+        # Close the file and move to next
+        doc.close()
+        return signature
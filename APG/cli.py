@@ -1,11 +1,25 @@
 import argparse
+import cProfile
 import os
 import json
+import pstats
 
+from APG.DuplicateFilter import DuplicateFilter
 from APG.FileGatherer import FileGatherer
+from APG.FileWriter import FileWriter
+from APG.IdentityResolver import IdentityResolver
+from APG.MetadataStore import MetadataStore
+from APG.Metrics import Metrics
+from APG.NearDuplicateIndex import NearDuplicateIndex
+from APG.Pipeline import Pipeline
+from APG.Proxies import Proxies
 from APG.ResultGatherer import ResultGatherer
 from APG.TextConverterAndExtractor import TextConverterAndExtractor
 from APG.ArxivScraper import ArxivScraper
+from APG.RateLimiter import RateLimiter
+from APG.ResponseCache import ResponseCache
+from APG.RetryPolicy import RetryPolicy
+from APG.Sessions import Sessions
 
 
 # Method that validates a CLI parameter is a positive integer
@@ -17,6 +31,33 @@ def valid_positive_int(value):
     return ivalue
 
 
+# Method that validates a CLI parameter is an integer of zero or more
+    # @param value : The value to validate
+def valid_non_negative_int(value):
+    ivalue = int(value)
+    if ivalue < 0:
+        raise argparse.ArgumentTypeError("Must be an integer of 0 or more.")
+    return ivalue
+
+
+# Method that validates a CLI parameter is a number greater than zero
+    # @param value : The value to validate
+def valid_positive_float(value):
+    fvalue = float(value)
+    if fvalue <= 0:
+        raise argparse.ArgumentTypeError("Must be a number greater than 0.")
+    return fvalue
+
+
+# Method that validates a CLI parameter is a number of zero or more
+    # @param value : The value to validate
+def valid_non_negative_float(value):
+    fvalue = float(value)
+    if fvalue < 0:
+        raise argparse.ArgumentTypeError("Must be a number of 0 or more.")
+    return fvalue
+
+
 # Method that validates a CLI parameter is a valid year
     # @param value : The value to validate
 def valid_year(value):
@@ -26,19 +67,80 @@ def valid_year(value):
     return ivalue
 
 
+# Method that validates a CLI parameter is a similarity between 0 and 1
+    # @param value : The value to validate
+def valid_similarity(value):
+    fvalue = float(value)
+    if fvalue < 0 or fvalue > 1:
+        raise argparse.ArgumentTypeError("Similarity must be between 0 and 1.")
+    return fvalue
+
+
+# Method that validates a CLI parameter is a HOST=SECONDS rate budget
+    # @param value : The value to validate
+def valid_host_delay(value):
+    host, sep, seconds = value.partition("=")
+    try:
+        seconds = float(seconds)
+    except ValueError:
+        seconds = -1
+    if not sep or not host or seconds < 0:
+        raise argparse.ArgumentTypeError("Must be HOST=SECONDS, with SECONDS zero or more.")
+    return host, seconds
+
+
+# Method that loads the Google Scholar and ArXiv results saved in a directory, with results that are the same paper
+#   as another result marked so that each paper is only fetched once, from its cheapest source
+# Only the sources given are loaded, so results left from an earlier run of the other source never cause a skip
+    # @param directory : The directory files are saved to
+    # @param sources : The sources scraped for this run, from "scholar" and "arxiv"
+def load_resolved_results(directory, sources=("scholar", "arxiv")):
+    results_by_source = {}
+    for source, results_path in (("scholar", os.path.join(directory, "results.txt")),
+                                 ("arxiv", os.path.join(directory, "ArXiv", "results.txt"))):
+        if source in sources and os.path.exists(results_path):
+            with open(results_path, 'r') as f:
+                results_by_source[source] = json.load(f)
+    IdentityResolver().resolve(results_by_source)
+    return results_by_source
+
+
 # Method that runs the ArXiv portion of the tool
     # @param query : The ArXiv search query
     # @param directory : The directory to save files to
     # @param total_results : The total number of results to gather
     # @param meta_can_be_missing : Boolean toggle that determines if absent title and author is acceptable
-def run_arxiv(query, directory, total_results, meta_can_be_missing):
+    # @param resume : Boolean toggle that reuses saved results and continues an interrupted run
+def run_arxiv(query, directory, total_results, meta_can_be_missing, resume=False):
+    run_arxiv_scraper(query, directory, total_results, resume)
+    run_arxiv_gatherer(query, directory, meta_can_be_missing, resume)
+
+
+# Method that runs the ArXiv result scraping, saving the results to the ArXiv folder
+    # @param query : The ArXiv search query
+    # @param directory : The directory to save files to
+    # @param total_results : The total number of results to gather
+    # @param resume : Boolean toggle that reuses saved results instead of scraping them again
+def run_arxiv_scraper(query, directory, total_results, resume=False):
     directory_updated = os.path.join(directory, "ArXiv")
-    scraper = ArxivScraper()
-    results = scraper.scrape_results(query, total_results)
+    results_path = os.path.join(directory_updated, "results.txt")
+    if resume and os.path.exists(results_path):
+        return
+    results = ArxivScraper().scrape_results(query, total_results)
     os.makedirs(directory_updated, exist_ok=True)
-    with open(os.path.join(directory_updated, "results.txt"), 'w') as f:
+    with open(results_path, 'w') as f:
         json.dump(results, f)
-    scraper.gather_files(results, query, directory_updated, meta_can_be_missing)
+
+
+# Method that runs the ArXiv file gathering, skipping papers that are also in the Google Scholar results
+    # @param query : The ArXiv search query
+    # @param directory : The directory to save files to
+    # @param meta_can_be_missing : Boolean toggle that determines if absent title and author is acceptable
+    # @param resume : Boolean toggle that continues an interrupted run
+    # @param include_scholar : Boolean toggle that skips papers in this run's Google Scholar results
+def run_arxiv_gatherer(query, directory, meta_can_be_missing, resume=False, include_scholar=False):
+    results = load_resolved_results(directory, ("scholar", "arxiv") if include_scholar else ("arxiv",))["arxiv"]
+    ArxivScraper().gather_files(results, query, os.path.join(directory, "ArXiv"), meta_can_be_missing, resume)
 
 
 # Method that runs the result gathering portion of the tool
@@ -47,7 +149,12 @@ def run_arxiv(query, directory, total_results, meta_can_be_missing):
     # @param total_results : The total number of results to gather
     # @param year_start : The starting year of a date range - use None if no filtering is desired
     # @param year_end : The ending year of a date range - use None if no filtering is desired
-def run_result_gatherer(query, directory, total_results, year_start, year_end):
+    # @param resume : Boolean toggle that reuses the saved results instead of scraping them again
+def run_result_gatherer(query, directory, total_results, year_start, year_end, resume=False):
+    results_path = os.path.join(directory, "results.txt")
+    if resume and os.path.exists(results_path):
+        with open(results_path, 'r') as f:
+            return json.load(f)
     results = ResultGatherer().scrape_results(query, total_results, year_start, year_end)
     os.makedirs(directory, exist_ok=True)
     with open(os.path.join(directory, "results.txt"), 'w') as f:
@@ -61,19 +168,51 @@ def run_result_gatherer(query, directory, total_results, year_start, year_end):
     # @param year_start : The starting year of a date range - use None if no filtering is desired
     # @param year_end : The ending year of a date range - use None if no filtering is desired
     # @param meta_can_be_missing : Boolean toggle that determines if absent title and author is acceptable
-def run_file_gatherer(query, directory, year_start, year_end, meta_can_be_missing):
+    # @param concurrency : The number of results to fetch at once
+    # @param resume : Boolean toggle that continues an interrupted run
+    # @param include_arxiv : Boolean toggle that skips papers in this run's ArXiv results
+def run_file_gatherer(query, directory, year_start, year_end, meta_can_be_missing, concurrency=1, resume=False,
+                      include_arxiv=False):
     results_path = os.path.join(directory, "results.txt")
     if not os.path.exists(results_path):
         raise FileNotFoundError(f"Cannot find results file: {results_path}")
-    with open(results_path, 'r') as f:
-        results = json.load(f)
-    FileGatherer().gather_files(results, query, directory, meta_can_be_missing, year_start, year_end)
+    results = load_resolved_results(directory, ("scholar", "arxiv") if include_arxiv else ("scholar",))["scholar"]
+    FileGatherer().gather_files(results, query, directory, meta_can_be_missing, year_start, year_end, concurrency,
+                                resume)
 
 
 # Method that runs the text converting and extracting portion of the tool
     # @param directory : The directory to save files to
-def run_text_converter(directory):
-    TextConverterAndExtractor().convert_and_extract(directory)
+    # @param workers : The number of processes to convert files with
+    # @param force : Boolean toggle that converts every file, even ones that are up to date
+    # @param min_image_size : Images narrower or shorter than this many pixels are skipped - None keeps the default
+    # @param min_image_bytes : Images smaller than this many bytes are skipped - None keeps the default
+    # @param image_folders : Boolean toggle that also writes each paper's images to its own Images/<index> folder
+def run_text_converter(directory, workers=1, force=False, min_image_size=None, min_image_bytes=None,
+                       image_folders=True):
+    converter = TextConverterAndExtractor()
+    # Set on the instance, so worker processes receive the settings along with the converter
+    if min_image_size is not None:
+        converter.min_image_width = converter.min_image_height = min_image_size
+    if min_image_bytes is not None:
+        converter.min_image_bytes = min_image_bytes
+    converter.image_folders = image_folders
+    converter.convert_and_extract(directory, workers, force)
+
+
+# Method that rebuilds the one-file-per-field folders of a directory, and of its ArXiv folder, from their metadata
+#   stores
+    # @param directory : The directory files are saved to
+def run_export(directory):
+    store = MetadataStore()
+    exported = False
+    for path_to_directory in (directory, os.path.join(directory, "ArXiv")):
+        if store.exists(path_to_directory):
+            print(f"Exported {store.export(path_to_directory)} papers to the folders of '{path_to_directory}'.",
+                  flush=True)
+            exported = True
+    if not exported:
+        raise FileNotFoundError(f"Cannot find a metadata store in: {directory}")
 
 
 # Method that parses CLI arguments
@@ -82,8 +221,62 @@ def parse_args():
     parser = argparse.ArgumentParser(description="Run the data gathering and processing pipeline.")
     subparsers = parser.add_subparsers(dest='command', required=True)
 
+    # Create a parent parser for the options shared by every subcommand
+    report_parser = argparse.ArgumentParser(add_help=False)
+    report_parser.add_argument('--profile', action='store_true',
+                               help='Flag to run the command under cProfile, saving profile.pstats to --directory')
+    report_parser.add_argument('--prometheus', action='store_true',
+                               help='Flag to also save the run report in Prometheus text format, as metrics.prom')
+
+    # Create a parent parser for the options shared by every subcommand that makes requests
+    network_parser = argparse.ArgumentParser(add_help=False)
+    network_parser.add_argument('--host_delay', type=valid_host_delay, action='append', default=[],
+                                help='Seconds between requests to a host, as HOST=SECONDS (repeatable)')
+    network_parser.add_argument('--pool_size', type=valid_positive_int, default=None,
+                                help='How many keep-alive connections to keep open for each host')
+    network_parser.add_argument('--dns_cache_ttl', type=valid_non_negative_int, default=None,
+                                help='Seconds to reuse a resolved host address (0 disables the DNS cache)')
+    network_parser.add_argument('--max_file_size', type=valid_positive_int, default=None,
+                                help='Largest file to download, in megabytes (default: 100)')
+    network_parser.add_argument('--cache_dir', default=None,
+                                help='Directory for the download cache (default: .cache inside --directory)')
+    network_parser.add_argument('--no_cache', action='store_true', help='Flag to turn off the download cache')
+    network_parser.add_argument('--cache_size', type=valid_positive_int, default=None,
+                                help='Megabytes the download cache may take up before the least recently used files '
+                                     'are removed (default: 1024)')
+    network_parser.add_argument('--max_tries', type=valid_positive_int, default=None,
+                                help='Attempts at each request that fails with a status such as 429 or 503, or a '
+                                     'connection error (default: 3)')
+    network_parser.add_argument('--max_backoff', type=valid_positive_float, default=None,
+                                help='Longest wait between attempts at a request, in seconds (default: 60)')
+
+    # Create a parent parser for the options shared by every subcommand that saves papers
+    gather_parser = argparse.ArgumentParser(add_help=False)
+    gather_parser.add_argument('--near_duplicate_threshold', type=valid_similarity, default=None,
+                               help='Similarity (0 to 1) at which papers count as near-duplicates, 0 turns the check '
+                                    'off (default: 0.8)')
+    gather_parser.add_argument('--prioritize', action='store_true',
+                               help='Flag to fetch results from most to least relevant, scored on their title and '
+                                    'snippet or abstract')
+    gather_parser.add_argument('--prune_margin', type=valid_non_negative_float, default=None,
+                               help='Skip results whose title and snippet or abstract score more than this far below '
+                                    'the relevance threshold, without fetching them')
+    gather_parser.add_argument('--time_budget', type=valid_positive_float, default=None,
+                               help='Seconds to spend gathering files, after which the rest are left for --resume')
+    gather_parser.add_argument('--byte_budget', type=valid_positive_float, default=None,
+                               help='Megabytes to download while gathering files, after which the rest are left for '
+                                    '--resume')
+    gather_parser.add_argument('--metadata_store', action='store_true',
+                               help='Flag to save the fields of each paper to metadata.sqlite3 instead of to one file '
+                                    'per field (use the export command to write those files)')
+    gather_parser.add_argument('--sync_writes', action='store_true',
+                               help='Flag to write files on the thread that fetched them, instead of in the background')
+    gather_parser.add_argument('--fsync', action='store_true',
+                               help='Flag to sync each batch of saved files to the disk, so they survive a power loss')
+
     # Add a subparser for running all portions of the tool
-    all_parser = subparsers.add_parser('all', help='Run the full pipeline')
+    all_parser = subparsers.add_parser('all', parents=[report_parser, network_parser, gather_parser],
+                                       help='Run the full pipeline')
     all_parser.add_argument('--query', required=True, help='The search query to use')
     all_parser.add_argument('--directory', required=True, help='The directory to save files to')
     all_parser.add_argument('--total_results', type=valid_positive_int, default=100, help='How many results to scrape')
@@ -92,18 +285,32 @@ def parse_args():
     all_parser.add_argument('--meta_can_be_missing', action='store_true',
                             help='Flag allowing for articles with missing metadata to be gathered')
     all_parser.add_argument('--include_arxiv', action='store_true', help='Flag to also scrape results from ArXiv')
+    all_parser.add_argument('--concurrency', type=valid_positive_int, default=1,
+                            help='How many results to fetch at once (never two results on the same host)')
+    all_parser.add_argument('--resume', action='store_true',
+                            help='Flag to skip work finished by an interrupted run and continue its numbering')
+    all_parser.add_argument('--workers', type=valid_positive_int, default=1,
+                            help='How many processes to convert files with')
+    all_parser.add_argument('--pipeline', action='store_true',
+                            help='Flag to run scraping, gathering, and converting at the same time instead of in turn')
 
     # Add a subparser for running the ArXiv portion of the tool
-    arxiv_parser = subparsers.add_parser('arxiv', help='Run ArXiv scraping and gathering')
+    arxiv_parser = subparsers.add_parser('arxiv', parents=[report_parser, network_parser, gather_parser],
+                                         help='Run ArXiv scraping and gathering')
     arxiv_parser.add_argument('--query', required=True, help='The search query to use')
     arxiv_parser.add_argument('--directory', required=True, help='The directory to save files to')
     arxiv_parser.add_argument('--total_results', type=valid_positive_int, default=100, help='How many results to scrape')
     arxiv_parser.add_argument('--meta_can_be_missing', action='store_true',
                               help='Flag allowing for articles with missing metadata to be gathered')
     arxiv_parser.add_argument('--convert_to_plain', action='store_true', help='Flag to also convert PDFs to plain text')
+    arxiv_parser.add_argument('--resume', action='store_true',
+                              help='Flag to skip work finished by an interrupted run and continue its numbering')
+    arxiv_parser.add_argument('--workers', type=valid_positive_int, default=1,
+                              help='How many processes to convert files with')
 
     # Add a subparser for running just the result gathering portion of the tool
-    res_parser = subparsers.add_parser('results', help='Run only result gathering')
+    res_parser = subparsers.add_parser('results', parents=[report_parser, network_parser],
+                                       help='Run only result gathering')
     res_parser.add_argument('--query', required=True, help='The search query to use')
     res_parser.add_argument('--directory', required=True, help='The directory to save files to')
     res_parser.add_argument('--total_results', type=valid_positive_int, default=100, help='How many results to scrape')
@@ -111,17 +318,43 @@ def parse_args():
     res_parser.add_argument('--year_end', type=valid_year, default=None, help='The end year of articles to gather')
 
     # Add a subparser for running just the file gathering portion of the tool
-    files_parser = subparsers.add_parser('files', help='Run only file gathering')
+    files_parser = subparsers.add_parser('files', parents=[report_parser, network_parser, gather_parser],
+                                         help='Run only file gathering')
     files_parser.add_argument('--query', required=True, help='The search query to use')
     files_parser.add_argument('--directory', required=True, help='The directory to save files to')
     files_parser.add_argument('--year_start', type=valid_year, default=None, help='The start year of articles to gather')
     files_parser.add_argument('--year_end', type=valid_year, default=None, help='The end year of articles to gather')
     files_parser.add_argument('--meta_can_be_missing', action='store_true',
                               help='Flag allowing for articles with missing metadata to be gathered')
+    files_parser.add_argument('--concurrency', type=valid_positive_int, default=1,
+                              help='How many results to fetch at once (never two results on the same host)')
+    files_parser.add_argument('--resume', action='store_true',
+                              help='Flag to skip work finished by an interrupted run and continue its numbering')
 
     # Add a subparser for running just the text converting and extracting portion of the tool
-    conv_parser = subparsers.add_parser('convert', help='Run only text conversion and extraction')
+    conv_parser = subparsers.add_parser('convert', parents=[report_parser],
+                                        help='Run only text conversion and extraction')
     conv_parser.add_argument('--directory', required=True, help='The directory files are saved to')
+    conv_parser.add_argument('--workers', type=valid_positive_int, default=1,
+                             help='How many processes to convert files with')
+    conv_parser.add_argument('--near_duplicate_threshold', type=valid_similarity, default=None,
+                             help='Similarity (0 to 1) at which papers count as near-duplicates, 0 turns the check '
+                                  'off (default: 0.8)')
+    conv_parser.add_argument('--force', action='store_true',
+                             help='Flag to convert every file again, even ones that are already up to date')
+    conv_parser.add_argument('--min_image_size', type=valid_non_negative_int, default=None,
+                             help='Skip images narrower or shorter than this many pixels (default: 32)')
+    conv_parser.add_argument('--min_image_bytes', type=valid_non_negative_int, default=None,
+                             help='Skip images smaller than this many bytes (default: 2048)')
+    conv_parser.add_argument('--no_image_folders', action='store_true',
+                             help='Flag to only list each paper\'s images in Images/<index>.json, without also '
+                                  'writing them to an Images/<index> folder')
+
+    # Add a subparser for rebuilding the one-file-per-field folders from a metadata store
+    export_parser = subparsers.add_parser('export', parents=[report_parser],
+                                          help='Write the Titles, Keywords, Authors, ModDate, Abstracts, and Bad '
+                                               'folders from a metadata store')
+    export_parser.add_argument('--directory', required=True, help='The directory files are saved to')
 
     return parser.parse_args()
 
@@ -129,27 +362,95 @@ def parse_args():
 def main():
     args = parse_args()  # Get the args
 
+    # Apply any custom per-host rate budgets and connection pool settings before anything is requested
+    for host, seconds in getattr(args, 'host_delay', []):
+        RateLimiter.set_budget(host, seconds)
+    Sessions.configure(pool_maxsize=getattr(args, 'pool_size', None),
+                       dns_cache_ttl=getattr(args, 'dns_cache_ttl', None))
+    RetryPolicy.configure(max_tries=getattr(args, 'max_tries', None), max_delay=getattr(args, 'max_backoff', None))
+    if getattr(args, 'max_file_size', None) is not None:
+        FileGatherer.max_file_size = args.max_file_size * 1024 * 1024
+    if hasattr(args, 'no_cache') and not args.no_cache:
+        ResponseCache.configure(args.cache_dir or os.path.join(args.directory, ".cache"),
+                                max_size=args.cache_size * 1024 * 1024 if args.cache_size is not None else None)
+        Proxies.configure(os.path.join(args.cache_dir or os.path.join(args.directory, ".cache"), "proxies.json"))
+    if args.command in ('all', 'results'):  # Check proxies in the background, ready for when Scholar starts refusing
+        Proxies.warm()
+    if hasattr(args, 'prioritize'):  # Every gathering command shares the same budget
+        # Papers saved by every run and command in this directory are skipped
+        DuplicateFilter.configure(os.path.join(args.directory, "duplicates.sqlite3"))
+        FileGatherer.prioritize = args.prioritize
+        FileGatherer.prune_margin = args.prune_margin
+        FileGatherer.time_budget = args.time_budget
+        FileGatherer.byte_budget = args.byte_budget * 1024 * 1024 if args.byte_budget is not None else None
+    if hasattr(args, 'metadata_store'):
+        MetadataStore.enabled = args.metadata_store
+    if hasattr(args, 'sync_writes'):
+        FileWriter.configure(background=not args.sync_writes, fsync=args.fsync)
+    if hasattr(args, 'near_duplicate_threshold'):
+        NearDuplicateIndex.configure(os.path.join(args.directory, "near_duplicates.sqlite3"),
+                                     args.near_duplicate_threshold)
+
+    # Save the run report even when the command fails part way, since that is when it is needed most
+    Metrics.reset()
+    try:
+        if args.profile:
+            profiler = cProfile.Profile()
+            try:
+                profiler.runcall(run_command, args)
+            finally:
+                profile_path = os.path.join(args.directory, "profile.pstats")
+                os.makedirs(args.directory, exist_ok=True)
+                profiler.dump_stats(profile_path)
+                print(f"\nProfile saved to {profile_path}. The slowest calls, by cumulative time:", flush=True)
+                pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+        else:
+            run_command(args)
+    finally:
+        Proxies.save()  # Requests only save the proxy pool now and then, so keep what changed since
+        report_path = Metrics.export(args.directory, args.command, args.prometheus,
+                                     {"connections": Sessions.get_stats(), "retries": RetryPolicy.get_stats(),
+                                      "proxies": Proxies.get_stats(), "writes": FileWriter.get_stats()})
+        print(f"\nRun report saved to {report_path}", flush=True)
+
+
+# Method that runs the portion(s) of the tool the parsed arguments ask for
+    # @param args : The parsed CLI arguments
+def run_command(args):
     # Run only the portion(s) of the tool that is appropriate
-    if args.command == 'all':
-        run_result_gatherer(args.query, args.directory, args.total_results, args.year_start, args.year_end)
-        run_file_gatherer(args.query, args.directory, args.year_start, args.year_end, args.meta_can_be_missing)
+    if args.command == 'all' and args.pipeline:
+        Pipeline(args.query, args.directory, args.total_results, args.year_start, args.year_end,
+                 args.meta_can_be_missing, args.include_arxiv, args.concurrency, args.workers, args.resume).run()
+
+    elif args.command == 'all':
+        run_result_gatherer(args.query, args.directory, args.total_results, args.year_start, args.year_end,
+                            args.resume)
+        if args.include_arxiv:  # Scrape ArXiv first, so papers in both result lists are only fetched once
+            run_arxiv_scraper(args.query, args.directory, args.total_results, args.resume)
+        run_file_gatherer(args.query, args.directory, args.year_start, args.year_end, args.meta_can_be_missing,
+                          args.concurrency, args.resume, args.include_arxiv)
         if args.include_arxiv:
-            run_arxiv(args.query, args.directory, args.total_results, args.meta_can_be_missing)
-        run_text_converter(args.directory)
+            run_arxiv_gatherer(args.query, args.directory, args.meta_can_be_missing, args.resume, True)
+        run_text_converter(args.directory, args.workers)
 
     elif args.command == 'arxiv':
-        run_arxiv(args.query, args.directory, args.total_results, args.meta_can_be_missing)
+        run_arxiv(args.query, args.directory, args.total_results, args.meta_can_be_missing, args.resume)
         if args.convert_to_plain:
-            run_text_converter(args.directory)
+            run_text_converter(args.directory, args.workers)
 
     elif args.command == 'results':
         run_result_gatherer(args.query, args.directory, args.total_results, args.year_start, args.year_end)
 
     elif args.command == 'files':
-        run_file_gatherer(args.query, args.directory, args.year_start, args.year_end, args.meta_can_be_missing)
+        run_file_gatherer(args.query, args.directory, args.year_start, args.year_end, args.meta_can_be_missing,
+                          args.concurrency, args.resume)
 
     elif args.command == 'convert':
-        run_text_converter(args.directory)
+        run_text_converter(args.directory, args.workers, args.force, args.min_image_size, args.min_image_bytes,
+                           not args.no_image_folders)
+
+    elif args.command == 'export':
+        run_export(args.directory)
 
 
 if __name__ == '__main__':
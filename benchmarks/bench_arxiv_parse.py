@@ -0,0 +1,103 @@
+# Benchmark comparing parsing ArXiv API pages with BeautifulSoup (as the scraper used to) against parse_feed
+# Builds one large Atom feed from the entries of saved fixtures and parses it with both, each in its own process, so
+#   their time and peak memory can be compared, and checks that every result is identical
+# Usage: python benchmarks/bench_arxiv_parse.py [fixture ...] [--entries N]
+import argparse
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from APG.ArxivScraper import ArxivScraper
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+# Builds a feed holding the given number of entries, repeated from the entries of the fixtures
+    # @param fixtures : The paths of saved ArXiv API responses
+    # @param entries : How many entries the feed holds
+    # @param path : The path to write the feed to
+def build_feed(fixtures: list, entries: int, path: str):
+    texts = [Path(fixture).read_text(encoding="utf-8") for fixture in fixtures]
+    samples = [entry for text in texts for entry in re.findall(r"<entry>.*?</entry>", text, re.DOTALL)]
+    head = texts[0][:texts[0].index("<entry>")]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(head)
+        for n in range(entries):
+            f.write(samples[n % len(samples)].replace("</title>", f" {n}</title>", 1))
+        f.write("\n</feed>\n")
+
+
+# Parses a feed the way the scraper did before parse_feed, building the whole document with BeautifulSoup
+    # @param path : The path of the feed
+def parse_with_soup(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        soup = BeautifulSoup(f.read(), features="xml")
+    results = []
+    for element in soup.select("entry"):
+        title = element.select_one('title')
+        authors = [author.text for author in element.select('author > name')]
+        link = element.select_one('id')
+        mod_date = element.select_one('updated')
+        abstract = element.select_one('summary')
+        results.append({
+            "title": title.text if title else "No title",
+            "authors": ", ".join(authors) if authors else "No authors",
+            "link": link.text.replace("abs", "pdf") if link else None,
+            "mod_date": mod_date.text[:7] if mod_date else None,
+            "abstract": abstract.text if abstract else None
+        })
+    return results
+
+
+# Parses a feed in a child process and sends back the time taken, the peak memory, and the results
+    # @param parser : "soup" or "iterparse"
+    # @param path : The path of the feed
+    # @param connection : The pipe to send the measurements through
+def run_parser(parser: str, path: str, connection):
+    start = time.perf_counter()
+    if parser == "soup":
+        results = parse_with_soup(path)
+    else:
+        with open(path, "rb") as f:
+            results = list(ArxivScraper().parse_feed(f))
+    elapsed = time.perf_counter() - start
+    connection.send((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, results))
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare BeautifulSoup and iterparse parsing of ArXiv API pages")
+    parser.add_argument('fixtures', nargs='*', default=None, help='Saved ArXiv API responses to build the feed from')
+    parser.add_argument('--entries', type=int, default=30000, help='How many entries the built feed holds')
+    args = parser.parse_args()
+
+    fixtures = args.fixtures or sorted(FIXTURES.glob("*.xml"))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "feed.xml")
+        build_feed(fixtures, args.entries, path)
+        print(f"Parsing a feed of {args.entries} entries, {os.path.getsize(path) / (1024 * 1024):.1f} MB")
+        measured = {}
+        for name in ("soup", "iterparse"):
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=run_parser, args=(name, path, sender))
+            process.start()
+            measured[name] = receiver.recv()
+            process.join()
+
+    for name, (elapsed, peak, _) in measured.items():
+        print(f"\t{name:10} {elapsed:8.2f} s\tpeak memory {peak:8.1f} MB")
+    mismatches = sum(1 for a, b in zip(measured["soup"][2], measured["iterparse"][2]) if a != b)
+    mismatches += abs(len(measured["soup"][2]) - len(measured["iterparse"][2]))
+    print(f"\tSpeedup: {measured['soup'][0] / measured['iterparse'][0]:.1f}x\n\tMismatched results: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
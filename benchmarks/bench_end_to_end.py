@@ -0,0 +1,152 @@
+# End-to-end benchmark of the whole pipeline, run offline against the local stub server in stub_server.py
+# Google Scholar, the ArXiv API, and every publisher site are pointed at the stub server through ResultGatherer.base_url
+#   and ArxivScraper.api_url, and rate budgets are turned off, so each stage runs as fast as the code allows
+# Each stage is timed on its own and reported as throughput, with per-item latencies taken from the Metrics
+#   histograms, so the numbers can be saved with --output and compared across releases
+# Usage: python benchmarks/bench_end_to_end.py [--results N] [--concurrency N] [--workers N] [--pipeline]
+#   [--output results.json]
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from importlib import metadata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from APG.ArxivScraper import ArxivScraper
+from APG.DuplicateFilter import DuplicateFilter
+from APG.FileGatherer import FileGatherer
+from APG.Metrics import Metrics
+from APG.NearDuplicateIndex import NearDuplicateIndex
+from APG.Pipeline import Pipeline
+from APG.RateLimiter import RateLimiter
+from APG.ResultGatherer import ResultGatherer
+from APG.TextConverterAndExtractor import TextConverterAndExtractor
+from stub_server import StubServer
+
+QUERY = "deep learning for protein folding"
+
+
+# Estimates a percentile of a stage's latencies from its histogram, as the upper bound of the bucket it falls in
+    # @param stage : The stage, as reported by Metrics.report
+    # @param percentile : The percentile, from 0 to 1
+def estimate_percentile(stage: dict, percentile: float):
+    target = percentile * stage["count"]
+    seen = 0
+    for bound, count in stage["buckets"].items():
+        seen += count
+        if seen >= target:
+            return stage["max_seconds"] if bound == "+Inf" else min(float(bound), stage["max_seconds"])
+    return stage["max_seconds"]
+
+
+# Runs one stage with its output hidden, and measures it
+# Returns the stage's measurements: wall time, items per second, bytes downloaded, and the latencies it recorded
+    # @param name : The name of the stage
+    # @param items : How many items the stage handles, for its throughput
+    # @param work : Function that runs the stage
+def run_stage(name: str, items: int, work):
+    Metrics.reset()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        work()
+    wall = time.perf_counter() - start
+    report = Metrics.report(name)
+    downloaded = report["counters"].get("bytes_downloaded", 0)
+    latencies = {stage: {"count": values["count"], "mean_seconds": values["mean_seconds"],
+                         "p50_seconds": estimate_percentile(values, 0.5),
+                         "p95_seconds": estimate_percentile(values, 0.95), "max_seconds": values["max_seconds"]}
+                 for stage, values in report["stages"].items()}
+    return {"wall_seconds": round(wall, 3), "items": items, "items_per_second": round(items / wall, 2),
+            "bytes_downloaded": downloaded, "megabytes_per_second": round(downloaded / wall / (1024 * 1024), 2),
+            "latencies": latencies}
+
+
+# Prints the measurements of every stage as a table
+    # @param stages : Stage name -> measurements, as returned by run_stage
+def print_table(stages: dict):
+    print(f"\n{'Stage':16}{'Items':>8}{'Seconds':>10}{'Items/s':>10}{'MB/s':>8}")
+    for name, measured in stages.items():
+        print(f"{name:16}{measured['items']:>8}{measured['wall_seconds']:>10.2f}{measured['items_per_second']:>10.1f}"
+              f"{measured['megabytes_per_second']:>8.1f}")
+        for stage, latency in measured["latencies"].items():
+            print(f"\t{stage:18} n={latency['count']:<6} mean {latency['mean_seconds'] * 1000:8.1f} ms"
+                  f"\tp50 {latency['p50_seconds'] * 1000:8.1f} ms\tp95 {latency['p95_seconds'] * 1000:8.1f} ms"
+                  f"\tmax {latency['max_seconds'] * 1000:8.1f} ms")
+
+
+# Gets the installed version of the package, so saved results say which release they measured
+def package_version():
+    try:
+        return metadata.version("AcademicPaperGatherer")
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the pipeline against a local stub server")
+    parser.add_argument('--results', type=int, default=200, help='Results to scrape and gather from each source')
+    parser.add_argument('--papers', type=int, default=1000, help='Distinct papers the stub server holds')
+    parser.add_argument('--links', type=int, default=10, help='.pdf links on each landing page the server returns')
+    parser.add_argument('--concurrency', type=int, default=4, help='Results fetched at once while gathering files')
+    parser.add_argument('--workers', type=int, default=2, help='Processes to convert files with')
+    parser.add_argument('--pipeline', action='store_true', help='Also time a pipelined run of every stage at once')
+    parser.add_argument('--output', default=None, help='Path to save the measurements to as JSON')
+    args = parser.parse_args()
+
+    RateLimiter.enabled = False
+    measured = {}
+    with StubServer(papers=args.papers, links=args.links) as server, tempfile.TemporaryDirectory() as temp_dir:
+        ResultGatherer.base_url = f"{server.base_url}/scholar"
+        ArxivScraper.api_url = f"{server.base_url}/api/query"
+        directory = os.path.join(temp_dir, "output")
+        os.makedirs(directory)
+        DuplicateFilter.configure(os.path.join(temp_dir, "duplicates.sqlite3"))
+        NearDuplicateIndex.configure(os.path.join(temp_dir, "near_duplicates.sqlite3"))
+        print(f"Benchmarking {args.results} results from each source against the stub server at {server.base_url}")
+
+        scholar_results = []
+        arxiv_results = []
+        measured["scholar_scrape"] = run_stage(
+            "scholar_scrape", args.results,
+            lambda: scholar_results.extend(ResultGatherer().scrape_results(QUERY, args.results, None, None)))
+        measured["arxiv_scrape"] = run_stage(
+            "arxiv_scrape", args.results,
+            lambda: arxiv_results.extend(ArxivScraper().scrape_results(QUERY, args.results)))
+        measured["scholar_gather"] = run_stage(
+            "scholar_gather", len(scholar_results),
+            lambda: FileGatherer().gather_files(scholar_results, QUERY, directory, False, None, None,
+                                                args.concurrency))
+        measured["arxiv_gather"] = run_stage(
+            "arxiv_gather", len(arxiv_results),
+            lambda: ArxivScraper().gather_files(arxiv_results, QUERY, os.path.join(directory, "ArXiv"), False))
+        articles = len([name for name in os.listdir(os.path.join(directory, "Articles")) if name.endswith(".pdf")])
+        measured["convert"] = run_stage(
+            "convert", articles, lambda: TextConverterAndExtractor().convert_and_extract(directory, args.workers))
+
+        if args.pipeline:
+            pipeline_directory = os.path.join(temp_dir, "pipeline")
+            # Start over with empty indexes, or every paper would be a duplicate of one gathered above
+            DuplicateFilter.configure(os.path.join(temp_dir, "pipeline_duplicates.sqlite3"))
+            DuplicateFilter.file_digests = {}
+            NearDuplicateIndex.configure(os.path.join(temp_dir, "pipeline_near_duplicates.sqlite3"))
+            measured["pipeline"] = run_stage(
+                "pipeline", 2 * args.results,
+                lambda: Pipeline(QUERY, pipeline_directory, args.results, None, None, False, True, args.concurrency,
+                                 args.workers).run())
+
+    print_table(measured)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"version": package_version(), "python": platform.python_version(),
+                       "settings": vars(args), "stages": measured}, f, indent=2)
+        print(f"\nMeasurements saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
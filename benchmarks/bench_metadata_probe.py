@@ -0,0 +1,78 @@
+# Benchmark comparing the metadata probes of FileFilterer on large PDFs
+# Builds a set of many-page PDFs (or uses the PDFs in a given directory) and times how long each probe takes to read
+#   their document information
+# Usage: python benchmarks/bench_metadata_probe.py [directory of PDFs] [--pages N] [--files N] [--repeat N]
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pymupdf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from APG.FileFilterer import FileFilterer
+
+
+# Builds PDFs with many pages of text, similar in structure to long papers and theses
+    # @param directory : The directory to save the PDFs to
+    # @param files : How many PDFs to build
+    # @param pages : How many pages each PDF has
+def build_corpus(directory: str, files: int, pages: int):
+    for n in range(files):
+        doc = pymupdf.open()
+        for page_number in range(pages):
+            page = doc.new_page()
+            page.insert_text((72, 72), f"Paper {n} page {page_number}\n" + "Lorem ipsum dolor sit amet. " * 40)
+        doc.set_metadata({"title": f"Machine learning paper {n}", "author": "A. Author", "keywords": "ml",
+                          "modDate": "D:20240101000000"})
+        doc.save(os.path.join(directory, f"{n}.pdf"))
+        doc.close()
+
+
+# Times one probe over every file, reading each from memory like a downloaded file
+# Returns the best total time of all repeats, in seconds
+    # @param probe : The probe to time
+    # @param bodies : The bytes of every PDF
+    # @param repeat : How many times to repeat the run
+def time_probe(probe: str, bodies: list, repeat: int):
+    filterer = FileFilterer()
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for body in bodies:
+            meta = filterer.read_metadata(io.BytesIO(body), probe)
+            assert meta is not None and '/Title' in meta
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the pymupdf and PyPDF2 metadata probes")
+    parser.add_argument('directory', nargs='?', default=None, help='Directory of PDFs to use instead of built ones')
+    parser.add_argument('--files', type=int, default=10, help='How many PDFs to build')
+    parser.add_argument('--pages', type=int, default=2000, help='How many pages each built PDF has')
+    parser.add_argument('--repeat', type=int, default=3, help='How many times to repeat each probe')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        directory = args.directory
+        if directory is None:
+            directory = temp_dir
+            print(f"Building {args.files} PDFs with {args.pages} pages each...", flush=True)
+            build_corpus(directory, args.files, args.pages)
+        bodies = [p.read_bytes() for p in sorted(Path(directory).glob("*.pdf"))]
+
+    size = sum(len(body) for body in bodies) / (1024 * 1024)
+    print(f"{len(bodies)} PDFs, {size:.1f} MB in total")
+    results = {probe: time_probe(probe, bodies, args.repeat) for probe in ("pypdf2", "pymupdf")}
+    for probe, elapsed in results.items():
+        print(f"\t{probe:8} {elapsed * 1000:9.1f} ms total\t{elapsed / len(bodies) * 1000:8.2f} ms per file")
+    print(f"\tSpeedup: {results['pypdf2'] / results['pymupdf']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Benchmark comparing scoring papers one at a time with hybrid_match against score_batch
+# Builds a corpus of random titles and keywords (or reads the papers saved in an output directory) and
+#   scores it with both paths, checking that every score is identical
+# Usage: python benchmarks/bench_scoring.py [output directory] [--papers N] [--query QUERY]
+import argparse
+import ast
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from APG.FileFilterer import FileFilterer
+from APG.MetadataStore import MetadataStore
+
+WORDS = ("deep learning neural network graph transformer attention protein folding model vision language data "
+         "analysis survey method reinforcement optimization bayesian inference robust federated privacy").split()
+
+
+# Builds random (title, keywords) pairs shaped like the ones read from PDF metadata
+    # @param papers : How many pairs to build
+def build_corpus(papers: int):
+    generator = random.Random(0)
+    corpus = []
+    for _ in range(papers):
+        title = " ".join(generator.choice(WORDS) for _ in range(generator.randint(4, 14))).title()
+        keywords = ", ".join(generator.choice(WORDS) for _ in range(generator.randint(0, 6)))
+        corpus.append((title, [keywords]))
+    return corpus
+
+
+# Reads the (title, keywords) pairs of the papers saved in an output directory, from its metadata store if it has one
+    # @param directory : The output directory
+def read_corpus(directory: str):
+    store = MetadataStore()
+    if store.exists(directory):
+        return [(paper["title"], ast.literal_eval(paper["keywords"])) for paper in store.iter_papers(directory)
+                if paper["outcome"] == "saved"]
+    corpus = []
+    for title_path in sorted(Path(directory, "Titles").glob("*.txt")):
+        keywords_path = Path(directory, "Keywords", title_path.name)
+        keywords = ast.literal_eval(keywords_path.read_text(encoding="utf-8")) if keywords_path.exists() else [""]
+        corpus.append((title_path.read_text(encoding="utf-8"), keywords))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare scalar and batch relevance scoring")
+    parser.add_argument('directory', nargs='?', default=None, help='Output directory to score instead of a built one')
+    parser.add_argument('--papers', type=int, default=100000, help='How many papers to build')
+    parser.add_argument('--query', default="deep learning for protein folding", help='The query to score against')
+    args = parser.parse_args()
+
+    corpus = read_corpus(args.directory) if args.directory else build_corpus(args.papers)
+    filterer = FileFilterer()
+    print(f"Scoring {len(corpus)} papers against '{args.query}'")
+
+    start = time.perf_counter()
+    scalar = [filterer.hybrid_match(args.query, title, keywords) for title, keywords in corpus]
+    scalar_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = filterer.score_batch(filterer.compile_query(args.query), corpus)
+    batch_time = time.perf_counter() - start
+
+    mismatches = sum(1 for a, b in zip(scalar, batch) if a != b)
+    kept = sum(1 for score in batch if score >= FileFilterer.THRESHOLD)
+    print(f"\thybrid_match {scalar_time:8.2f} s\n\tscore_batch  {batch_time:8.2f} s"
+          f"\n\tSpeedup: {scalar_time / batch_time:.1f}x\n\tMismatched scores: {mismatches}"
+          f"\n\tPapers at or above THRESHOLD ({FileFilterer.THRESHOLD}): {kept}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+# Local HTTP server that stands in for Google Scholar, the ArXiv API, and publisher sites, for offline benchmarks
+# It serves synthetic Scholar result pages, ArXiv Atom feeds, landing pages full of .pdf links, and generated PDFs
+#   of several sizes, from its own process so serving never competes with the code being measured
+# Routes:
+#   /scholar?start=&num=&q=     Google Scholar result pages, in the .gs_r / .gs_rt / .gs_or_ggsm format
+#   /api/query?start=&max_results=    ArXiv API Atom feeds, whose entries link to /pdf/<n>
+#   /page/<n>                   Landing pages with many .pdf links, some of which are missing
+#   /paper/<n>.pdf, /pdf/<n>    Generated PDFs
+import multiprocessing
+import random
+import threading
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pymupdf
+
+WORDS = ("deep learning neural network graph transformer attention protein folding model vision language data "
+         "analysis survey method reinforcement optimization bayesian inference robust federated privacy").split()
+OFF_TOPIC = ("cooking recipe garden soil pottery glaze knitting pattern sourdough bread").split()
+
+
+# Synthetic corpus of papers the server answers from
+class Corpus:
+    # Method that makes up a title for every paper, from a fixed seed so every run serves the same corpus
+        # @param papers : How many distinct papers there are
+        # @param page_sizes : The page counts PDFs cycle through, so downloads come in several sizes
+        # @param relevant : The share of papers whose titles match the benchmark query
+    def __init__(self, papers: int, page_sizes: tuple, relevant: float):
+        generator = random.Random(0)
+        self.titles = []
+        for n in range(papers):
+            words = WORDS if generator.random() < relevant else OFF_TOPIC
+            self.titles.append(" ".join(generator.choice(words) for _ in range(8)).title() + f" {n}")
+        self.page_sizes = page_sizes
+        self.templates = {}  # Page count -> a PDF of filler pages, which each paper's PDF is built from
+        self.pdfs = {}  # Paper number -> PDF bytes
+
+    # Method that builds every paper's PDF up front, so building them never shows up in download latencies
+    def build_all(self):
+        generator = random.Random(1)
+        for pages in sorted(set(self.page_sizes)):
+            doc = pymupdf.open()
+            doc.new_page()  # The first page is filled in for each paper, since near-duplicates are found from it
+            for _ in range(pages - 1):
+                doc.new_page().insert_textbox(pymupdf.Rect(72, 72, 540, 760), self.__filler(generator), fontsize=8)
+            self.templates[pages] = doc.tobytes()
+            doc.close()
+        for n in range(len(self.titles)):
+            self.pdfs[n] = self.build_pdf(n)
+
+    # Method that makes up a page of filler text
+        # @param generator : The random number generator to draw words from
+    @staticmethod
+    def __filler(generator: random.Random):
+        return " ".join(f"{generator.choice(WORDS)}{generator.randrange(10 ** 6)}" for _ in range(400))
+
+    # Method that gets the PDF of a paper
+        # @param n : The number of the paper
+    def pdf(self, n: int):
+        return self.pdfs[n]
+
+    # Method that builds the PDF of a paper from a template of its size, with its own title, abstract, and metadata
+        # @param n : The number of the paper
+    def build_pdf(self, n: int):
+        doc = pymupdf.open(stream=self.templates[self.page_sizes[n % len(self.page_sizes)]])
+        doc[0].insert_text((72, 72), f"{self.titles[n]}\nAbstract\nThis paper studies {self.titles[n].lower()}."
+                                     f"\nIntroduction")
+        doc[0].insert_textbox(pymupdf.Rect(72, 150, 540, 760), self.__filler(random.Random(n)), fontsize=8)
+        doc.set_metadata({"title": self.titles[n], "author": f"Author {n}", "keywords": "deep learning, data",
+                          "modDate": "D:20230115000000"})
+        body = doc.tobytes()
+        doc.close()
+        return body
+
+    # Method that builds a Google Scholar result page -- even results link straight to a PDF, odd ones to a landing page
+        # @param start : The number of the first result
+        # @param num : How many results are on the page
+        # @param base : The base URL of the server
+    def scholar_page(self, start: int, num: int, base: str):
+        results = []
+        for n in range(start, min(start + num, len(self.titles))):
+            file_link = f'<div class="gs_or_ggsm"><a href="{base}/paper/{n}.pdf">[PDF]</a></div>' if n % 2 == 0 else ""
+            results.append(f'<div class="gs_r gs_or gs_scl">{file_link}<div class="gs_ri">'
+                           f'<h3 class="gs_rt"><a id="stub{n}" href="{base}/page/{n}">{escape(self.titles[n])}</a></h3>'
+                           f'<div class="gs_a">Author {n}\xa0- Stub Journal, 2023</div>'
+                           f'<div class="gs_rs">A study of {escape(self.titles[n].lower())}.</div></div></div>')
+        return f"<html><body><div id=\"gs_res_ccl_mid\">{''.join(results)}</div></body></html>"
+
+    # Method that builds an ArXiv API Atom feed -- entries start from the second half of the corpus, so the first
+    #   ArXiv results are not the same papers as the first Google Scholar results
+        # @param start : The number of the first result
+        # @param num : How many results are in the feed
+        # @param base : The base URL of the server
+    def arxiv_feed(self, start: int, num: int, base: str):
+        entries = []
+        half = len(self.titles) // 2
+        for n in (i % len(self.titles) for i in range(half + start, half + min(start + num, len(self.titles)))):
+            entries.append(f"<entry><id>{base}/abs/{n}</id><updated>2023-01-15T00:00:00Z</updated>"
+                           f"<published>2023-01-15T00:00:00Z</published><title>{escape(self.titles[n])}</title>"
+                           f"<summary>A study of {escape(self.titles[n].lower())}.</summary>"
+                           f"<author><name>Author {n}</name></author></entry>")
+        return ('<?xml version="1.0" encoding="UTF-8"?><feed xmlns="http://www.w3.org/2005/Atom">'
+                f"<title>Stub</title>{''.join(entries)}</feed>")
+
+    # Method that builds a landing page with links to the paper's PDF, related papers' PDFs, and PDFs that do not exist
+        # @param n : The number of the paper
+        # @param links : How many .pdf links the page holds
+        # @param base : The base URL of the server
+    def landing_page(self, n: int, links: int, base: str):
+        hrefs = [f"{base}/paper/{n}.pdf"]
+        for i in range(1, links):
+            hrefs.append(f"{base}/missing/{n}-{i}.pdf" if i % 3 == 0 else
+                         f"{base}/paper/{(n + i) % len(self.titles)}.pdf")
+        anchors = "".join(f'<li><a href="{href}">Download {i}</a></li>' for i, href in enumerate(hrefs))
+        return f"<html><body><h1>{escape(self.titles[n])}</h1><ul>{anchors}</ul></body></html>"
+
+
+# Handles every request from the corpus, with keep-alive connections like a real server
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    corpus = None
+    links = 10
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        base = f"http://{self.headers.get('Host')}"
+        corpus = self.corpus
+        try:
+            if url.path == "/scholar":
+                self.__send(200, "text/html; charset=utf-8",
+                            corpus.scholar_page(int(query["start"]), int(query["num"]), base).encode())
+            elif url.path == "/api/query":
+                self.__send(200, "application/atom+xml; charset=utf-8",
+                            corpus.arxiv_feed(int(query["start"]), int(query["max_results"]), base).encode())
+            elif url.path.startswith("/page/"):
+                self.__send(200, "text/html; charset=utf-8",
+                            corpus.landing_page(int(url.path[6:]), self.links, base).encode())
+            elif url.path.startswith("/paper/") and url.path.endswith(".pdf"):
+                self.__send(200, "application/pdf", corpus.pdf(int(url.path[7:-4])))
+            elif url.path.startswith("/pdf/"):
+                self.__send(200, "application/pdf", corpus.pdf(int(url.path[5:])))
+            else:
+                self.__send(404, "text/plain", b"Not found")
+        except (KeyError, ValueError, IndexError):
+            self.__send(400, "text/plain", b"Bad request")
+
+    def __send(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Server that stays quiet when a client hangs up mid-response, as benchmarks do when they abandon a download
+class StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+# Serves the corpus until the parent process closes the pipe
+    # @param connection : The pipe the chosen port is sent back through
+    # @param papers : How many distinct papers there are
+    # @param page_sizes : The page counts PDFs cycle through
+    # @param relevant : The share of papers whose titles match the benchmark query
+    # @param links : How many .pdf links each landing page holds
+def serve(connection, papers: int, page_sizes: tuple, relevant: float, links: int):
+    corpus = Corpus(papers, page_sizes, relevant)
+    corpus.build_all()
+    StubHandler.corpus = corpus
+    StubHandler.links = links
+    server = StubHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection.send(server.server_address[1])
+    try:
+        connection.recv()  # Blocks until the parent asks to stop, or goes away
+    except EOFError:
+        pass
+    server.shutdown()
+
+
+# Runs the stub server in its own process
+class StubServer:
+    # Method that sets up the corpus the server will answer from
+        # @param papers : How many distinct papers there are
+        # @param page_sizes : The page counts PDFs cycle through, so downloads come in several sizes
+        # @param relevant : The share of papers whose titles match the benchmark query
+        # @param links : How many .pdf links each landing page holds
+    def __init__(self, papers: int = 1000, page_sizes: tuple = (1, 4, 12, 40), relevant: float = 0.8,
+                 links: int = 10):
+        self.settings = (papers, page_sizes, relevant, links)
+        self.process = None
+        self.connection = None
+        self.base_url = None
+
+    # Method that starts the server process and returns its base URL
+    def start(self):
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve, args=(child, *self.settings), daemon=True)
+        self.process.start()
+        self.base_url = f"http://127.0.0.1:{self.connection.recv()}"
+        return self.base_url
+
+    # Method that stops the server process
+    def stop(self):
+        if self.process is not None:
+            self.connection.send("stop")
+            self.process.join(timeout=5)
+            self.process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()